@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""Cold start benchmark of the CLI.
+Every round starts a new interpreter that parses a teardown command line
+the way main.py does, i.e. everything up to the first teardown step, and
+reports the wall-clock time. A last run lists the modules loaded by then,
+and the benchmark fails when one of the --forbid modules (the AWS SDK by
+default) is among them or, with --max_seconds, on a slow start.
+Nothing is called, no credentials are needed.
+"""
+
+# Standard Packages
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Loaded by the steps only, never at the start
+FORBIDDEN_MODULES = ("boto3", "botocore", "s3transfer")
+
+# Up to the first step of main.py
+STARTUP = """
+import json
+import sys
+sys.path.insert(0, {src!r})
+import main
+main.parse_args({argv!r})
+print(json.dumps(sorted(sys.modules)))
+"""
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+
+def run_round(argv):
+    """Start the CLI in a new interpreter.
+
+    :args:
+        argv (of main.py)
+    :return:
+        (wall-clock seconds, names of the loaded modules)
+    """
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c",
+         STARTUP.format(src=os.path.abspath(SRC_DIR), argv=argv)],
+        stdout=subprocess.PIPE, check=True, universal_newlines=True,
+    ).stdout
+    return time.perf_counter() - started, json.loads(output.splitlines()[-1])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument(
+        "--argv", nargs=argparse.REMAINDER,
+        default=["--vpc_id", "vpc-0123456789abcdef0", "--region", "us-east-1"],
+        help="The main.py command line, last"
+    )
+    parser.add_argument(
+        "--forbid", nargs="*", default=list(FORBIDDEN_MODULES),
+        help="Fail when one of these modules is loaded at the start"
+    )
+    parser.add_argument("--output", metavar="FILE",
+                        help="Write the results as JSON to the FILE")
+    parser.add_argument(
+        "--max_seconds", type=float,
+        help="Fail when the median cold start is above this"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Run the benchmark rounds.
+
+    :args:
+        argv
+    :return:
+        exit code
+    """
+    args = parse_args(argv)
+    rounds = [run_round(args.argv) for _ in range(args.rounds)]
+    seconds = [round(wall, 3) for wall, _ in rounds]
+    modules = rounds[-1][1]
+    median = round(statistics.median(seconds), 3)
+    LOGGER.info(f"Cold start of main.py {' '.join(args.argv)}: median "
+                f"{median}s, min {min(seconds)}s, max {max(seconds)}s, "
+                f"{len(modules)} modules loaded")
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump({"args": vars(args), "seconds": seconds,
+                       "median": median, "modules": modules}, out, indent=2)
+
+    failures = [f"{module} is loaded before the first step"
+                for module in args.forbid if module in modules]
+    if args.max_seconds is not None and median > args.max_seconds:
+        failures.append(f"cold start {median}s > {args.max_seconds}s")
+    for failure in failures:
+        LOGGER.error(f"Benchmark regression: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
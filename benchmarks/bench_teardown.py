@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+"""Offline benchmark of the teardown pipeline.
+Synthetic VPCs of a configurable size are created in a moto backed fake
+AWS (subnets, ENIs, security groups with cross-group rules, NAT gateways,
+peering connections and TGW attachments) and torn down by the same calls
+main.py makes:
+    1. teardown_vpc() of every vpc (batch_runner when there are several)
+    2. cleanup_regions() with the customer and transit gateway ids
+    3. cleanup_account() for the S3 buckets
+Every round reports the wall-clock time, the API calls (per operation with
+--verbose), the time spent waiting and the peak memory (tracemalloc).
+With --max_seconds/--max_api_calls the benchmark fails on a regression.
+Nothing leaves the machine, the credentials are fake.
+"""
+
+# Standard Packages
+import argparse
+import contextlib
+import importlib
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+REGION = "us-east-1"
+PROFILE = "bench"
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+
+def fake_credentials():
+    """Point boto3 at a throwaway profile, before the modules are imported.
+    """
+    credentials = tempfile.NamedTemporaryFile(
+        "w", prefix="bench_credentials", delete=False
+    )
+    with credentials:
+        credentials.write(f"[{PROFILE}]\n"
+                          "aws_access_key_id = testing\n"
+                          "aws_secret_access_key = testing\n")
+    os.environ.update(
+        AWS_SHARED_CREDENTIALS_FILE=credentials.name,
+        AWS_CONFIG_FILE=os.devnull,
+        AWS_PROFILE=PROFILE,
+        AWS_DEFAULT_REGION=REGION,
+    )
+    return credentials.name
+
+
+def mock_aws():
+    """The moto mock of every service the teardown touches.
+    """
+    try:
+        from moto import mock_aws as mock
+        return mock()
+    except ImportError:
+        # moto < 5 has a mock per service
+        from moto import mock_dynamodb, mock_ec2, mock_s3, mock_sts
+        stack = contextlib.ExitStack()
+        for mock in (mock_ec2, mock_s3, mock_dynamodb, mock_sts):
+            stack.enter_context(mock())
+        return stack
+
+
+def create_vpc(ec2_client, index, args, tgw_id=None):
+    """Create a vpc with all the dependencies of the given sizes.
+
+    :args:
+        ec2_client, index, args, tgw_id
+    :return:
+        vpc_id
+    """
+    vpc_id = ec2_client.create_vpc(
+        CidrBlock=f"10.{index}.0.0/16"
+    )["Vpc"]["VpcId"]
+    subnets = [
+        ec2_client.create_subnet(
+            VpcId=vpc_id, CidrBlock=f"10.{index}.{number}.0/24",
+        )["Subnet"]["SubnetId"]
+        for number in range(max(1, args.subnets))
+    ]
+
+    igw_id = ec2_client.create_internet_gateway(
+    )["InternetGateway"]["InternetGatewayId"]
+    ec2_client.attach_internet_gateway(InternetGatewayId=igw_id, VpcId=vpc_id)
+    route_table_id = ec2_client.create_route_table(
+        VpcId=vpc_id
+    )["RouteTable"]["RouteTableId"]
+    ec2_client.create_route(RouteTableId=route_table_id,
+                            DestinationCidrBlock="0.0.0.0/0",
+                            GatewayId=igw_id)
+    for subnet_id in subnets:
+        ec2_client.associate_route_table(RouteTableId=route_table_id,
+                                         SubnetId=subnet_id)
+
+    for number in range(args.nat_gateways):
+        allocation_id = ec2_client.allocate_address(
+            Domain="vpc"
+        )["AllocationId"]
+        ec2_client.create_nat_gateway(
+            SubnetId=subnets[number % len(subnets)],
+            AllocationId=allocation_id,
+        )
+
+    for number in range(args.enis):
+        ec2_client.create_network_interface(
+            SubnetId=subnets[number % len(subnets)]
+        )
+
+    groups = [
+        ec2_client.create_security_group(
+            GroupName=f"bench-{index}-{number}", Description="benchmark",
+            VpcId=vpc_id,
+        )["GroupId"]
+        for number in range(args.security_groups)
+    ]
+    # Every group references the next one, the last one closes the cycle
+    for number, group_id in enumerate(groups):
+        permissions = [
+            {"IpProtocol": "tcp", "FromPort": 1000 + rule,
+             "ToPort": 1000 + rule, "IpRanges": [{"CidrIp": "10.0.0.0/8"}]}
+            for rule in range(args.rules)
+        ]
+        if len(groups) > 1:
+            permissions.append({
+                "IpProtocol": "tcp", "FromPort": 443, "ToPort": 443,
+                "UserIdGroupPairs": [
+                    {"GroupId": groups[(number + 1) % len(groups)]}
+                ],
+            })
+        if permissions:
+            ec2_client.authorize_security_group_ingress(
+                GroupId=group_id, IpPermissions=permissions,
+            )
+
+    for number in range(args.peerings):
+        peer_id = ec2_client.create_vpc(
+            CidrBlock=f"172.{16 + number % 16}.{index}.0/24"
+        )["Vpc"]["VpcId"]
+        ec2_client.create_vpc_peering_connection(VpcId=vpc_id,
+                                                 PeerVpcId=peer_id)
+
+    if tgw_id:
+        for number in range(args.tgw_attachments):
+            ec2_client.create_transit_gateway_vpc_attachment(
+                TransitGatewayId=tgw_id, VpcId=vpc_id,
+                SubnetIds=[subnets[number % len(subnets)]],
+            )
+    return vpc_id
+
+
+def create_account(args):
+    """Create the synthetic vpcs and the region and account leftovers.
+
+    :args:
+        args
+    :return:
+        (vpc ids, customer gateway ids, transit gateway ids)
+    """
+    import boto3
+
+    ec2_client = boto3.client("ec2", region_name=REGION)
+    tgw_ids = []
+    if args.tgw_attachments:
+        tgw_ids.append(ec2_client.create_transit_gateway(
+        )["TransitGateway"]["TransitGatewayId"])
+    cust_gw_ids = [ec2_client.create_customer_gateway(
+        BgpAsn=65000, PublicIp="203.0.113.1", Type="ipsec.1",
+    )["CustomerGateway"]["CustomerGatewayId"]]
+    vpc_ids = [
+        create_vpc(ec2_client, index + 1, args,
+                   tgw_ids[0] if tgw_ids else None)
+        for index in range(args.vpcs)
+    ]
+
+    s3_client = boto3.client("s3", region_name=REGION)
+    for number in range(args.buckets):
+        bucket = f"bench-teardown-{number}"
+        s3_client.create_bucket(Bucket=bucket)
+        for key in range(args.objects):
+            s3_client.put_object(Bucket=bucket, Key=f"key-{key}", Body=b"x")
+    return vpc_ids, cust_gw_ids, tgw_ids
+
+
+def teardown(vpc_ids, cust_gw_ids, tgw_ids, args):
+    """The teardown pipeline of main.py, without the argument parsing.
+    """
+    import batch_runner
+    import main
+
+    if len(vpc_ids) == 1:
+        main.teardown_vpc(vpc_ids[0], REGION, max_workers=args.max_workers)
+    else:
+        jobs = batch_runner.run_batch(
+            [batch_runner.BatchJob(vpc_id, REGION) for vpc_id in vpc_ids],
+            lambda job: main.teardown_vpc(job.vpc_id, job.aws_region,
+                                          max_workers=args.max_workers),
+            max_jobs=args.max_jobs, max_jobs_per_region=args.max_jobs,
+        )
+        failed = [job for job in jobs if job.status != "done"]
+        if failed:
+            raise RuntimeError(f"{len(failed)} vpc teardown(s) failed: "
+                               f"{failed[0].error}")
+    if not main.cleanup_regions({REGION}, cust_gw_ids, tgw_ids):
+        raise RuntimeError("The region cleanup failed")
+    main.cleanup_account({REGION}, argparse.Namespace(s3_prefix=None,
+                                                      s3_tag=None))
+
+
+def run_round(args):
+    """Create the account, tear it down and measure the teardown only.
+
+    :args:
+        args
+    :return:
+        dict
+    """
+    import aws_rate_limiter
+    import s3_bucket_index
+    import teardown_metrics
+
+    with mock_aws():
+        vpc_ids, cust_gw_ids, tgw_ids = create_account(args)
+        s3_bucket_index.drop_index()
+        teardown_metrics.reset()
+        aws_rate_limiter.get_limiter().reset()
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            teardown(vpc_ids, cust_gw_ids, tgw_ids, args)
+        finally:
+            wall = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        summary = teardown_metrics.get_metrics().summary()
+        return {
+            "wall_seconds": round(wall, 3),
+            "api_calls": summary["api_calls"],
+            "wait_seconds": summary["wait_seconds"],
+            "queued_seconds": round(sum(
+                totals["queued_seconds"] for totals in
+                aws_rate_limiter.get_limiter().report().values()), 3),
+            "peak_memory_bytes": peak,
+            "operations": {
+                operation: values["calls"]
+                for operation, values in summary["operations"].items()
+            },
+            "phases": {
+                f"{phase['run']} {phase['phase']}": phase["seconds"]
+                for phase in summary["phases"]
+            },
+        }
+
+
+def report(rounds, args, stream=None):
+    """Print the per-round results and the median.
+
+    :args:
+        rounds, args, stream (defaults to stdout)
+    :return:
+        dict of the medians
+    """
+    stream = stream or sys.stdout
+    columns = ("wall_seconds", "api_calls", "wait_seconds",
+               "queued_seconds", "peak_memory_bytes")
+    stream.write(f"\nvpcs={args.vpcs} subnets={args.subnets} "
+                 f"enis={args.enis} security_groups={args.security_groups} "
+                 f"rules={args.rules} nat_gateways={args.nat_gateways} "
+                 f"peerings={args.peerings} "
+                 f"tgw_attachments={args.tgw_attachments} "
+                 f"buckets={args.buckets} objects={args.objects}\n")
+    stream.write(f"{'round':<8}" + "".join(f"{name:>19}" for name in columns)
+                 + "\n")
+    for number, result in enumerate(rounds, 1):
+        stream.write(f"{number:<8}" + "".join(
+            f"{result[name]:>19}" for name in columns) + "\n")
+    medians = {
+        name: round(statistics.median(result[name] for result in rounds), 3)
+        for name in columns
+    }
+    stream.write(f"{'median':<8}" + "".join(
+        f"{medians[name]:>19}" for name in columns) + "\n")
+    if args.verbose:
+        stream.write("\nAPI calls of the last round:\n")
+        for operation, calls in sorted(rounds[-1]["operations"].items(),
+                                       key=lambda item: -item[1]):
+            stream.write(f"  {operation:<48} {calls:>6}\n")
+        stream.write("\nPhases of the last round (seconds):\n")
+        for phase, seconds in sorted(rounds[-1]["phases"].items()):
+            stream.write(f"  {phase:<64} {seconds:>8.3f}\n")
+    return medians
+
+
+def parse_args(argv):
+    """Parse the synthetic account sizes and the benchmark options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the teardown pipeline"
+    )
+    sizes = parser.add_argument_group("account size arguments")
+    sizes.add_argument("--vpcs", type=int, default=1)
+    sizes.add_argument("--subnets", type=int, default=6)
+    sizes.add_argument("--enis", type=int, default=12)
+    sizes.add_argument("--security_groups", type=int, default=8)
+    sizes.add_argument("--rules", type=int, default=4,
+                       help="CIDR rules per security group")
+    sizes.add_argument("--nat_gateways", type=int, default=2)
+    sizes.add_argument("--peerings", type=int, default=2)
+    sizes.add_argument("--tgw_attachments", type=int, default=1)
+    sizes.add_argument("--buckets", type=int, default=2)
+    sizes.add_argument("--objects", type=int, default=50,
+                       help="Objects per S3 bucket")
+
+    bench = parser.add_argument_group("benchmark arguments")
+    bench.add_argument("--rounds", type=int, default=3)
+    bench.add_argument(
+        "--warmup", type=int, default=1,
+        help="Unreported rounds first, to load the botocore and moto models"
+    )
+    bench.add_argument("--max_workers", type=int, default=None)
+    bench.add_argument("--max_jobs", type=int, default=4)
+    bench.add_argument(
+        "--no_rate_limiter", action="store_true",
+        help="Leave the client-side rate limiter out of the measurement"
+    )
+    bench.add_argument("--output", metavar="FILE",
+                       help="Write the results as JSON to the FILE")
+    bench.add_argument(
+        "--max_seconds", type=float,
+        help="Fail when the median wall-clock time is above this"
+    )
+    bench.add_argument(
+        "--max_api_calls", type=int,
+        help="Fail when the median number of API calls is above this"
+    )
+    bench.add_argument("--verbose", action="store_true",
+                       help="Show the calls and phases of the last round")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Run the benchmark rounds.
+
+    :args:
+        argv
+    :return:
+        exit code
+    """
+    args = parse_args(argv)
+    credentials = fake_credentials()
+    sys.path.insert(0, os.path.abspath(SRC_DIR))
+    # Imported up front, so the import time and memory stay out of the
+    # measured rounds
+    import aws_rate_limiter
+    importlib.import_module("main")
+
+    if args.no_rate_limiter:
+        aws_rate_limiter.ENABLED = False
+    if not args.verbose:
+        logging.getLogger("root").setLevel(logging.WARNING)
+    for name in ("botocore", "boto3", "urllib3", "moto"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    try:
+        for _ in range(args.warmup):
+            run_round(args)
+        rounds = [run_round(args) for _ in range(args.rounds)]
+    finally:
+        os.remove(credentials)
+    medians = report(rounds, args)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump({"args": vars(args), "rounds": rounds,
+                       "median": medians}, out, indent=2)
+
+    failures = []
+    if args.max_seconds is not None and \
+            medians["wall_seconds"] > args.max_seconds:
+        failures.append(f"wall-clock time {medians['wall_seconds']}s > "
+                        f"{args.max_seconds}s")
+    if args.max_api_calls is not None and \
+            medians["api_calls"] > args.max_api_calls:
+        failures.append(f"{medians['api_calls']} API calls > "
+                        f"{args.max_api_calls}")
+    for failure in failures:
+        LOGGER.error(f"Benchmark regression: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+"""Streaming, paginated discovery of the VPC resources.
+Every describe_* call goes through a botocore paginator (where the API has
+one), and each result is turned into a compact __slots__ record that only
+holds the fields the teardown needs. Records are yielded page by page, so
+memory stays flat on VPCs with 10k+ ENIs and the consumer can start working
+on the first page while the later pages are still loading.
+"""
+
+# Standard Packages
+import logging
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Largest MaxResults accepted by each paginated describe call
+PAGE_SIZES = {
+    "describe_instances": 1000,
+    "describe_network_interfaces": 1000,
+    "describe_nat_gateways": 1000,
+    "describe_vpc_endpoints": 1000,
+    "describe_security_groups": 1000,
+    "describe_vpc_peering_connections": 1000,
+    "describe_transit_gateway_vpc_attachments": 1000,
+    "describe_route_tables": 100,
+    "describe_subnets": 1000,
+    "describe_network_acls": 1000,
+    "describe_internet_gateways": 1000,
+    "list_tables": 100,
+}
+
+# States of the VPC peering connections that still have to be deleted, the
+# other ones (deleting, deleted, rejected, failed, expired) are closed
+PEERING_OPEN_STATES = ("initiating-request", "pending-acceptance",
+                       "provisioning", "active")
+
+
+class Record(object):
+    """Base class of the compact resource records.
+    """
+    __slots__ = ("resource_id", "vpc_id", "state")
+    kind = None
+
+    def __init__(self, resource_id, vpc_id=None, state=None):
+        self.resource_id = resource_id
+        self.vpc_id = vpc_id
+        self.state = state
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.resource_id}, {self.state})"
+
+
+class InstanceRecord(Record):
+    __slots__ = ()
+    kind = "instances"
+
+
+class NetworkInterfaceRecord(Record):
+    __slots__ = ("subnet_id", "interface_type", "requester_managed",
+                 "attachment_id", "attachment_status", "instance_id",
+                 "allocation_id")
+    kind = "network_interfaces"
+
+
+class NatGatewayRecord(Record):
+    __slots__ = ("allocation_ids", "network_interface_ids")
+    kind = "nat_gateways"
+
+
+class AddressRecord(Record):
+    __slots__ = ("public_ip", "association_id", "network_interface_id")
+    kind = "addresses"
+
+
+class VpcEndpointRecord(Record):
+    __slots__ = ("endpoint_type", "network_interface_ids")
+    kind = "vpc_endpoints"
+
+
+class SecurityGroupRecord(Record):
+    __slots__ = ("group_name", "ip_permissions", "ip_permissions_egress")
+    kind = "security_groups"
+
+
+class PeeringRecord(Record):
+    __slots__ = ("requester_vpc_id", "accepter_vpc_id")
+    kind = "vpc_peering_connections"
+
+
+class VpnGatewayRecord(Record):
+    __slots__ = ()
+    kind = "vpn_gateways"
+
+
+class VpnConnectionRecord(Record):
+    __slots__ = ("vpn_gateway_id", "customer_gateway_id",
+                 "transit_gateway_id")
+    kind = "vpn_connections"
+
+
+class TgwAttachmentRecord(Record):
+    __slots__ = ("transit_gateway_id",)
+    kind = "transit_gateway_vpc_attachments"
+
+
+class RouteTableRecord(Record):
+    # associations: (association_id, main, subnet_id)
+    # routes: (destination_cidr_block, origin)
+    __slots__ = ("associations", "routes")
+    kind = "route_tables"
+
+
+class SubnetRecord(Record):
+    __slots__ = ()
+    kind = "subnets"
+
+
+class NetworkAclRecord(Record):
+    __slots__ = ("is_default",)
+    kind = "network_acls"
+
+
+class InternetGatewayRecord(Record):
+    __slots__ = ()
+    kind = "internet_gateways"
+
+
+def iter_items(client, operation, result_key, **kwargs):
+    """Yield the items of a describe call, one page at a time.
+
+    :args:
+        client, operation, result_key, describe kwargs
+    :return:
+        generator of response items
+    """
+    if client.can_paginate(operation):
+        page_size = PAGE_SIZES.get(operation)
+        config = {"PageSize": page_size} if page_size else {}
+        pages = client.get_paginator(operation).paginate(
+            PaginationConfig=config, **kwargs
+        )
+    else:
+        pages = [getattr(client, operation)(**kwargs)]
+    for page in pages:
+        for item in page.get(result_key, []):
+            yield item
+
+
+def _vpc_filter(name, vpc_id):
+    return [{"Name": name, "Values": [vpc_id]}]
+
+
+def _attached_vpc(attachments):
+    for attachment in attachments:
+        if attachment["State"] in ("attaching", "attached", "available"):
+            return attachment["VpcId"]
+    return None
+
+
+def iter_instances(ec2_client, vpc_id):
+    for res in iter_items(ec2_client, "describe_instances", "Reservations",
+                          Filters=_vpc_filter("vpc-id", vpc_id)):
+        for ins in res["Instances"]:
+            yield InstanceRecord(ins["InstanceId"], ins.get("VpcId"),
+                                 ins["State"]["Name"])
+
+
+def network_interface_record(eni):
+    record = NetworkInterfaceRecord(eni["NetworkInterfaceId"],
+                                    eni.get("VpcId"), eni["Status"])
+    attachment = eni.get("Attachment", {})
+    record.subnet_id = eni.get("SubnetId")
+    record.interface_type = eni.get("InterfaceType", "interface")
+    record.requester_managed = eni.get("RequesterManaged", False)
+    record.attachment_id = attachment.get("AttachmentId")
+    record.attachment_status = attachment.get("Status")
+    record.instance_id = attachment.get("InstanceId")
+    record.allocation_id = eni.get("Association", {}).get("AllocationId")
+    return record
+
+
+def iter_network_interfaces(ec2_client, vpc_id):
+    for eni in iter_items(ec2_client, "describe_network_interfaces",
+                          "NetworkInterfaces",
+                          Filters=_vpc_filter("vpc-id", vpc_id)):
+        yield network_interface_record(eni)
+
+
+def iter_nat_gateways(ec2_client, vpc_id):
+    for nat_gw in iter_items(ec2_client, "describe_nat_gateways",
+                             "NatGateways",
+                             Filter=_vpc_filter("vpc-id", vpc_id)):
+        record = NatGatewayRecord(nat_gw["NatGatewayId"],
+                                  nat_gw.get("VpcId"), nat_gw["State"])
+        addresses = nat_gw.get("NatGatewayAddresses", [])
+        record.allocation_ids = tuple(
+            addr["AllocationId"] for addr in addresses
+            if "AllocationId" in addr
+        )
+        record.network_interface_ids = tuple(
+            addr["NetworkInterfaceId"] for addr in addresses
+            if "NetworkInterfaceId" in addr
+        )
+        yield record
+
+
+def iter_addresses(ec2_client, vpc_id):
+    # EIPs don't carry a vpc-id, they're mapped through their ENI
+    for eip in iter_items(ec2_client, "describe_addresses", "Addresses",
+                          Filters=[{"Name": "domain", "Values": ["vpc"]}]):
+        record = AddressRecord(eip["AllocationId"])
+        record.public_ip = eip.get("PublicIp")
+        record.association_id = eip.get("AssociationId")
+        record.network_interface_id = eip.get("NetworkInterfaceId")
+        yield record
+
+
+def iter_vpc_endpoints(ec2_client, vpc_id):
+    for ep in iter_items(ec2_client, "describe_vpc_endpoints",
+                         "VpcEndpoints",
+                         Filters=_vpc_filter("vpc-id", vpc_id)):
+        record = VpcEndpointRecord(ep["VpcEndpointId"], ep.get("VpcId"),
+                                   ep.get("State"))
+        record.endpoint_type = ep.get("VpcEndpointType")
+        record.network_interface_ids = tuple(ep.get("NetworkInterfaceIds", []))
+        yield record
+
+
+def security_group_record(sg):
+    record = SecurityGroupRecord(sg["GroupId"], sg.get("VpcId"))
+    record.group_name = sg["GroupName"]
+    record.ip_permissions = sg.get("IpPermissions", [])
+    record.ip_permissions_egress = sg.get("IpPermissionsEgress", [])
+    return record
+
+
+def iter_security_groups(ec2_client, vpc_id):
+    for sg in iter_items(ec2_client, "describe_security_groups",
+                         "SecurityGroups",
+                         Filters=_vpc_filter("vpc-id", vpc_id)):
+        yield security_group_record(sg)
+
+
+def peering_record(peering):
+    record = PeeringRecord(peering["VpcPeeringConnectionId"],
+                           state=peering["Status"]["Code"])
+    record.requester_vpc_id = peering["RequesterVpcInfo"].get("VpcId")
+    record.accepter_vpc_id = peering["AccepterVpcInfo"].get("VpcId")
+    return record
+
+
+def iter_vpc_peering_connections(ec2_client, vpc_id):
+    # The filters are ANDed, so both sides come from one pass over the open
+    # peerings of the region instead of a requester and an accepter query
+    for peering in iter_items(ec2_client, "describe_vpc_peering_connections",
+                              "VpcPeeringConnections",
+                              Filters=[{"Name": "status-code",
+                                        "Values": list(PEERING_OPEN_STATES)}]):
+        record = peering_record(peering)
+        if record.state in PEERING_OPEN_STATES and vpc_id in (
+                record.requester_vpc_id, record.accepter_vpc_id):
+            record.vpc_id = vpc_id
+            yield record
+
+
+def iter_vpn_gateways(ec2_client, vpc_id):
+    for vpn_gw in iter_items(ec2_client, "describe_vpn_gateways",
+                             "VpnGateways",
+                             Filters=_vpc_filter("attachment.vpc-id", vpc_id)):
+        yield VpnGatewayRecord(vpn_gw["VpnGatewayId"],
+                               _attached_vpc(vpn_gw.get("VpcAttachments", [])),
+                               vpn_gw["State"])
+
+
+def vpn_connection_record(vpn_con, vpc_id=None):
+    record = VpnConnectionRecord(vpn_con["VpnConnectionId"], vpc_id,
+                                 vpn_con["State"])
+    record.vpn_gateway_id = vpn_con.get("VpnGatewayId")
+    record.customer_gateway_id = vpn_con.get("CustomerGatewayId")
+    record.transit_gateway_id = vpn_con.get("TransitGatewayId")
+    return record
+
+
+def iter_vpn_connections(ec2_client, vpn_gw_ids, vpc_id=None):
+    if not vpn_gw_ids:
+        return
+    for vpn_con in iter_items(
+            ec2_client, "describe_vpn_connections", "VpnConnections",
+            Filters=[{"Name": "vpn-gateway-id", "Values": list(vpn_gw_ids)}]):
+        yield vpn_connection_record(vpn_con, vpc_id)
+
+
+def iter_transit_gateway_vpc_attachments(ec2_client, vpc_id):
+    for attach in iter_items(ec2_client,
+                             "describe_transit_gateway_vpc_attachments",
+                             "TransitGatewayVpcAttachments",
+                             Filters=_vpc_filter("vpc-id", vpc_id)):
+        record = TgwAttachmentRecord(attach["TransitGatewayAttachmentId"],
+                                     attach.get("VpcId"), attach["State"])
+        record.transit_gateway_id = attach.get("TransitGatewayId")
+        yield record
+
+
+def iter_route_tables(ec2_client, vpc_id):
+    for route_table in iter_items(ec2_client, "describe_route_tables",
+                                  "RouteTables",
+                                  Filters=_vpc_filter("vpc-id", vpc_id)):
+        record = RouteTableRecord(route_table["RouteTableId"],
+                                  route_table.get("VpcId"))
+        record.associations = tuple(
+            (assoc["RouteTableAssociationId"], assoc.get("Main", False),
+             assoc.get("SubnetId"))
+            for assoc in route_table.get("Associations", [])
+        )
+        record.routes = tuple(
+            (route["DestinationCidrBlock"], route.get("Origin"))
+            for route in route_table.get("Routes", [])
+            if "DestinationCidrBlock" in route
+        )
+        yield record
+
+
+def iter_subnets(ec2_client, vpc_id):
+    for subnet in iter_items(ec2_client, "describe_subnets", "Subnets",
+                             Filters=_vpc_filter("vpc-id", vpc_id)):
+        yield SubnetRecord(subnet["SubnetId"], subnet.get("VpcId"),
+                           subnet.get("State"))
+
+
+def iter_network_acls(ec2_client, vpc_id):
+    for netacl in iter_items(ec2_client, "describe_network_acls",
+                             "NetworkAcls",
+                             Filters=_vpc_filter("vpc-id", vpc_id)):
+        record = NetworkAclRecord(netacl["NetworkAclId"], netacl.get("VpcId"))
+        record.is_default = netacl.get("IsDefault", False)
+        yield record
+
+
+def iter_internet_gateways(ec2_client, vpc_id):
+    for igw in iter_items(ec2_client, "describe_internet_gateways",
+                          "InternetGateways",
+                          Filters=_vpc_filter("attachment.vpc-id", vpc_id)):
+        yield InternetGatewayRecord(
+            igw["InternetGatewayId"],
+            _attached_vpc(igw.get("Attachments", [])),
+        )
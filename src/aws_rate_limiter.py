@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""Client-side rate controller shared by every EC2 client of the process.
+Every request waits for a token of its API action family (describe, mutate
+or delete) in its region before it's sent, so parallel teardowns stay
+within the account's API limits instead of hitting RequestLimitExceeded.
+The buckets adapt to the throttle responses: the refill rate is cut when a
+call is throttled and slowly recovers on every success. The time spent
+waiting for a token (queueing delay) is reported per family.
+The throttled calls themselves are retried by botocore, see aws_session.
+The buckets refill and wait on the teardown_clock.
+"""
+
+# Standard Packages
+import logging
+import os
+import threading
+
+# Local imports
+import teardown_clock
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Set TEARDOWN_RATE_LIMITER=0 to send the requests without waiting
+ENABLED = os.environ.get("TEARDOWN_RATE_LIMITER", "1") != "0"
+
+# Services whose calls are rate limited
+RATE_LIMITED_SERVICES = ("ec2",)
+
+# (refill rate per second, bucket size) of every action family, after the
+# EC2 request token buckets
+RATES = {
+    "describe": (20.0, 100),
+    "mutate": (5.0, 200),
+    "delete": (5.0, 200),
+}
+
+# Adaptive rate: multiplicative decrease on a throttle, additive increase
+# on a success, never below MIN_RATE
+DECREASE_FACTOR = 0.7
+INCREASE_STEP = 0.05
+MIN_RATE = 0.5
+
+# Error codes of the throttled calls
+THROTTLE_CODES = (
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "SlowDown",
+)
+
+DESCRIBE_PREFIXES = ("Describe", "Get", "List", "Search")
+DELETE_PREFIXES = ("Delete", "Release", "Terminate", "Detach",
+                   "Disassociate", "Revoke", "Reject")
+
+
+def action_family(operation):
+    """The token bucket family of the API action.
+
+    :args:
+        operation (i.e. "DescribeVpcs")
+    :return:
+        "describe", "mutate" or "delete"
+    """
+    if operation.startswith(DESCRIBE_PREFIXES):
+        return "describe"
+    if operation.startswith(DELETE_PREFIXES):
+        return "delete"
+    return "mutate"
+
+
+class TokenBucket(object):
+    """Token bucket with an adaptive refill rate. A token is reserved
+    straight away and the caller sleeps outside of the lock until it's due,
+    so the waiting callers are served in order.
+
+    :args:
+        rate, burst
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = teardown_clock.get_clock().monotonic()
+        self.calls = 0
+        self.throttled = 0
+        self.queued = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token, waiting until one is available.
+
+        :return:
+            the queueing delay in seconds
+        """
+        with self._lock:
+            self._refill(teardown_clock.get_clock().monotonic())
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.calls += 1
+            self.queued += delay
+            self.max_wait = max(self.max_wait, delay)
+        if delay > 0:
+            teardown_clock.get_clock().sleep(delay)
+        return delay
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill(teardown_clock.get_clock().monotonic())
+            self.throttled += 1
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            # Drop the burst, the account is already at its limit
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(teardown_clock.get_clock().monotonic())
+                self.rate = min(self.max_rate, self.rate + INCREASE_STEP)
+
+
+class RateLimiter(object):
+    """Token buckets per (service, region, action family).
+    """
+
+    def __init__(self, rates=None):
+        self.rates = dict(rates or RATES)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, service, aws_region, operation):
+        key = (service, aws_region, action_family(operation))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(*self.rates[key[2]])
+                    self._buckets[key] = bucket
+        return bucket
+
+    def attach(self, client):
+        """Hook the limiter into the client's events:
+            before-send - wait for a token, before every attempt
+            needs-retry - slow the bucket down on a throttle response
+            after-call  - speed the bucket back up on a success (2xx)
+
+        :args:
+            client
+        """
+        service = client.meta.service_model.service_name
+        if not ENABLED or service not in RATE_LIMITED_SERVICES:
+            return
+        aws_region = client.meta.region_name
+
+        def operation_of(event_name):
+            return event_name.rsplit(".", 1)[-1]
+
+        def before_send(event_name=None, **kwargs):
+            self.bucket(service, aws_region,
+                        operation_of(event_name)).acquire()
+
+        def needs_retry(response=None, event_name=None, **kwargs):
+            if response is None:
+                return None
+            code = response[1].get("Error", {}).get("Code")
+            if code in THROTTLE_CODES:
+                LOGGER.info(f"Throttled {operation_of(event_name)} in "
+                            f"{aws_region} ({code}), slowing down")
+                self.bucket(service, aws_region,
+                            operation_of(event_name)).on_throttle()
+            return None
+
+        def after_call(http_response=None, parsed=None, model=None,
+                       **kwargs):
+            # after-call is emitted for the error responses too, before
+            # botocore raises them
+            if http_response is None or \
+                    http_response.status_code >= 300 or \
+                    "Error" in (parsed or {}):
+                return
+            self.bucket(service, aws_region, model.name).on_success()
+
+        events = client.meta.events
+        events.register(f"before-send.{service}", before_send)
+        # First in line, before the retry handler decides on the retry
+        events.register_first(f"needs-retry.{service}", needs_retry)
+        events.register(f"after-call.{service}", after_call)
+
+    def reset(self):
+        """Drop the buckets, i.e. between two benchmark rounds.
+        """
+        with self._lock:
+            self._buckets.clear()
+
+    def report(self):
+        """Calls, throttles and queueing delay per action family.
+
+        :return:
+            {family: dict}
+        """
+        report = {}
+        with self._lock:
+            buckets = list(self._buckets.items())
+        for (_, _, family), bucket in buckets:
+            totals = report.setdefault(family, {
+                "calls": 0, "throttled": 0, "queued_seconds": 0.0,
+                "max_wait_seconds": 0.0,
+            })
+            totals["calls"] += bucket.calls
+            totals["throttled"] += bucket.throttled
+            totals["queued_seconds"] += bucket.queued
+            totals["max_wait_seconds"] = max(totals["max_wait_seconds"],
+                                             bucket.max_wait)
+        return report
+
+    def log_report(self):
+        for family, totals in sorted(self.report().items()):
+            average = totals["queued_seconds"] / max(1, totals["calls"])
+            LOGGER.info(f"API {family} calls: {totals['calls']}, throttled: "
+                        f"{totals['throttled']}, queueing delay: "
+                        f"{totals['queued_seconds']:.1f}s total, "
+                        f"{average:.2f}s average, "
+                        f"{totals['max_wait_seconds']:.2f}s max")
+
+
+_LIMITER = RateLimiter()
+
+
+def get_limiter():
+    """The rate limiter shared by every client of the process.
+    """
+    return _LIMITER
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""Process-wide boto3 session and client pool shared by all modules.
+Credentials and service models are loaded once per profile, and clients are
+cached per (profile, region, service) so their HTTPS connection pools stay
+warm for the whole run. The pool size follows the configured concurrency.
+Every client retries the throttled and transient errors (standard retry
+mode) and its EC2 calls go through the shared rate limiter. The calls of every
+client are recorded by teardown_metrics and traced by teardown_tracing.
+boto3 is only imported with the first session, so the modules importing this
+one (and the CLI start-up) don't pay for the AWS SDK until a step runs.
+"""
+
+# Standard Packages
+import logging
+import os
+import threading
+
+# Local imports
+import aws_rate_limiter
+import teardown_metrics
+import teardown_tracing
+import teardown_scheduler
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# botocore default for max_pool_connections
+MIN_POOL_CONNECTIONS = 10
+
+# Retries per call, on top of the first attempt, for the throttled and
+# transient errors
+MAX_ATTEMPTS = 10
+
+_LOCK = threading.RLock()
+_SESSIONS = {}
+_CLIENTS = {}
+_MAX_WORKERS = teardown_scheduler.MAX_WORKERS
+
+
+def _profile(profile):
+    # Fall back to the default credential chain when AWS_PROFILE isn't set
+    return profile or os.environ.get("AWS_PROFILE")
+
+
+def configure(max_workers):
+    """Set the concurrency the clients are sized for.
+    Cached clients are dropped when the pool size changes.
+
+    :args:
+        max_workers
+    """
+    global _MAX_WORKERS
+    with _LOCK:
+        if max_workers != _MAX_WORKERS:
+            _MAX_WORKERS = max_workers
+            _CLIENTS.clear()
+
+
+def max_pool_connections():
+    """The HTTPS connection pool size for every client.
+    It follows the configured workers (phases, times batch jobs), not the
+    threads of the per-phase executors, which are capped at this size too:
+    with several phases fanning out at once, more threads than connections
+    share a client, and the extra connections are opened and discarded
+    instead of pooled (urllib3 logs "Connection pool is full"). The rate
+    limiter keeps the EC2 calls below the API limits either way.
+    """
+    return max(MIN_POOL_CONNECTIONS, _MAX_WORKERS)
+
+
+def client_config():
+    """The botocore config of every client.
+    """
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=max_pool_connections(),
+        retries={"max_attempts": MAX_ATTEMPTS, "mode": "standard"},
+    )
+
+
+def get_session(profile=None):
+    """Return the shared boto3 session for the profile.
+
+    :args:
+        profile (defaults to AWS_PROFILE)
+    :return:
+        boto3.Session
+    """
+    profile = _profile(profile)
+    with _LOCK:
+        if profile not in _SESSIONS:
+            # Deferred, importing boto3 takes longer than the rest of the
+            # CLI start-up
+            import boto3
+            # Any clients created from this session will use credentials
+            # from the [profile_name] section of ~/.aws/credentials.
+            _SESSIONS[profile] = boto3.Session(profile_name=profile)
+        return _SESSIONS[profile]
+
+
+def get_client(service, aws_region=None, profile=None):
+    """Return the shared, thread safe client for (profile, region, service).
+
+    :args:
+        service, aws_region, profile
+    :return:
+        boto3 client
+    """
+    key = (_profile(profile), aws_region, service)
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+    with _LOCK:
+        if key not in _CLIENTS:
+            # Session.client() isn't thread safe, hence the lock
+            client = get_session(profile).client(
+                service,
+                region_name=aws_region,
+                config=client_config(),
+            )
+            aws_rate_limiter.get_limiter().attach(client)
+            teardown_metrics.get_metrics().attach(client)
+            teardown_tracing.get_tracer().attach(client)
+            _CLIENTS[key] = client
+        return _CLIENTS[key]
+
+
+def get_resource(service, aws_region=None, profile=None):
+    """Return a new resource object on top of the shared session.
+    Resources aren't thread safe, so they are never shared.
+
+    :args:
+        service, aws_region, profile
+    :return:
+        boto3 resource
+    """
+    with _LOCK:
+        resource = get_session(profile).resource(
+            service,
+            region_name=aws_region,
+            config=client_config(),
+        )
+        aws_rate_limiter.get_limiter().attach(resource.meta.client)
+        teardown_metrics.get_metrics().attach(resource.meta.client)
+        teardown_tracing.get_tracer().attach(resource.meta.client)
+        return resource
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""Wait engine for the VPC teardown.
+Instead of sleeping for a fixed amount of time after every delete/detach call,
+we poll the real resource state and return as soon as it has been reached:
+    1. botocore waiters are used where the EC2 API provides one
+       (NAT Gateway, ENI, VPC peering, VPN connection).
+    2. describe based predicates are used where there is no waiter
+       (VGW detach, TGW attachment, route table association, subnet).
+Polling uses exponential backoff with jitter and per resource type timeouts.
+The time is read from (and slept on) the teardown_clock.
+"""
+
+# Standard Packages
+import logging
+import random
+
+# Third party packages
+from botocore.exceptions import ClientError, WaiterError
+
+# Local imports
+import teardown_clock
+import teardown_metrics
+import teardown_tracing
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Maximum time (in seconds) to wait for each resource type
+TIMEOUTS = {
+    "nat_gateway": 900,
+    "network_interface": 600,
+    "vpc_peering_connection": 300,
+    "vpc_endpoint": 600,
+    "vpn_gateway_attachment": 600,
+    "vpn_connection": 900,
+    "transit_gateway_attachment": 900,
+    "transit_gateway": 900,
+    "customer_gateway": 300,
+    "route_table_association": 120,
+    "subnet": 120,
+    "security_group": 300,
+    "dynamodb_table": 900,
+    "dynamodb_replica": 1800,
+    "default": 300,
+}
+
+# Backoff settings (in seconds)
+BASE_DELAY = 2
+MAX_DELAY = 30
+
+# Error codes meaning the resource is already gone
+NOT_FOUND_CODES = (
+    "InvalidNetworkInterfaceID.NotFound",
+    "InvalidSubnetID.NotFound",
+    "InvalidVpnGatewayID.NotFound",
+    "InvalidTransitGatewayAttachmentID.NotFound",
+    "InvalidAssociationID.NotFound",
+    "InvalidRouteTableID.NotFound",
+)
+
+
+class WaitTimeoutError(Exception):
+    """Raised when a resource doesn't reach the expected state in time.
+    """
+
+
+def backoff_delays(base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Generate exponentially growing delays with "equal jitter".
+
+    :args:
+        base_delay, max_delay
+    :return:
+        generator of delays in seconds
+    """
+    attempt = 0
+    while True:
+        ceiling = min(max_delay, base_delay * 2 ** attempt)
+        yield ceiling / 2 + random.uniform(0, ceiling / 2)
+        attempt += 1
+
+
+def wait_until(predicate, resource_type, description, timeout=None,
+               base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Poll the predicate until it returns True or the timeout expires.
+    The predicate is checked straight away, so we never sleep when
+    the resource has already reached the expected state.
+
+    :args:
+        predicate, resource_type, description, timeout
+    :return:
+        elapsed time in seconds
+    """
+    if timeout is None:
+        timeout = TIMEOUTS.get(resource_type, TIMEOUTS["default"])
+    clock = teardown_clock.get_clock()
+    started = clock.monotonic()
+    deadline = started + timeout
+    with teardown_tracing.span(f"wait {resource_type}",
+                               description=description) as span:
+        for polls, delay in enumerate(
+                backoff_delays(base_delay, max_delay), 1):
+            if predicate():
+                elapsed = clock.monotonic() - started
+                span.set_attribute("polls", polls)
+                LOGGER.info(f"{description} is done after {elapsed:.1f}s")
+                return elapsed
+            remaining = deadline - clock.monotonic()
+            if remaining <= 0:
+                span.set_attribute("polls", polls)
+                raise WaitTimeoutError(
+                    f"Timed out after {timeout}s waiting for {description}"
+                )
+            teardown_metrics.sleep(min(delay, remaining), resource_type)
+
+
+def waiter_predicate(ec2_client, waiter_name, **kwargs):
+    """Wrap a botocore waiter into a single-shot predicate, so that the
+    backoff and timeouts are driven by wait_until().
+
+    :args:
+        ec2_client, waiter_name, waiter kwargs
+    :return:
+        predicate function
+    """
+    waiter = ec2_client.get_waiter(waiter_name)
+
+    def predicate():
+        try:
+            waiter.wait(WaiterConfig={"Delay": 0, "MaxAttempts": 1}, **kwargs)
+            return True
+        except WaiterError as error:
+            if error.kwargs.get("reason", "").startswith(
+                    "Max attempts exceeded"):
+                return False
+            raise
+    return predicate
+
+
+def _is_not_found(error):
+    return error.response["Error"]["Code"] in NOT_FOUND_CODES
+
+
+def nat_gateway_deleted(ec2_client, nat_gw_ids):
+    """Wait until all NAT Gateways are deleted.
+    """
+    return wait_until(
+        waiter_predicate(ec2_client, "nat_gateway_deleted",
+                         NatGatewayIds=list(nat_gw_ids)),
+        "nat_gateway", f"deletion of {', '.join(nat_gw_ids)}",
+    )
+
+
+def network_interface_available(ec2_client, eni_id):
+    """Wait until the ENI is detached.
+    """
+    return wait_until(
+        waiter_predicate(ec2_client, "network_interface_available",
+                         NetworkInterfaceIds=[eni_id]),
+        "network_interface", f"detach of {eni_id}",
+    )
+
+
+def network_interface_deleted(ec2_client, eni_id):
+    """Wait until the ENI is gone.
+    """
+    def predicate():
+        try:
+            ec2_client.describe_network_interfaces(
+                NetworkInterfaceIds=[eni_id]
+            )
+        except ClientError as error:
+            if _is_not_found(error):
+                return True
+            raise
+        return False
+    return wait_until(predicate, "network_interface", f"deletion of {eni_id}")
+
+
+def vpc_peering_connection_deleted(ec2_client, peering_id):
+    """Wait until the VPC peering connection is deleted.
+    """
+    return wait_until(
+        waiter_predicate(ec2_client, "vpc_peering_connection_deleted",
+                         VpcPeeringConnectionIds=[peering_id]),
+        "vpc_peering_connection", f"deletion of {peering_id}",
+    )
+
+
+def vpn_gateway_detached(ec2_client, vpn_gw_id, vpc_id):
+    """Wait until the VGW is detached from the vpc.
+    """
+    def predicate():
+        try:
+            vpn_gws = ec2_client.describe_vpn_gateways(
+                VpnGatewayIds=[vpn_gw_id]
+            )["VpnGateways"]
+        except ClientError as error:
+            if _is_not_found(error):
+                return True
+            raise
+        for vpn_gw in vpn_gws:
+            for attachment in vpn_gw.get("VpcAttachments", []):
+                if (attachment["VpcId"] == vpc_id and
+                        attachment["State"] != "detached"):
+                    return False
+        return True
+    return wait_until(
+        predicate, "vpn_gateway_attachment",
+        f"detach of {vpn_gw_id} from {vpc_id}",
+    )
+
+
+def vpn_connection_deleted(ec2_client, vpn_conn_id):
+    """Wait until the VPN connection is deleted.
+    """
+    return wait_until(
+        waiter_predicate(ec2_client, "vpn_connection_deleted",
+                         VpnConnectionIds=[vpn_conn_id]),
+        "vpn_connection", f"deletion of {vpn_conn_id}",
+    )
+
+
+def transit_gateway_attachment_deleted(ec2_client, attachment_id):
+    """Wait until the TGW vpc attachment is deleted.
+    """
+    def predicate():
+        try:
+            attachments = ec2_client.describe_transit_gateway_vpc_attachments(
+                TransitGatewayAttachmentIds=[attachment_id]
+            )["TransitGatewayVpcAttachments"]
+        except ClientError as error:
+            if _is_not_found(error):
+                return True
+            raise
+        return all(attach["State"] == "deleted" for attach in attachments)
+    return wait_until(
+        predicate, "transit_gateway_attachment",
+        f"deletion of {attachment_id}",
+    )
+
+
+def route_table_disassociated(ec2_client, association_id):
+    """Wait until the route table association is gone.
+    """
+    def predicate():
+        route_tables = ec2_client.describe_route_tables(
+            Filters=[
+                {"Name": "association.route-table-association-id",
+                 "Values": [association_id]},
+            ]
+        )["RouteTables"]
+        for route_table in route_tables:
+            for association in route_table["Associations"]:
+                if (association["RouteTableAssociationId"] == association_id
+                        and association.get("AssociationState", {}).get(
+                            "State") != "disassociated"):
+                    return False
+        return True
+    return wait_until(
+        predicate, "route_table_association",
+        f"disassociation of {association_id}",
+    )
+
+
+def subnet_deleted(ec2_client, subnet_id):
+    """Wait until the subnet is gone.
+    """
+    def predicate():
+        try:
+            ec2_client.describe_subnets(SubnetIds=[subnet_id])
+        except ClientError as error:
+            if _is_not_found(error):
+                return True
+            raise
+        return False
+    return wait_until(predicate, "subnet", f"deletion of {subnet_id}")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""Batch mode: decommission many VPCs concurrently.
+Jobs are read from a file (or stdin) with one VPC per line:
+    vpc_id,region[,cust_gw_id[,tgw_id]]
+Blank lines and lines starting with '#' are ignored, and so is a header
+line starting with "vpc_id". The jobs run on a bounded worker pool with
+a per-region limit on top and share the process-wide client pool. A
+failing job never stops the others. An aggregated summary is printed
+at the end.
+"""
+
+# Standard Packages
+import argparse
+import csv
+import logging
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Local imports
+import teardown_tracing
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Default limits on the concurrent jobs
+MAX_JOBS = 4
+MAX_JOBS_PER_REGION = 2
+
+
+def positive_int(value):
+    """argparse type of the worker and job limits.
+
+    :args:
+        value
+    :return:
+        int >= 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive int")
+    return number
+
+
+class BatchJob(object):
+    """A single VPC teardown of the batch and its outcome.
+    """
+
+    def __init__(self, vpc_id, aws_region, cust_gw_id=None, tgw_id=None):
+        self.vpc_id = vpc_id
+        self.aws_region = aws_region
+        self.cust_gw_id = cust_gw_id or None
+        self.tgw_id = tgw_id or None
+        self.status = "pending"
+        self.error = None
+        self.duration = 0.0
+
+    def __repr__(self):
+        return f"BatchJob({self.vpc_id}, {self.aws_region})"
+
+
+def read_jobs(path):
+    """Read the batch jobs from a file, '-' means stdin.
+
+    :args:
+        path
+    :return:
+        list of BatchJob
+    """
+    stream = sys.stdin if path == "-" else open(path)
+    try:
+        jobs = []
+        for row in csv.reader(stream):
+            row = [field.strip() for field in row]
+            if not row or not row[0] or row[0].startswith("#") or \
+                    row[0] == "vpc_id":
+                continue
+            if len(row) < 2 or not row[1]:
+                raise ValueError(f"Missing region for {row[0]} in {path}")
+            jobs.append(BatchJob(*row[:4]))
+        return jobs
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _run_job(job, teardown):
+    LOGGER.info(f"Starting the batch job ==> {job.vpc_id} "
+                f"in {job.aws_region}")
+    job.status = "running"
+    started = time.monotonic()
+    try:
+        teardown(job)
+        job.status = "done"
+    except SystemExit as error:
+        # The modules sys.exit() on fatal errors, keep it to this job
+        job.status = "failed"
+        job.error = str(error.code) if error.code is not None else "exited"
+    except Exception as error:
+        job.status = "failed"
+        job.error = repr(error)
+    job.duration = time.monotonic() - started
+    log = LOGGER.info if job.status == "done" else LOGGER.error
+    log(f"Batch job {job.vpc_id} in {job.aws_region} {job.status} "
+        f"after {job.duration:.1f}s {job.error or ''}")
+    return job
+
+
+def run_batch(jobs, teardown, max_jobs=MAX_JOBS,
+              max_jobs_per_region=MAX_JOBS_PER_REGION):
+    """Run the teardown of every job concurrently. A job is only started
+    when both the global and its region limit allow it, so a busy region
+    never holds up the workers of the other regions.
+
+    :args:
+        jobs, teardown (callable taking a BatchJob), max_jobs,
+        max_jobs_per_region
+    :return:
+        list of BatchJob
+    """
+    if max_jobs < 1 or max_jobs_per_region < 1:
+        raise ValueError(f"max_jobs ({max_jobs}) and max_jobs_per_region "
+                         f"({max_jobs_per_region}) must be at least 1")
+    pending = list(jobs)
+    running = {}
+    per_region = Counter()
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        while pending or running:
+            for job in list(pending):
+                if len(running) >= max_jobs:
+                    break
+                if per_region[job.aws_region] < max_jobs_per_region:
+                    pending.remove(job)
+                    per_region[job.aws_region] += 1
+                    running[executor.submit(
+                        teardown_tracing.bind(_run_job), job, teardown
+                    )] = job
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                per_region[running.pop(future).aws_region] -= 1
+    return jobs
+
+
+def print_summary(jobs, stream=None):
+    """Print the aggregated outcome of the batch.
+
+    :args:
+        jobs, stream (defaults to stdout)
+    """
+    stream = stream or sys.stdout
+    done = [job for job in jobs if job.status == "done"]
+    failed = [job for job in jobs if job.status != "done"]
+    total = sum(job.duration for job in jobs)
+    stream.write(f"\n{'vpc_id':<24} {'region':<16} {'status':<8} "
+                 f"{'seconds':>9}  error\n")
+    for job in jobs:
+        stream.write(f"{job.vpc_id:<24} {job.aws_region:<16} "
+                     f"{job.status:<8} {job.duration:>9.1f}  "
+                     f"{job.error or ''}\n")
+    stream.write(f"\n{len(jobs)} jobs: {len(done)} done, "
+                 f"{len(failed)} failed, {total:.1f}s of teardown time\n")
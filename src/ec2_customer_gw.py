@@ -2,16 +2,28 @@
 
 """After deleting a VPC, we've to clean up rest of the "zombie" resources
 that were associated/attached to the deleted VPC,
-such as Customer Gateway.
+such as Customer Gateway(s).
+The customer gateways are the ones given on the command line and the ones
+of the VPN connections deleted with the vpc (see
+ec2_vpn_conns_gw.released_customer_gateways()). They are looked up directly
+with CustomerGatewayIds, the ones still used by a VPN connection are kept,
+and the others are deleted concurrently and confirmed with one batched poll.
 """
 
 # Standard Packages
 import logging
-import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # Third party packages
-import boto3
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_discovery
+import aws_session
+import aws_waiters
+import teardown_tracing
+from aws_waiters import WaitTimeoutError
 
 # Sets up logging
 logger = logging.getLogger("root")
@@ -20,57 +32,149 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 LOGGER = logging.getLogger("root")
 LOGGER.setLevel(logging.DEBUG)
 
+# Ids per describe call
+MAX_IDS_PER_CALL = 200
+
+# Errors meaning the customer gateway is already gone
+NOT_FOUND_CODES = ("InvalidCustomerGatewayID.NotFound",
+                   "InvalidCustomerGatewayId.NotFound")
+
+
+def _batches(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), MAX_IDS_PER_CALL):
+        yield ids[start:start + MAX_IDS_PER_CALL]
+
+
+def describe_customer_gateways(ec2_client, cust_gw_ids):
+    """The customer gateways, looked up directly with CustomerGatewayIds.
+    The ones that don't exist aren't in the result.
+
+    :args:
+        ec2_client, cust_gw_ids
+    :return:
+        {cust_gw_id: state}
+    """
+    states = {}
+    for batch in _batches(cust_gw_ids):
+        try:
+            cust_gws = ec2_client.describe_customer_gateways(
+                CustomerGatewayIds=batch
+            )['CustomerGateways']
+        except ClientError as error:
+            if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+                raise
+            if len(batch) == 1:
+                LOGGER.info(f"The {batch[0]} doesn't exist")
+                continue
+            # One unknown id fails the whole call, look them up one by one
+            for cust_gw_id in batch:
+                states.update(describe_customer_gateways(ec2_client,
+                                                         [cust_gw_id]))
+            continue
+        for cust_gw in cust_gws:
+            states[cust_gw['CustomerGatewayId']] = cust_gw['State']
+    return states
+
+
+def in_use(ec2_client, cust_gw_ids):
+    """The customer gateways still used by a VPN connection.
 
-def delete_cust_gw(aws_region, cust_gw):
-    """ Delete Customer Gateway that had been specified in command line arguments
-    
     :args:
-        aws_region, cust_gw
+        ec2_client, cust_gw_ids
+    :return:
+        {cust_gw_id: set of VPN connection ids}
     """
+    used = {}
+    for batch in _batches(cust_gw_ids):
+        for vpn_con in aws_discovery.iter_items(
+                ec2_client, "describe_vpn_connections", "VpnConnections",
+                Filters=[{"Name": "customer-gateway-id", "Values": batch}]):
+            if vpn_con["State"] != "deleted" and \
+                    vpn_con.get("CustomerGatewayId") in batch:
+                used.setdefault(vpn_con["CustomerGatewayId"], set()).add(
+                    vpn_con["VpnConnectionId"]
+                )
+    return used
 
-    # Set up boto3 session
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
-        )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    ec2_client = session.client('ec2')
-
-    # Delete Customer Gateway
-    filters = [
-        {'Name': 'state', 'Values': ['available'], }
-    ]
-    cust_gws = ec2_client.describe_customer_gateways(
-        Filters=filters
-    )['CustomerGateways']
-    for cust_gw_id in cust_gws:
-        if cust_gw_id['CustomerGatewayId'] == cust_gw:
-            ec2_client.delete_customer_gateway(
-                CustomerGatewayId=cust_gw_id['CustomerGatewayId'],
-                # DryRun = True
+
+def delete_cust_gw(aws_region, cust_gw_ids, released_ids=()):
+    """Delete the Customer Gateway(s) that had been specified in command
+    line arguments, and the ones released by the deleted VPN connections
+    that no other connection uses.
+
+    :args:
+        aws_region, cust_gw_ids, released_ids
+    """
+    ec2_client = aws_session.get_client('ec2', aws_region)
+    requested = set(cust_gw_ids)
+    states = describe_customer_gateways(ec2_client,
+                                        requested | set(released_ids))
+    available = {cust_gw_id for cust_gw_id, state in states.items()
+                 if state == "available"}
+    used = in_use(ec2_client, available)
+    for cust_gw_id in sorted(used):
+        log = LOGGER.error if cust_gw_id in requested else LOGGER.info
+        log(f"The {cust_gw_id} is still used by "
+            f"{', '.join(sorted(used[cust_gw_id]))}, keeping it")
+    available -= set(used)
+    if not available:
+        LOGGER.info(f"There is no customer gateway to delete in the "
+                    f"{aws_region} region")
+
+    failed = []
+
+    def delete(cust_gw_id):
+        try:
+            ec2_client.delete_customer_gateway(CustomerGatewayId=cust_gw_id)
+            LOGGER.info(f"Deleting the ==> {cust_gw_id}")
+        except ClientError as error:
+            if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+                LOGGER.error(error)
+                failed.append(cust_gw_id)
+
+    if available:
+        max_workers = min(aws_session.max_pool_connections(), len(available))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(teardown_tracing.bind(delete),
+                              sorted(available)))
+    pending = available - set(failed)
+
+    def all_deleted():
+        current = describe_customer_gateways(ec2_client, pending)
+        for cust_gw_id in sorted(pending):
+            if current.get(cust_gw_id, "deleted") == "deleted":
+                pending.discard(cust_gw_id)
+        return not pending
+
+    if pending:
+        try:
+            aws_waiters.wait_until(
+                all_deleted, "customer_gateway",
+                f"the deletion of {', '.join(sorted(pending))}",
             )
-            LOGGER.info(f"Deleting the ==> {cust_gw_id['CustomerGatewayId']}")
-        else:
-            LOGGER.info(f"The {cust_gw_id} doesn't exist in \
-                        the {aws_region} region"
-                        )
+        except WaitTimeoutError as error:
+            LOGGER.error(error)
+    failed = set(failed) | (requested & set(used))
+    if failed:
+        sys.exit(f"Unable to delete the customer gateway(s) "
+                 f"{', '.join(sorted(failed))} in {aws_region}")
 
 
-def main(aws_region, cust_gw):
+def main(aws_region, cust_gw_ids, released_ids=()):
     """ A main function
-    
+
     :args:
-        aws_region, cust_gw
+        aws_region, cust_gw_ids (a customer gateway id or a list of them),
+        released_ids
     """
-    delete_cust_gw(aws_region, cust_gw)
+    if isinstance(cust_gw_ids, str):
+        cust_gw_ids = [cust_gw_ids]
+    delete_cust_gw(aws_region, cust_gw_ids, released_ids)
 
 
 if __name__ == "__main__":
     try:
-        main(sys.argv[1], sys.argv[2])
+        main(sys.argv[1], sys.argv[2:])
     except KeyboardInterrupt:
         exit(0)
@@ -2,17 +2,30 @@
 
 """After deleting a VPC, we've to clean up the rest of the resources
 that were created as part of the account creation pipeline such as DynamoDB table.
+The table names are streamed with a paginated list_tables, optionally
+filtered by name prefix or tags (ListTagsOfResource, see --dynamodb_prefix
+and --dynamodb_tag of main.py), and the tables are
+deleted concurrently within the control-plane limit on concurrent table
+operations. The on-demand backups and the global table replicas of a table
+are deleted first, then describe_table is polled until the table is gone.
+A table that can't be deleted fails the step once the others are done.
 """
 
 # Standard Packages
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # Third party packages
-import boto3
 from botocore.exceptions import ClientError
 
+# Local imports
+import aws_discovery
+import aws_session
+import teardown_tracing
+from aws_waiters import WaitTimeoutError, wait_until
+
 # Sets up logging
 logger = logging.getLogger("root")
 FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
@@ -20,54 +33,208 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 LOGGER = logging.getLogger("root")
 LOGGER.setLevel(logging.DEBUG)
 
+# DynamoDB limits the number of concurrent CreateTable, UpdateTable and
+# DeleteTable operations per account and region (500 by default)
+MAX_CONCURRENT_TABLE_OPS = int(
+    os.environ.get("TEARDOWN_DYNAMODB_MAX_TABLE_OPS", "500")
+)
+
+NOT_FOUND_CODES = ("ResourceNotFoundException",)
+
+
+def iter_table_names(dynamodb_client, prefixes=None):
+    """Stream the table names of the region.
+
+    :args:
+        dynamodb_client, prefixes
+    :return:
+        generator of table names
+    """
+    for name in aws_discovery.iter_items(
+            dynamodb_client, "list_tables", "TableNames"):
+        if not prefixes or name.startswith(tuple(prefixes)):
+            yield name
+
+
+def table_tags(dynamodb_client, table_arn):
+    """The tags of the table as a dict.
+
+    :args:
+        dynamodb_client, table_arn
+    """
+    return {
+        tag['Key']: tag['Value']
+        for tag in aws_discovery.iter_items(
+            dynamodb_client, "list_tags_of_resource", "Tags",
+            ResourceArn=table_arn,
+        )
+    }
+
+
+def _tags_match(tags, wanted):
+    # A None value matches any value of the tag
+    for key, value in (wanted or {}).items():
+        if key not in tags or value is not None and tags[key] != value:
+            return False
+    return True
+
+
+def has_tags(dynamodb_client, table_arn, tags):
+    """Whether the table has all the tags.
+
+    :args:
+        dynamodb_client, table_arn, tags ({key: value}, None for any value)
+    :return:
+        bool
+    """
+    return not tags or _tags_match(table_tags(dynamodb_client, table_arn),
+                                   tags)
+
+
+def delete_backups(dynamodb_client, table_name):
+    """Delete the on-demand backups of the table.
+
+    :args:
+        dynamodb_client, table_name
+    """
+    for backup in aws_discovery.iter_items(
+            dynamodb_client, "list_backups", "BackupSummaries",
+            TableName=table_name, BackupType="USER"):
+        if backup.get('BackupStatus') == "DELETED":
+            continue
+        dynamodb_client.delete_backup(BackupArn=backup['BackupArn'])
+        LOGGER.info(f"Deleting the backup ==> {backup['BackupArn']}")
+
+
+def delete_replicas(dynamodb_client, table, aws_region):
+    """Remove the global table replicas in the other regions, with one
+    UpdateTable call, and wait once until they are all gone.
 
-def deleteTable(aws_region):
-    """ Delete DynamoDB table that had been created via pipeline
-    
     :args:
-        aws_region
+        dynamodb_client, table (describe_table description), aws_region
     """
+    table_name = table['TableName']
+    regions = sorted(replica['RegionName']
+                     for replica in table.get('Replicas', [])
+                     if replica['RegionName'] != aws_region)
+    if not regions:
+        return
+    dynamodb_client.update_table(
+        TableName=table_name,
+        ReplicaUpdates=[{"Delete": {"RegionName": region}}
+                        for region in regions],
+    )
+    LOGGER.info(f"Deleting the replicas of {table_name} ==> "
+                f"{', '.join(regions)}")
+
+    def replicas_gone():
+        description = dynamodb_client.describe_table(
+            TableName=table_name
+        )['Table']
+        return description['TableStatus'] == "ACTIVE" and not {
+            other['RegionName'] for other in description.get('Replicas', [])
+        }.intersection(regions)
+
+    wait_until(replicas_gone, "dynamodb_replica",
+               f"the {table_name} replicas in {', '.join(regions)}")
+
+
+def table_deleted(dynamodb_client, table_name):
+    """Whether the table is gone.
+
+    :args:
+        dynamodb_client, table_name
+    :return:
+        bool
+    """
+    try:
+        dynamodb_client.describe_table(TableName=table_name)
+    except ClientError as error:
+        if error.response['Error']['Code'] in NOT_FOUND_CODES:
+            return True
+        raise
+    return False
+
+
+def delete_table(dynamodb_client, table_name, aws_region, tags=None):
+    """Delete the backups, replicas and then the table itself, and wait
+    until the table is gone.
 
-    # Create boto3 client session
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
+    :args:
+        dynamodb_client, table_name, aws_region, tags
+    :return:
+        True if the table was deleted, False if it doesn't match the tags
+    """
+    table = dynamodb_client.describe_table(TableName=table_name)['Table']
+    if not has_tags(dynamodb_client, table['TableArn'], tags):
+        return False
+    if table.get('DeletionProtectionEnabled'):
+        raise RuntimeError(f"The {table_name} has deletion protection "
+                           f"enabled")
+    delete_backups(dynamodb_client, table_name)
+    delete_replicas(dynamodb_client, table, aws_region)
+    dynamodb_client.delete_table(
+        TableName=table_name
     )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    dynamodb_client = session.client('dynamodb')
+    LOGGER.info(f"Deleting the ==> {table_name}")
+    wait_until(lambda: table_deleted(dynamodb_client, table_name),
+               "dynamodb_table", f"the deletion of the {table_name}")
+    return True
+
+
+def deleteTable(aws_region, tags=None, prefixes=None):
+    """ Delete DynamoDB table that had been created via pipeline
+
+    :args:
+        aws_region, tags ({key: value}), prefixes
+    """
+
+    dynamodb_client = aws_session.get_client('dynamodb', aws_region)
 
     # Delete DynamoDB table(s)
-    ddb_tables = dynamodb_client.list_tables()['TableNames']
     try:
-        if ddb_tables != []:
-            for ddb in ddb_tables:
-                dynamodb_client.delete_table(
-                    TableName=ddb
-                )
-                LOGGER.info(f"Deleting the ==> {ddb}")
-        else:               
-            LOGGER.info(f"The DynamoDB table doesn't exist in \
-                        the {aws_region} region"
-                        )
+        ddb_tables = list(iter_table_names(dynamodb_client, prefixes))
     except ClientError as error:
         LOGGER.error(error)
+        return
+    if ddb_tables == []:
+        LOGGER.info(f"The DynamoDB table doesn't exist in \
+                    the {aws_region} region"
+                    )
+        return
+
+    failed = []
 
+    def delete(table_name):
+        try:
+            delete_table(dynamodb_client, table_name, aws_region, tags)
+        except (ClientError, RuntimeError, WaitTimeoutError) as error:
+            if isinstance(error, ClientError) and \
+                    error.response['Error']['Code'] in NOT_FOUND_CODES:
+                return
+            LOGGER.error(f"Unable to delete the {table_name}: {error}")
+            failed.append(table_name)
 
-def main(aws_region):
+    max_workers = min(MAX_CONCURRENT_TABLE_OPS,
+                      aws_session.max_pool_connections(), len(ddb_tables))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(teardown_tracing.bind(delete), ddb_tables))
+    if failed:
+        sys.exit(f"Unable to delete the DynamoDB table(s) "
+                 f"{', '.join(sorted(failed))} in {aws_region}")
+
+
+def main(aws_region, tags=None, prefixes=None):
     """ A main function
-    
+
     :args:
-        aws_region
+        aws_region, tags, prefixes
     """
-    deleteTable(aws_region)
+    deleteTable(aws_region, tags, prefixes)
 
 
 if __name__ == "__main__":
     try:
-        main(sys.argv[1])
+        main(sys.argv[1], prefixes=sys.argv[2:] or None)
     except KeyboardInterrupt:
         exit(0)
@@ -14,10 +14,10 @@ import sys
 import logging
 # from tabulate import tabulate
 
-# None Standard packages
-import boto3
-
-print("AWS_PROFILE is: " + os.environ['AWS_PROFILE'])
+# Local imports
+import aws_discovery
+import aws_session
+import vpc_inventory
 
 # Sets up logging
 logger = logging.getLogger("root")
@@ -35,42 +35,18 @@ def get_ec2_status(vpc_id, aws_region):
         True statement ==> clean exit if there are some running instance(s)
     """
 
-    # Create a boto3 session profile
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
-        )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    ec2_client = session.client('ec2')
+    # Only the instances, the teardown loads the kinds its phases need
+    inventory = vpc_inventory.get_inventory(vpc_id, aws_region,
+                                            kinds=("instances",))
 
     # Check for running EC2 instance(s)
-    filters = [
-        {"Name": "instance-state-name", "Values": ["running", "stopped"]},
-        {"Name": "vpc-id", "Values": [vpc_id]},
+    ec2_instances = [
+        ins for ins in inventory.items("instances")
+        if ins.state in ("running", "stopped")
     ]
-    ec2_instances = ec2_client.describe_instances(
-        Filters=filters
-    )['Reservations']
-    instance_ids, state_names = [], []
     if len(ec2_instances) > 0:
-        for res in ec2_instances:
-            for ins in res['Instances']:
-                instance_ids.append(ins['InstanceId'])
-                inst_id = ''.join(instance_ids)
-            # instance_ids = ''.join(instance_ids.append(ins['InstanceId']))
-                state_names.append(ins['State']['Name'])
-                st_name = ''.join(state_names)
-            # state_names = ''.join(state_names.append(ins['State']['Name']))
-                # return inst_id
-            # LOGGER.info(f"Running EC2 {inst_id} with status: \
-            # <{st_name}> in the {vpc_id}.")
-            # print(tabulate([{inst_id}], [{st_name}], headers=['instance_ids',
-            # 'state_names'])
-            # )
+        inst_id = ', '.join(ins.resource_id for ins in ec2_instances)
+        st_name = ', '.join(ins.state for ins in ec2_instances)
         sys.exit(f"Running EC2 {inst_id} with status: <{st_name}> in the {vpc_id}. \
                   Please delete the EC2 or RDS instance/cluster first...")
     else:
@@ -82,24 +58,16 @@ def get_rds_status(vpc_id, aws_region):
     :returns:
         true statement
     """
-    # Create a boto3 session profile
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
-        )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    rds_client = session.client('rds')
+    rds_client = aws_session.get_client('rds', aws_region)
 
     # Check for RDS instances
     filters = [
         {"Name": "db-instance-id", "Values": ["available"]},
         # {"Name": "tag:Name", "Values": [vpc_id]},
     ]
-    rds_instances = rds_client.describe_db_instances(Filters=filters)['DBInstances']
+    rds_instances = list(aws_discovery.iter_items(
+        rds_client, "describe_db_instances", "DBInstances", Filters=filters
+    ))
     if len(rds_instances) > 0:
         for rdb in rds_instances:
             if rdb["DBSecurityGroup"]["VpcId"] == vpc_id:
@@ -111,6 +79,7 @@ def get_rds_status(vpc_id, aws_region):
 
 
 def main(vpc_id, aws_region):
+    LOGGER.info(f"AWS_PROFILE is: {os.environ.get('AWS_PROFILE')}")
     get_ec2_status(vpc_id, aws_region)
     get_rds_status(vpc_id, aws_region)
 
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""NAT gateway and Elastic IP stages of delete_vpc.
+    1. Every NAT gateway deletion is started at once and a single
+       nat_gateway_deleted poll (multi-ID) waits for all of them, so the
+       stage takes about one NAT deletion time whatever their number.
+    2. Only the EIPs of this vpc are released: the ones of its NAT gateways
+       and the ones associated with its ENIs, concurrently. The other
+       (unassociated) EIPs of the account are left alone.
+"""
+
+# Standard Packages
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party packages
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_session
+import aws_waiters
+import teardown_tracing
+from aws_waiters import WaitTimeoutError
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Errors meaning the resource is already gone
+NOT_FOUND_CODES = ("NatGatewayNotFound", "InvalidAllocationID.NotFound",
+                   "InvalidAssociationID.NotFound")
+
+# NAT gateways listed for about an hour after they're gone, their EIPs
+# may be in use elsewhere by then
+GONE_STATES = ("deleted", "failed")
+
+
+def _run_concurrently(func, items):
+    # Run func over the items on the shared client pool, in the current span
+    if not items:
+        return []
+    max_workers = min(aws_session.max_pool_connections(), len(items))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(teardown_tracing.bind(func), items))
+
+
+def _delete_nat_gateway(ec2_client, nat_gw_id):
+    try:
+        ec2_client.delete_nat_gateway(NatGatewayId=nat_gw_id)
+        LOGGER.info(f"Deleting the NAT gateway ==> {nat_gw_id}")
+    except ClientError as error:
+        if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+            raise
+
+
+def delete_nat_gateways(ec2_client, inventory):
+    """Delete the NAT gateways of the vpc at once and wait for all of them.
+    Their EIPs are disassociated but not released, they stay in the
+    inventory as the vpc's for release_addresses().
+
+    :args:
+        ec2_client, inventory
+    """
+    natgws = inventory.items("nat_gateways")
+    LOGGER.info(f"The list of NATGW: {natgws}")
+    # Mark their EIPs before the deletion disassociates them
+    inventory.wait_loaded("addresses")
+    for nat_gw in natgws:
+        if nat_gw.state in GONE_STATES:
+            continue
+        for allocation_id in nat_gw.allocation_ids:
+            inventory.update("addresses", allocation_id,
+                             vpc_id=inventory.vpc_id)
+    pending = [nat_gw.resource_id for nat_gw in natgws
+               if nat_gw.state != "deleted"]
+    _run_concurrently(
+        lambda nat_gw_id: _delete_nat_gateway(ec2_client, nat_gw_id),
+        [nat_gw.resource_id for nat_gw in natgws
+         if nat_gw.state not in ("deleting", "deleted")],
+    )
+    if pending:
+        try:
+            aws_waiters.nat_gateway_deleted(ec2_client, pending)
+        except WaitTimeoutError as error:
+            # The subnet deletion reports the NAT gateways left
+            LOGGER.error(error)
+            return
+
+    for nat_gw in natgws:
+        inventory.remove("nat_gateways", nat_gw.resource_id)
+        if nat_gw.state in GONE_STATES:
+            continue
+        for eni_id in nat_gw.network_interface_ids:
+            inventory.remove("network_interfaces", eni_id)
+        for allocation_id in nat_gw.allocation_ids:
+            inventory.update("addresses", allocation_id,
+                             network_interface_id=None, association_id=None)
+
+
+def vpc_addresses(inventory):
+    """The EIPs of the vpc, i.e. of its live NAT gateways and its ENIs.
+    An EIP associated with an ENI of another vpc is never the vpc's.
+
+    :args:
+        inventory
+    :return:
+        list of aws_discovery.AddressRecord
+    """
+    nat_gws = [nat_gw for nat_gw in inventory.items("nat_gateways")
+               if nat_gw.state not in GONE_STATES]
+    nat_allocations = {allocation_id for nat_gw in nat_gws
+                       for allocation_id in nat_gw.allocation_ids}
+    nat_enis = {eni_id for nat_gw in nat_gws
+                for eni_id in nat_gw.network_interface_ids}
+    return [
+        eip for eip in inventory.items("addresses")
+        if (eip.vpc_id == inventory.vpc_id or
+            eip.resource_id in nat_allocations) and
+        (eip.network_interface_id is None or
+         eip.vpc_id == inventory.vpc_id or
+         eip.network_interface_id in nat_enis)
+    ]
+
+
+def _release(ec2_client, eip):
+    if eip.association_id is not None:
+        try:
+            ec2_client.disassociate_address(AssociationId=eip.association_id)
+            LOGGER.info(f"Disassociating {eip.public_ip} from "
+                        f"{eip.network_interface_id}")
+        except ClientError as error:
+            if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+                raise
+    try:
+        ec2_client.release_address(AllocationId=eip.resource_id)
+        LOGGER.info(f"Releasing {eip.public_ip} ({eip.resource_id})")
+    except ClientError as error:
+        if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+            raise
+
+
+def release_addresses(ec2_client, inventory):
+    """Release the EIPs of the vpc concurrently. A failing release is
+    logged and doesn't stop the others.
+
+    :args:
+        ec2_client, inventory
+    """
+    def release(eip):
+        try:
+            _release(ec2_client, eip)
+        except ClientError as error:
+            LOGGER.error(f"Unable to release {eip.resource_id}: {error}")
+            return
+        inventory.remove("addresses", eip.resource_id)
+
+    _run_concurrently(release, vpc_addresses(inventory))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""ENI teardown stage of delete_vpc.
+    1. The ENIs of the vpc are classified by interface type and requester
+       managed status. The ones owned by a service (Lambda, ELB, VPC
+       endpoint, NAT or transit gateway...) are left to their owners, they
+       go away together with the owning resource.
+    2. The attached ENIs are detached concurrently.
+    3. The pending ENIs are polled in batches, a multi-ID
+       describe_network_interfaces call per poll, and every ENI is deleted
+       concurrently as soon as it's available.
+"""
+
+# Standard Packages
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party packages
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_discovery
+import aws_session
+import aws_waiters
+import teardown_tracing
+from aws_waiters import WaitTimeoutError
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Interface types we create and delete ourselves, everything else belongs
+# to the service that created it
+DELETABLE_TYPES = ("interface", "efa", "trunk", "branch")
+
+# Filter values per describe_network_interfaces call
+MAX_IDS_PER_CALL = 200
+
+# Errors meaning the ENI is gone or not detached yet
+NOT_FOUND_CODES = ("InvalidNetworkInterfaceID.NotFound",
+                   "InvalidAttachmentID.NotFound")
+IN_USE_CODES = ("InvalidNetworkInterface.InUse",)
+
+
+def classify(enis):
+    """Split the ENIs into the ones to delete and the ones to leave to
+    their owners.
+
+    :args:
+        enis (aws_discovery.NetworkInterfaceRecord)
+    :return:
+        (list to delete, list to leave)
+    """
+    delete, leave = [], []
+    for eni in enis:
+        if eni.requester_managed or \
+                eni.interface_type not in DELETABLE_TYPES:
+            leave.append(eni)
+        else:
+            delete.append(eni)
+    return delete, leave
+
+
+def describe_statuses(ec2_client, eni_ids):
+    """The status of the ENIs, a multi-ID call per MAX_IDS_PER_CALL ENIs.
+    The ENIs that are gone aren't in the result.
+
+    :args:
+        ec2_client, eni_ids
+    :return:
+        {eni_id: status}
+    """
+    eni_ids = sorted(eni_ids)
+    statuses = {}
+    for start in range(0, len(eni_ids), MAX_IDS_PER_CALL):
+        for eni in aws_discovery.iter_items(
+                ec2_client, "describe_network_interfaces",
+                "NetworkInterfaces",
+                Filters=[{"Name": "network-interface-id",
+                          "Values": eni_ids[start:start + MAX_IDS_PER_CALL]}]):
+            statuses[eni["NetworkInterfaceId"]] = eni["Status"]
+    return statuses
+
+
+def _detach(ec2_client, eni):
+    try:
+        ec2_client.detach_network_interface(AttachmentId=eni.attachment_id)
+        LOGGER.info(f"Detaching {eni.attachment_id} of {eni.resource_id}")
+    except ClientError as error:
+        if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+            raise
+
+
+def _delete(ec2_client, eni_id):
+    # True once the ENI is gone, False while it's still in use
+    try:
+        ec2_client.delete_network_interface(NetworkInterfaceId=eni_id)
+    except ClientError as error:
+        code = error.response['Error']['Code']
+        if code in NOT_FOUND_CODES:
+            return True
+        if code in IN_USE_CODES:
+            return False
+        raise
+    LOGGER.info(f"Deleting the ENI ==> {eni_id}")
+    return True
+
+
+def delete_network_interfaces(ec2_client, inventory, timeout=None):
+    """Detach and delete the ENIs of the vpc we own, see the module
+    docstring. A timeout or a failing ENI isn't fatal, the subnet deletion
+    reports whatever is left.
+
+    :args:
+        ec2_client, inventory, timeout
+    """
+    nat_enis = {eni_id for nat in inventory.items("nat_gateways")
+                for eni_id in nat.network_interface_ids}
+    enis, leave = classify(
+        eni for eni in inventory.items("network_interfaces")
+        if eni.resource_id not in nat_enis
+    )
+    for eni in leave:
+        LOGGER.info(f"Leaving the {eni.interface_type} ENI "
+                    f"{eni.resource_id} to its owner")
+    if not enis:
+        LOGGER.info("No ENIs to delete")
+        return
+
+    failed = []
+
+    def run(func, eni_ids):
+        # Errors are logged per ENI, the rest go on
+        def call(eni_id):
+            try:
+                return func(eni_id)
+            except ClientError as error:
+                LOGGER.error(error)
+                failed.append(eni_id)
+                return None
+        return list(executor.map(teardown_tracing.bind(call), eni_ids))
+
+    max_workers = min(aws_session.max_pool_connections(), len(enis))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        attached = {eni.resource_id: eni for eni in enis
+                    if eni.attachment_id is not None}
+        run(lambda eni_id: _detach(ec2_client, attached[eni_id]),
+            sorted(attached))
+        pending = {eni.resource_id for eni in enis} - set(failed)
+
+        def all_deleted():
+            statuses = describe_statuses(ec2_client, pending)
+            for eni_id in pending - set(statuses):
+                pending.discard(eni_id)
+                inventory.remove("network_interfaces", eni_id)
+            available = sorted(eni_id for eni_id in pending
+                               if statuses[eni_id] == "available")
+            for eni_id, gone in zip(available, run(
+                    lambda eni_id: _delete(ec2_client, eni_id), available)):
+                if gone:
+                    pending.discard(eni_id)
+                    inventory.remove("network_interfaces", eni_id)
+                elif gone is None:
+                    pending.discard(eni_id)
+            return not pending
+
+        try:
+            aws_waiters.wait_until(
+                all_deleted, "network_interface",
+                f"the deletion of {len(enis)} ENI(s) of {inventory.vpc_id}",
+                timeout=timeout,
+            )
+        except WaitTimeoutError as error:
+            LOGGER.error(f"{error}: {', '.join(sorted(pending))}")
+    if failed:
+        LOGGER.error(f"Unable to delete {len(failed)} ENI(s) of "
+                     f"{inventory.vpc_id}: {', '.join(sorted(failed))}")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+"""Security group teardown ordered by the references between the groups.
+A group can't be deleted while a rule of another group references it, but
+deleting a group drops its own rules as well. So instead of revoking every
+rule one call at a time:
+    1. The reference graph between the groups of the VPC is built from
+       the UserIdGroupPairs of their rules.
+    2. Only the groups on a reference cycle and the default group get
+       their rules referencing the custom groups revoked, with one call
+       per group and direction.
+    3. The custom groups are deleted in parallel waves, the groups nobody
+       references first, with DependencyViolation errors retried.
+The number of API calls stays close to the number of groups.
+"""
+
+# Standard Packages
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party packages
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_session
+import aws_waiters
+import teardown_clock
+import teardown_metrics
+import teardown_tracing
+from aws_waiters import WaitTimeoutError
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Errors meaning the group is still in use or already gone
+DEPENDENCY_CODES = ("DependencyViolation",)
+NOT_FOUND_CODES = ("InvalidGroup.NotFound",)
+
+
+def referenced_groups(sg):
+    """The ids of the other groups referenced by the rules of the group.
+
+    :args:
+        sg (aws_discovery.SecurityGroupRecord)
+    :return:
+        set of group ids
+    """
+    refs = set()
+    for permission in list(sg.ip_permissions) + \
+            list(sg.ip_permissions_egress):
+        for pair in permission.get("UserIdGroupPairs", []):
+            if pair.get("GroupId"):
+                refs.add(pair["GroupId"])
+    refs.discard(sg.resource_id)
+    return refs
+
+
+def reference_graph(groups):
+    """Map every group to the groups (of the list) its rules reference.
+
+    :args:
+        groups
+    :return:
+        {group_id: set of group ids}
+    """
+    ids = {sg.resource_id for sg in groups}
+    return {sg.resource_id: referenced_groups(sg) & ids for sg in groups}
+
+
+def _on_cycle(graph, start):
+    stack = list(graph[start])
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if node == start:
+            return True
+        if node not in seen:
+            seen.add(node)
+            stack.extend(graph.get(node, ()))
+    return False
+
+
+def cyclic_groups(graph):
+    """The groups on a reference cycle, which no deletion order can break.
+
+    :args:
+        graph
+    :return:
+        set of group ids
+    """
+    return {node for node in graph if _on_cycle(graph, node)}
+
+
+def deletion_wave(graph):
+    """The groups no other remaining group references, deletable together.
+
+    :args:
+        graph
+    :return:
+        list of group ids
+    """
+    referenced = set()
+    for refs in graph.values():
+        referenced.update(refs)
+    return sorted(node for node in graph if node not in referenced)
+
+
+def custom_groups(groups):
+    return [sg for sg in groups if sg.group_name != "default"]
+
+
+def _revoke(ec2_client, sg, ingress, egress):
+    if ingress:
+        ec2_client.revoke_security_group_ingress(
+            GroupId=sg.resource_id,
+            IpPermissions=ingress,
+        )
+    if egress:
+        ec2_client.revoke_security_group_egress(
+            GroupId=sg.resource_id,
+            IpPermissions=egress,
+        )
+    LOGGER.info(f'Removing {len(ingress)} ingress and {len(egress)} egress \
+                rules from Group ID: {sg.resource_id}, \
+                Group Name: {sg.group_name}'
+                )
+
+
+def _references(permissions, group_ids):
+    return [
+        permission for permission in permissions
+        if any(pair.get("GroupId") in group_ids
+               for pair in permission.get("UserIdGroupPairs", []))
+    ]
+
+
+def blocking_rules(groups):
+    """The rules that keep the custom groups from being deleted, i.e. the
+    rules referencing a custom group, of the groups on a reference cycle
+    and of the default group.
+
+    :args:
+        groups
+    :return:
+        list of (group, ingress permissions, egress permissions)
+    """
+    custom = custom_groups(groups)
+    custom_ids = {sg.resource_id for sg in custom}
+    cyclic = cyclic_groups(reference_graph(custom))
+    revokes = []
+    for sg in groups:
+        if sg.resource_id in cyclic or sg.group_name == "default":
+            ingress = _references(sg.ip_permissions, custom_ids)
+            egress = _references(sg.ip_permissions_egress, custom_ids)
+            if ingress or egress:
+                revokes.append((sg, ingress, egress))
+    return revokes
+
+
+def revoke_blocking_rules(ec2_client, inventory):
+    """Revoke the blocking rules, one call per group and direction.
+
+    :args:
+        ec2_client, inventory
+    """
+    revokes = blocking_rules(inventory.items("security_groups"))
+    if not revokes:
+        return
+    LOGGER.info(f"Revoking the rules of {len(revokes)} security group(s)")
+
+    def revoke(item):
+        sg, ingress, egress = item
+        _revoke(ec2_client, sg, ingress, egress)
+        inventory.update(
+            "security_groups", sg.resource_id,
+            ip_permissions=[p for p in sg.ip_permissions
+                            if p not in ingress],
+            ip_permissions_egress=[p for p in sg.ip_permissions_egress
+                                   if p not in egress],
+        )
+
+    with ThreadPoolExecutor(
+            max_workers=min(aws_session.max_pool_connections(),
+                            len(revokes))) as executor:
+        list(executor.map(teardown_tracing.bind(revoke), revokes))
+
+
+def _delete(ec2_client, sg):
+    # True once the group is gone, False while it's still in use
+    try:
+        ec2_client.delete_security_group(
+            GroupId=sg.resource_id,
+        )
+    except ClientError as error:
+        code = error.response['Error']['Code']
+        if code in NOT_FOUND_CODES:
+            return True
+        if code in DEPENDENCY_CODES:
+            LOGGER.info(f"The {sg.resource_id} is still in use, retrying...")
+            return False
+        raise
+    LOGGER.info(f'Removing security Group ID {sg.resource_id}, \
+            Group Name: {sg.group_name}!')
+    return True
+
+
+def delete_security_groups(ec2_client, inventory, timeout=None):
+    """Delete the custom groups in parallel waves that follow the reference
+    graph. Groups failing with DependencyViolation stay for a later wave,
+    with a backoff when a whole wave makes no progress.
+
+    :args:
+        ec2_client, inventory, timeout
+    """
+    remaining = {sg.resource_id: sg
+                 for sg in custom_groups(inventory.items("security_groups"))}
+    if not remaining:
+        return
+    if timeout is None:
+        timeout = aws_waiters.TIMEOUTS["security_group"]
+    clock = teardown_clock.get_clock()
+    deadline = clock.monotonic() + timeout
+    delays = aws_waiters.backoff_delays()
+    max_workers = min(aws_session.max_pool_connections(), len(remaining))
+    delete = teardown_tracing.bind(
+        lambda group_id: _delete(ec2_client, remaining[group_id])
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while remaining:
+            graph = reference_graph(remaining.values())
+            # A cycle left over means the revokes didn't go through yet
+            wave = deletion_wave(graph) or sorted(remaining)
+            deleted = [
+                group_id for group_id, gone in zip(
+                    wave, executor.map(delete, wave)) if gone
+            ]
+            for group_id in deleted:
+                remaining.pop(group_id)
+                inventory.remove("security_groups", group_id)
+            if deleted or not remaining:
+                continue
+            if clock.monotonic() >= deadline:
+                raise WaitTimeoutError(
+                    f"Timed out after {timeout}s deleting the security "
+                    f"groups {', '.join(sorted(remaining))}"
+                )
+            teardown_metrics.sleep(
+                min(next(delays), deadline - clock.monotonic()),
+                "security_group",
+            )
@@ -1,19 +1,33 @@
 #!/usr/bin/env python
 
-"""After deleting a VPC, we've to clean up rest of the "zombie" recources
-that were associated/attached to the deleted VPC,
-such as Transit Gateway.
+"""Transit gateway stages of the VPC teardown.
+    1. detach_vpc() runs as a delete_vpc phase: the route table
+       associations and propagations of the vpc attachments are removed
+       and the attachments are deleted, all concurrently. The attachments
+       are polled in batches, a multi-ID describe call per poll, and every
+       attachment is deleted as soon as its association is gone, so a
+       shared TGW is left without stale associations or propagated routes
+       of the vpc.
+    2. After deleting a VPC, main() cleans up the "zombie" transit
+       gateway(s) given on the command line: they are looked up directly by
+       id, deleted concurrently and polled in batches until deleted.
 """
 
 # Standard Packages
 import logging
-import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # Third party packages
-import boto3
 from botocore.exceptions import ClientError
 
+# Local imports
+import aws_discovery
+import aws_session
+import aws_waiters
+import teardown_tracing
+from aws_waiters import WaitTimeoutError
+
 # Sets up logging
 logger = logging.getLogger("root")
 FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
@@ -21,61 +35,320 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 LOGGER = logging.getLogger("root")
 LOGGER.setLevel(logging.DEBUG)
 
+# Ids per describe call
+MAX_IDS_PER_CALL = 200
+
+# Errors meaning the resource is already gone
+NOT_FOUND_CODES = ("InvalidTransitGatewayID.NotFound",
+                   "InvalidTransitGatewayAttachmentID.NotFound",
+                   "InvalidRouteTableID.NotFound",
+                   "TransitGatewayRouteTablePropagation.NotFound",
+                   "InvalidAssociation.NotFound")
+
+# Errors meaning the resource is busy with another state change
+INCORRECT_STATE_CODES = ("IncorrectState",)
+
+# Final states of the attachments and of the TGWs
+GONE_STATES = ("deleted", "rejected", "failed")
+
+
+def _batches(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), MAX_IDS_PER_CALL):
+        yield ids[start:start + MAX_IDS_PER_CALL]
+
+
+def _run_concurrently(func, items):
+    # Run func over the items on the shared client pool, in the current
+    # span. Returns the results, None for the items that failed, so one
+    # failing item doesn't abort the others.
+    def call(item):
+        try:
+            return func(item)
+        except ClientError as error:
+            if error.response['Error']['Code'] in NOT_FOUND_CODES:
+                return True
+            LOGGER.error(error)
+            return None
+        except Exception as error:
+            LOGGER.error(f"{item}: {error!r}")
+            return None
+
+    if not items:
+        return []
+    max_workers = min(aws_session.max_pool_connections(), len(items))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(teardown_tracing.bind(call), items))
+
+
+def describe_attachments(ec2_client, attachment_ids):
+    """The attachments, a multi-ID call per MAX_IDS_PER_CALL attachments.
+    The ones that are gone aren't in the result.
+
+    :args:
+        ec2_client, attachment_ids
+    :return:
+        {attachment_id: describe_transit_gateway_attachments item}
+    """
+    attachments = {}
+    for batch in _batches(attachment_ids):
+        for attachment in aws_discovery.iter_items(
+                ec2_client, "describe_transit_gateway_attachments",
+                "TransitGatewayAttachments",
+                Filters=[{"Name": "transit-gateway-attachment-id",
+                          "Values": batch}]):
+            if attachment["TransitGatewayAttachmentId"] in batch:
+                attachments[attachment["TransitGatewayAttachmentId"]] = \
+                    attachment
+    return attachments
+
+
+def describe_transit_gateways(ec2_client, tgw_ids):
+    """The TGWs, looked up directly with TransitGatewayIds. The ones that
+    don't exist aren't in the result.
 
-def delete_tgw(aws_region, tgw_id):
-    """ Delete Transit Gateway that had been specified in command line arguments.
-    
     :args:
-        aws_region, tgw_id
+        ec2_client, tgw_ids
+    :return:
+        {tgw_id: describe_transit_gateways item}
     """
+    tgws = {}
+    for batch in _batches(tgw_ids):
+        try:
+            items = list(aws_discovery.iter_items(
+                ec2_client, "describe_transit_gateways", "TransitGateways",
+                TransitGatewayIds=batch,
+            ))
+        except ClientError as error:
+            if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+                raise
+            if len(batch) == 1:
+                LOGGER.info(f"The {batch[0]} doesn't exist")
+                continue
+            # One unknown id fails the whole call, look them up one by one
+            items = [tgw for tgw_id in batch for tgw in
+                     describe_transit_gateways(ec2_client, [tgw_id]).values()]
+        for tgw in items:
+            tgws[tgw["TransitGatewayId"]] = tgw
+    return tgws
+
+
+def _propagations(ec2_client, attachment_id):
+    try:
+        return [
+            (attachment_id, propagation["TransitGatewayRouteTableId"])
+            for propagation in aws_discovery.iter_items(
+                ec2_client, "get_transit_gateway_attachment_propagations",
+                "TransitGatewayAttachmentPropagations",
+                TransitGatewayAttachmentId=attachment_id,
+            )
+            if propagation.get("State") in ("enabling", "enabled")
+        ]
+    except ClientError as error:
+        if error.response['Error']['Code'] in NOT_FOUND_CODES:
+            return []
+        raise
+
+
+def _disassociate(ec2_client, attachment_id, route_table_id):
+    ec2_client.disassociate_transit_gateway_route_table(
+        TransitGatewayRouteTableId=route_table_id,
+        TransitGatewayAttachmentId=attachment_id,
+    )
+    LOGGER.info(f"Disassociating {attachment_id} from {route_table_id}")
+    return True
+
+
+def _disable_propagation(ec2_client, attachment_id, route_table_id):
+    ec2_client.disable_transit_gateway_route_table_propagation(
+        TransitGatewayRouteTableId=route_table_id,
+        TransitGatewayAttachmentId=attachment_id,
+    )
+    LOGGER.info(f"Disabling the propagation of {attachment_id} to "
+                f"{route_table_id}")
+    return True
+
 
-    # Set up boto3 session
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
+def _delete_attachment(ec2_client, attachment_id):
+    # True once the deletion is under way, False while the attachment is
+    # busy (i.e. disassociating)
+    try:
+        ec2_client.delete_transit_gateway_vpc_attachment(
+            TransitGatewayAttachmentId=attachment_id
         )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    ec2_client = session.client('ec2')
+    except ClientError as error:
+        if error.response['Error']['Code'] in INCORRECT_STATE_CODES:
+            return False
+        raise
+    LOGGER.info(f"Deleting the TGW attachment ==> {attachment_id}")
+    return True
+
+
+def detach_vpc(ec2_client, inventory, timeout=None):
+    """Remove the route table associations and propagations of the vpc
+    attachments and delete the attachments, see the module docstring.
+    A timeout or a failing attachment isn't fatal, the subnet deletion
+    reports whatever is left.
+    Note - this only handles vpc<=>tgw attachments, not vpn<=>tgw
+
+    :args:
+        ec2_client, inventory, timeout
+    """
+    tgw_attachments = inventory.items("transit_gateway_vpc_attachments")
+    LOGGER.info(f"List of the TGW attachments: {tgw_attachments}")
+    if not tgw_attachments:
+        return
+    attachments = describe_attachments(
+        ec2_client, [attach.resource_id for attach in tgw_attachments]
+    )
+    pending = {attachment_id for attachment_id, attachment
+               in attachments.items()
+               if attachment["State"] not in GONE_STATES}
+    for attach in tgw_attachments:
+        if attach.resource_id not in pending:
+            inventory.remove("transit_gateway_vpc_attachments",
+                             attach.resource_id)
 
-    # Delete Transit Gateway
-    filters = [
-        {'Name': 'state', 'Values': ['available'], }
+    # Associations and propagations, concurrently. The association with the
+    # default route table of the TGW is left to the deletion, which removes
+    # it too.
+    default_route_tables = {
+        tgw.get("Options", {}).get("AssociationDefaultRouteTableId")
+        for tgw in describe_transit_gateways(
+            ec2_client, {attachments[attachment_id]["TransitGatewayId"]
+                         for attachment_id in pending}).values()
+    }
+    associated = {
+        attachment_id: attachments[attachment_id]["Association"]
+        ["TransitGatewayRouteTableId"]
+        for attachment_id in sorted(pending)
+        if attachments[attachment_id].get("Association", {}).get("State")
+        in ("associating", "associated")
+    }
+    associations = [(attachment_id, route_table_id)
+                    for attachment_id, route_table_id in associated.items()
+                    if route_table_id not in default_route_tables]
+    # The deletion removes the association too, when it couldn't be
+    # removed first
+    forced = {attachment_id for attachment_id, route_table_id
+              in associated.items()
+              if route_table_id in default_route_tables}
+    forced |= {attachment_id for (attachment_id, _), done in zip(
+        associations,
+        _run_concurrently(lambda assoc: _disassociate(ec2_client, *assoc),
+                          associations)) if done is None}
+    propagations = [
+        propagation for found in _run_concurrently(
+            lambda attachment_id: _propagations(ec2_client, attachment_id),
+            sorted(pending))
+        for propagation in (found or [])
     ]
-    trans_gws = ec2_client.describe_transit_gateways(
-        Filters=filters
-    )['TransitGateways']
-    for trans_gw_id in trans_gws:
-        if trans_gw_id['TransitGatewayId'] == tgw_id:
-            try:
-                ec2_client.delete_transit_gateway(
-                    TransitGatewayId=trans_gw_id['TransitGatewayId'],
-                    # DryRun=True,
-                )
-                LOGGER.info(f"Deleting ==> {trans_gw_id['TransitGatewayId']}")
-            except ClientError as error:
-                logging.error(error)
-                sys.exit()
-        else:
-            LOGGER.info(f"The {trans_gw_id} doesn't exist in \
-                        the {aws_region} region"
-                        )
-
-
-def main(aws_region, tgw_id):
+    _run_concurrently(lambda prop: _disable_propagation(ec2_client, *prop),
+                      propagations)
+
+    requested, failed = set(), set()
+
+    def all_deleted():
+        current = describe_attachments(ec2_client, pending)
+        ready = []
+        for attachment_id in sorted(pending):
+            attachment = current.get(attachment_id)
+            state = attachment["State"] if attachment else "deleted"
+            if state in GONE_STATES:
+                pending.discard(attachment_id)
+                inventory.remove("transit_gateway_vpc_attachments",
+                                 attachment_id)
+            elif attachment_id not in requested and state != "deleting" \
+                    and (attachment_id in forced or
+                         attachment.get("Association", {}).get("State") in
+                         (None, "disassociated")):
+                ready.append(attachment_id)
+        for attachment_id, started in zip(ready, _run_concurrently(
+                lambda attachment_id: _delete_attachment(ec2_client,
+                                                         attachment_id),
+                ready)):
+            if started:
+                requested.add(attachment_id)
+            elif started is None:
+                failed.add(attachment_id)
+                pending.discard(attachment_id)
+        return not pending
+
+    try:
+        aws_waiters.wait_until(
+            all_deleted, "transit_gateway_attachment",
+            f"the deletion of {len(attachments)} TGW attachment(s) of "
+            f"{inventory.vpc_id}",
+            timeout=timeout,
+        )
+    except WaitTimeoutError as error:
+        LOGGER.error(f"{error}: {', '.join(sorted(pending))}")
+    if failed:
+        LOGGER.error(f"Unable to delete {len(failed)} TGW attachment(s) of "
+                     f"{inventory.vpc_id}")
+
+
+def delete_tgw(aws_region, tgw_ids):
+    """Delete the Transit Gateway(s) that had been specified in command line
+    arguments, concurrently, and wait until they are deleted.
+
+    :args:
+        aws_region, tgw_ids
+    """
+    ec2_client = aws_session.get_client('ec2', aws_region)
+
+    # Delete Transit Gateway(s)
+    tgws = describe_transit_gateways(ec2_client, tgw_ids)
+    available = sorted(tgw_id for tgw_id, tgw in tgws.items()
+                       if tgw["State"] == "available")
+    if not available:
+        LOGGER.info(f"There is no available TGW of {', '.join(tgw_ids)} in "
+                    f"the {aws_region} region")
+
+    def delete(tgw_id):
+        ec2_client.delete_transit_gateway(TransitGatewayId=tgw_id)
+        LOGGER.info(f"Deleting ==> {tgw_id}")
+        return True
+
+    failed = {tgw_id for tgw_id, started in zip(
+        available, _run_concurrently(delete, available)) if started is None}
+    pending = {tgw_id for tgw_id, tgw in tgws.items()
+               if tgw["State"] not in GONE_STATES} - failed
+
+    def all_deleted():
+        current = describe_transit_gateways(ec2_client, pending)
+        for tgw_id in sorted(pending):
+            if tgw_id not in current or \
+                    current[tgw_id]["State"] in GONE_STATES:
+                pending.discard(tgw_id)
+        return not pending
+
+    if pending:
+        try:
+            aws_waiters.wait_until(
+                all_deleted, "transit_gateway",
+                f"the deletion of {', '.join(sorted(pending))}",
+            )
+        except WaitTimeoutError as error:
+            LOGGER.error(error)
+    if failed:
+        sys.exit(f"Unable to delete the TGW(s) {', '.join(sorted(failed))} "
+                 f"in {aws_region}")
+
+
+def main(aws_region, tgw_ids):
     """ A main function
-    
+
     :args:
-        aws_region, tgw_id
+        aws_region, tgw_ids (a TGW id or a list of them)
     """
-    delete_tgw(aws_region, tgw_id)
+    if isinstance(tgw_ids, str):
+        tgw_ids = [tgw_ids]
+    delete_tgw(aws_region, list(tgw_ids))
 
 
 if __name__ == "__main__":
     try:
-        main(sys.argv[1], sys.argv[2])
+        main(sys.argv[1], sys.argv[2:])
     except KeyboardInterrupt:
         exit(0)
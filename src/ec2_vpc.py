@@ -16,15 +16,30 @@
 """
 
 # Standard packages
+import functools
 import logging
-import os
 import sys
-import time
 
 # Third party packages
-import boto3
 from botocore.exceptions import ClientError
 
+# Local imports
+import aws_discovery
+import aws_session
+import aws_waiters
+import ec2_nat_gateways
+import ec2_network_interfaces
+import ec2_transit_gw
+import ec2_vpc_peering
+import ec2_vpn_conns_gw
+import ec2_security_groups
+import teardown_metrics
+import teardown_tracing
+import teardown_journal
+import vpc_inventory
+from aws_waiters import WaitTimeoutError
+from teardown_scheduler import Phase, run_phases
+
 # Sets up logging
 logger = logging.getLogger("root")
 FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
@@ -32,6 +47,22 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 LOGGER = logging.getLogger("root")
 LOGGER.setLevel(logging.DEBUG)
 
+# Endpoint ids per delete_vpc_endpoints and describe call
+MAX_ENDPOINTS_PER_CALL = 25
+
+
+def _wait(wait_func, *args):
+    """Wait for the resource state change. A timeout isn't fatal as
+    the following steps will report any remaining dependency.
+
+    :args:
+        wait_func, wait_func args
+    """
+    try:
+        wait_func(*args)
+    except WaitTimeoutError as error:
+        LOGGER.error(error)
+
 
 def vpc_exists(vpc_id, aws_region):
     """This function is checking if vpc does exist in specified region.
@@ -41,16 +72,7 @@ def vpc_exists(vpc_id, aws_region):
     :return:
         vpc-id
     """
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
-        )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    ec2_client = session.client('ec2')
+    ec2_client = aws_session.get_client('ec2', aws_region)
 
     # Check if VpcId does exsist
     try:
@@ -62,326 +84,225 @@ def vpc_exists(vpc_id, aws_region):
         sys.exit()
 
 
-def delete_vpc(vpc_id, aws_region):
-    """This function is describes and removes all VPC dependencies first
-    and then deletes the VPC itself.
+def _associate_default_dhcp_options(ec2_client, inventory):
+    """Detach default_dhcp_options if associated with the vpc
+    """
+    ec2_client.associate_dhcp_options(
+        DhcpOptionsId="default", VpcId=inventory.vpc_id
+    )
 
-    :args:
-        vpc_id, aws_region
+
+def _delete_nat_gateways(ec2_client, inventory):
+    """Delete NAT Gateways, all at once. Attached ENIs are automatically
+    deleted EIPs are disassociated but not released (see ec2_nat_gateways)
     """
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
+    ec2_nat_gateways.delete_nat_gateways(ec2_client, inventory)
+
+
+def _release_elastic_ips(ec2_client, inventory):
+    """Release the EIPs of the vpc NAT gateways and ENIs, concurrently
+    """
+    ec2_nat_gateways.release_addresses(ec2_client, inventory)
+
+
+def _delete_network_interfaces(ec2_client, inventory):
+    """Ensure ENIs are deleted before proceeding, concurrently and with
+    batched polling (see ec2_network_interfaces)
+    """
+    ec2_network_interfaces.delete_network_interfaces(ec2_client, inventory)
+
+
+def _delete_internet_gateways(ec2_client, inventory):
+    """Detach and delete the IGW associated with the vpc
+    """
+    for igw in inventory.items("internet_gateways"):
+        ec2_client.detach_internet_gateway(
+            InternetGatewayId=igw.resource_id,
+            VpcId=inventory.vpc_id,
         )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section in ~/.aws/credentials.
-    ec2 = session.resource("ec2")
-    ec2_client = session.client('ec2')
-    vpc = ec2.Vpc(vpc_id)
-
-    # Detach default_dhcp_options if associated with the vpc
-    dhcp_options_default = ec2.DhcpOptions("default")
-    if dhcp_options_default:
-        dhcp_options_default.associate_with_vpc(VpcId=vpc_id)
-
-    # Delete NAT Gateways. Attached ENIs are automatically deleted
-    # EIPs are disassociated but not released
-    filters = [
-        {"Name": "vpc-id", "Values": [vpc_id]}
-    ]
-    natgws = ec2_client.describe_nat_gateways(Filters=filters)["NatGateways"]
-    LOGGER.info(f"The list of NATGW: {natgws}")
-    for nat_gw in natgws:
-        ec2_client.delete_nat_gateway(NatGatewayId=nat_gw["NatGatewayId"])
-        time.sleep(90)
-
-    # Release an IP address without NetworkInterfaceId or AssociationId
-    filters = [
-        {"Name": "domain", "Values": ["vpc"]}
-    ]
-    eips = ec2_client.describe_addresses(Filters=filters)['Addresses']
-    for eip in eips:
-        if 'NetworkInterfaceId' not in eip:
-            LOGGER.info(eip['PublicIp'] +
-                        " doesn't have any instances associated, releasing")
-            ec2_client.release_address(AllocationId=eip['AllocationId'])
-        elif 'AssociationId' not in eip:
-            LOGGER.info(eip['PublicIp'] +
-                        "doesn't have any associationId, releasing")
-            ec2_client.release_address(AllocationId=eip['AllocationId'])
-            time.sleep(90)
-
-    # Ensure ENIs are deleted before proceeding
-    filters = [
-        {"Name": "vpc-id", "Values": [vpc_id]}
-    ]
-    enis = ec2_client.describe_network_interfaces(
-        Filters=filters
-    )["NetworkInterfaces"]
-    for eni in enis:
-        LOGGER.info(f"The eni is: {eni}")
+        LOGGER.info(f"Detaching the IGW ==> {igw.resource_id}")
+        ec2_client.delete_internet_gateway(
+            InternetGatewayId=igw.resource_id
+        )
+        inventory.remove("internet_gateways", igw.resource_id)
+
+
+def _endpoint_states(ec2_client, endpoint_ids):
+    # {endpoint id: state}, the endpoints that are gone aren't in it
+    endpoint_ids = sorted(endpoint_ids)
+    states = {}
+    for start in range(0, len(endpoint_ids), MAX_ENDPOINTS_PER_CALL):
+        batch = endpoint_ids[start:start + MAX_ENDPOINTS_PER_CALL]
         try:
-            attachid = eni["Attachment"]["AttachmentId"]
-            LOGGER.info(f"The attachId is: {attachid}")
-            ec2_client.detach_network_interface(
-                AttachmentId=attachid,
-            )
-            LOGGER.info(f"Detaching {attachid}")
-            ec2.delete_network_interface(
-                NetworkInterfaceId=eni["NetworkInterfaceId"],
-            )
-            LOGGER.info(f"Waiting on ENIs to delete")
-            time.sleep(120)
-        except Exception as ex:
-            LOGGER.error(ex)
-            if eni not in enis:
-                LOGGER.info(f"No ENIs remaining")
-
-    # Detach and delete the IGW associated with the vpc
-    igws = vpc.internet_gateways.all()
-    for igw in igws:
-        vpc.detach_internet_gateway(InternetGatewayId=igw.id)
-        LOGGER.info(f"Detaching the IGW ==> {igw.id}")
-        igw.delete()
-
-    # Delete the VPC Endpoints
-    filters = [
-        {"Name": "vpc-id", "Values": [vpc_id]}
-    ]
-    eps = ec2_client.describe_vpc_endpoints(Filters=filters)["VpcEndpoints"]
+            eps = list(aws_discovery.iter_items(
+                ec2_client, "describe_vpc_endpoints", "VpcEndpoints",
+                VpcEndpointIds=batch,
+            ))
+        except ClientError as error:
+            if error.response['Error']['Code'] != \
+                    "InvalidVpcEndpointId.NotFound":
+                raise
+            if len(batch) == 1:
+                continue
+            # One unknown id fails the whole call, look them up one by one
+            for endpoint_id in batch:
+                states.update(_endpoint_states(ec2_client, [endpoint_id]))
+            continue
+        for ep in eps:
+            states[ep["VpcEndpointId"]] = ep.get("State", "").lower()
+    return states
+
+
+def _delete_vpc_endpoints(ec2_client, inventory):
+    """Delete the VPC Endpoints, a call per MAX_ENDPOINTS_PER_CALL, and
+    wait until they are deleted: the requester-managed ENIs of the interface
+    endpoints keep the subnets from being deleted until then.
+    """
+    eps = [ep for ep in inventory.items("vpc_endpoints")
+           if (ep.state or "").lower() != "deleted"]
     LOGGER.info(f"List of EndPoints: {eps}")
-    for ep in eps:
-        ec2_client.delete_vpc_endpoints(VpcEndpointIds=[ep["VpcEndpointId"]])
+    if not eps:
+        return
+    endpoint_ids = sorted(ep.resource_id for ep in eps)
+    failed = set()
+    for start in range(0, len(endpoint_ids), MAX_ENDPOINTS_PER_CALL):
+        response = ec2_client.delete_vpc_endpoints(
+            VpcEndpointIds=endpoint_ids[start:start + MAX_ENDPOINTS_PER_CALL]
+        )
+        for item in response.get("Unsuccessful", []):
+            LOGGER.error(f"Unable to delete the {item['ResourceId']}: "
+                         f"{item.get('Error', {}).get('Message')}")
+            failed.add(item["ResourceId"])
+    pending = set(endpoint_ids) - failed
+
+    def all_deleted():
+        states = _endpoint_states(ec2_client, pending)
+        for endpoint_id in sorted(pending):
+            if states.get(endpoint_id, "deleted") == "deleted":
+                pending.discard(endpoint_id)
+                inventory.remove("vpc_endpoints", endpoint_id)
+        return not pending
+
+    if pending:
+        aws_waiters.wait_until(
+            all_deleted, "vpc_endpoint",
+            f"the deletion of {len(pending)} endpoint(s) of "
+            f"{inventory.vpc_id}",
+        )
+    if failed:
+        raise RuntimeError(f"Unable to delete the endpoint(s) "
+                           f"{', '.join(sorted(failed))} of "
+                           f"{inventory.vpc_id}")
 
-    # Delete custom security groups
-    filters = [
-        {"Name": "vpc-id", "Values": [vpc_id]}
-    ]
-    sec_grps = ec2_client.describe_security_groups(
-        Filters=filters
-    )['SecurityGroups']
-    if len(sec_grps) > 0:
-        for sg in sec_grps:
-            if sg["GroupName"] != "default":
-                LOGGER.info(f'List of SGs_Id: {sg["GroupId"]}')
-                for ingress in sg['IpPermissions']:
-                    LOGGER.info(f'List of ingress rules: {ingress}')
-                    ec2_client.revoke_security_group_ingress(
-                        GroupId=sg["GroupId"],
-                        IpPermissions=[ingress],
-                    )
-                    LOGGER.info(f'Removing {ingress} from Group ID: {sg["GroupId"]},\
-                                Group Name: {sg["GroupName"]}'
-                                )
-                for egress in sg['IpPermissionsEgress']:
-                    LOGGER.info(f'List of egress rules: {egress}')
-                    ec2_client.revoke_security_group_egress(
-                        GroupId=sg["GroupId"],
-                        IpPermissions=[egress],
-                    )
-                    LOGGER.info(f'Removing {egress} from Group ID: {sg["GroupId"]},\
-                                Group Name: {sg["GroupName"]}'
-                                )
-                ec2_client.delete_security_group(
-                    GroupId=sg['GroupId'],
-                )
-                LOGGER.info(f'Removing security Group ID {sg["GroupId"]}, \
-                        Group Name: {sg["GroupName"]}!')
 
-    # Delete vpc peering connection(s) as vpc-requester
-    filters = [
-        {"Name": "requester-vpc-info.vpc-id", "Values": [vpc_id]},
-    ]
-    vpc_peer_conns_req = ec2_client.describe_vpc_peering_connections(
-        Filters=filters
-    )["VpcPeeringConnections"]
-    LOGGER.info(f"VPC-Peer-Conns-req are: {vpc_peer_conns_req}")
-    for vpc_peer in vpc_peer_conns_req:
-        if vpc_peer["RequesterVpcInfo"]["VpcId"] == vpc_id:
-            ec2.VpcPeeringConnection(
-                vpc_peer["VpcPeeringConnectionId"]
-            ).delete()
-            LOGGER.info(f"Deleting peering connection as: \
-                        {vpc_peer['VpcPeeringConnectionId']}")
-            time.sleep(60)
-        else:
-            LOGGER.info(f"There is no peering connection as requester...")
+def _revoke_security_group_rules(ec2_client, inventory):
+    """Revoke the rules that keep the custom security groups from being
+    deleted (see ec2_security_groups)
+    """
+    ec2_security_groups.revoke_blocking_rules(ec2_client, inventory)
 
-    # Delete vpc peering connection(s) as vpc-accepter
-    filters = [
-        {"Name": "accepter-vpc-info.vpc-id", "Values": [vpc_id]},
-    ]
-    vpc_peer_conns_acc = ec2_client.describe_vpc_peering_connections(
-        Filters=filters
-    )["VpcPeeringConnections"]
-    LOGGER.info(f"VPC-Peer-Conns-acc are: {vpc_peer_conns_acc}")
-    try:
-        for vpc_peer_acc in vpc_peer_conns_acc:
-            if vpc_peer_acc["AccepterVpcInfo"]["VpcId"] == vpc_id:
-                ec2.VpcPeeringConnection(
-                    vpc_peer_acc["VpcPeeringConnectionId"]
-                ).delete()
-                time.sleep(90)
-                LOGGER.info(f"Deleting peering connection as: \
-                            {vpc_peer_acc['VpcPeeringConnectionId']}")
-        else:
-            LOGGER.info(f"There is no peering connection as accepter...")
-    except ClientError as error:
-        logging.error(error)
-        pass
 
-    # Detach VPN Gateway
-    filters = [
-        {"Name": "attachment.state", "Values": ["attached"]},
-    ]
-    vpn_gws = ec2_client.describe_vpn_gateways(
-        Filters=filters
-    )["VpnGateways"]
-    LOGGER.info(f"List of VPN gateways: {vpn_gws}")
-    try:
-        for vpn_gw in vpn_gws:
-            ec2_client.detach_vpn_gateway(
-                VpnGatewayId=vpn_gw["VpnGatewayId"],
-                VpcId=vpc_id,
-            )
-            LOGGER.info(f"Detaching the ==> {vpn_gw}")
-            time.sleep(60)
-    except ClientError as error:
-        logging.error(error)
-        sys.exit()
+def _delete_security_groups(ec2_client, inventory):
+    """Delete custom security groups in the reference graph order
+    """
+    ec2_security_groups.delete_security_groups(ec2_client, inventory)
 
-    # Detach VPN Gateway. Delete VPN connection.
-    # Note - it does not delete VPN Gateway or Customer Gateways
-    filters = [
-        {"Name": "state", "Values": ["available"]},
-        {"Name": "state", "Values": ["attached"]},
-    ]
-    vpn_conns = ec2_client.describe_vpn_connections(
-        Filters=filters
-    )["VpnConnections"]
-    LOGGER.info(f"List of VPN connections: {vpn_conns}")
-    try:
-        for vpn_con in vpn_conns:
-            if ec2_client.detach_vpn_gateway(
-                    VpnGatewayId=vpn_con["VpnGatewayId"],
-                    VpcId=vpc_id,
-            ):
-                ec2_client.delete_vpn_connection(
-                    VpnConnectionId=vpn_con["VpnConnectionId"],
-                )
-                LOGGER.info(f"Deleting the {vpn_con}")
-                time.sleep(60)
-            elif not ec2_client.detach_vpn_gateway(
-                        VpnGatewayId=vpn_con["VpnGatewayId"],
-                        VpcId=vpc_id,
-            ):
-                LOGGER.info(f"An error occurred (InvalidVpnGatewayAttachment.NotFound) \
-                             when calling the DetachVpnGateway operation: \
-                             The attachment with vpn gateway ID and \
-                             vpc ID {vpc_id} does not exist")
-    except ClientError as error:
-        logging.error(error)
-        sys.exit()
 
-    # Delete transit gateway attachment for this vpc
-    # Note - this only handles vpc<=>tgw attachments, not vpn<=>tgw
-    filters = [
-        {"Name": "vpc-id", "Values": [vpc_id]}
-    ]
-    tgw_attachments = ec2_client.describe_transit_gateway_vpc_attachments(
-        Filters=filters
-    )["TransitGatewayVpcAttachments"]
-    LOGGER.info(f"List of the TGW attachments: {tgw_attachments}")
-    for tgw_attach in tgw_attachments:
-        if tgw_attach["VpcId"] == vpc_id:
-            ec2_client.delete_transit_gateway_vpc_attachment(
-                TransitGatewayAttachmentId=tgw_attach[
-                    "TransitGatewayAttachmentId"
-                ]
-            )
-            time.sleep(60)
+def _delete_vpc_peering_connections(ec2_client, inventory):
+    """Delete the open vpc peering connection(s) as vpc-requester and
+    vpc-accepter, all at once
+    """
+    ec2_vpc_peering.delete_vpc_peering_connections(ec2_client, inventory)
 
-    # Disassociate the route table(s)
-    filters = [
-        {"Name": "vpc-id", "Values": [vpc_id]},
-        {"Name": "route.state", "Values": ["active"]},
-    ]
-    route_tables = ec2_client.describe_route_tables(
-        Filters=filters
-    )["RouteTables"]
+
+def _detach_vpn_gateways(ec2_client, inventory):
+    """Delete VPN connection(s). Detach VPN Gateway(s), concurrently.
+    Note - it does not delete VPN Gateway or Customer Gateways
+    """
+    ec2_vpn_conns_gw.detach_vpc(ec2_client, inventory)
+
+
+def _delete_tgw_attachments(ec2_client, inventory):
+    """Delete transit gateway attachment(s) for this vpc, with their route
+    table associations and propagations, concurrently
+    Note - this only handles vpc<=>tgw attachments, not vpn<=>tgw
+    """
+    ec2_transit_gw.detach_vpc(ec2_client, inventory)
+
+
+def _disassociate_route_tables(ec2_client, inventory):
+    """Disassociate the route table(s)
+    """
+    route_tables = inventory.items("route_tables")
     LOGGER.info(f"List of route tables: {route_tables}")
     for route_table in route_tables:
-        for association in route_table["Associations"]:
-            if not association["Main"]:
-                ec2_client.disassociate_route_table(
-                    AssociationId=association["RouteTableAssociationId"]
-                )
-                LOGGER.info(f"Disassotiating the: \
-                            {association['RouteTableAssociationId']}"
-                            )
-                time.sleep(30)
-
-    # Delete subnets
-    subnets = ec2_client.describe_subnets(
-        Filters=[
-            {
-                "Name": "vpc-id",
-                "Values": [vpc_id]
-            },
-        ],
-    )["Subnets"]
+        remaining = []
+        for association in route_table.associations:
+            association_id, main, _ = association
+            if main:
+                remaining.append(association)
+                continue
+            ec2_client.disassociate_route_table(
+                AssociationId=association_id
+            )
+            LOGGER.info(f"Disassotiating the: {association_id}")
+            _wait(aws_waiters.route_table_disassociated, ec2_client,
+                  association_id)
+        inventory.update("route_tables", route_table.resource_id,
+                         associations=tuple(remaining))
+
+
+def _delete_subnets(ec2_client, inventory):
+    """Delete subnets
+    """
+    subnets = inventory.items("subnets")
     LOGGER.info(f"List of subnets: {subnets}")
-    if len(subnets) > 0:
-        for subnet in subnets:
-            ec2_client.delete_subnet(SubnetId=subnet["SubnetId"])
-            LOGGER.info(f"Deleting subnets ==> {subnet['SubnetId']}")
-            time.sleep(10)
-
-    # Delete custom network ACLs
-    nacls = ec2.network_acls.all()
+    for subnet in subnets:
+        ec2_client.delete_subnet(SubnetId=subnet.resource_id)
+        LOGGER.info(f"Deleting subnets ==> {subnet.resource_id}")
+        _wait(aws_waiters.subnet_deleted, ec2_client, subnet.resource_id)
+        inventory.remove("subnets", subnet.resource_id)
+
+
+def _delete_network_acls(ec2_client, inventory):
+    """Delete custom network ACLs
+    """
+    nacls = [netacl for netacl in inventory.items("network_acls")
+             if not netacl.is_default]
     LOGGER.info(f"List of nACLS: {nacls}")
     for netacl in nacls:
-        if not netacl.is_default:
-            netacl.delete()
+        ec2_client.delete_network_acl(NetworkAclId=netacl.resource_id)
+        inventory.remove("network_acls", netacl.resource_id)
 
-    # Delete route(s), route table(s)
-    filters = [
-        {"Name": "vpc-id", "Values": [vpc_id]},
-        {"Name": "route.state", "Values": ["blackhole", "active"]},
-    ]
-    route_tables = ec2_client.describe_route_tables(
-        Filters=filters
-    )["RouteTables"]
-    LOGGER.info(f"List of route tables: {route_tables}")
+
+def _delete_route_tables(ec2_client, inventory):
+    """Delete route(s), route table(s)
+    The main route table is deleted together with the vpc.
+    """
+    route_tables = inventory.items("route_tables")
     for route_table in route_tables:
-        for route in route_table["Routes"]:
-            if route["Origin"] == "CreateRoute":
+        if any(main for _, main, _ in route_table.associations):
+            continue
+        for destination, origin in route_table.routes:
+            if origin == "CreateRoute":
                 ec2_client.delete_route(
-                    RouteTableId=route_table["RouteTableId"],
-                    DestinationCidrBlock=route["DestinationCidrBlock"],
+                    RouteTableId=route_table.resource_id,
+                    DestinationCidrBlock=destination,
                 )
         try:
             ec2_client.delete_route_table(
-                RouteTableId=route_table["RouteTableId"]
+                RouteTableId=route_table.resource_id
             )
-            LOGGER.info("Deleting route tables")
+            LOGGER.info(f"Deleting route table {route_table.resource_id}")
+            inventory.remove("route_tables", route_table.resource_id)
         except ClientError as error:
             logging.error(error)
 
-    # Delete routing table(s) without subnet associations
-    try:
-        for route_table in route_tables:
-            if route_table["Associations"] == []:
-                ec2_client.delete_route_table(
-                    RouteTableId=route_table["RouteTableId"]
-                )
-    except ClientError as error:
-        logging.error(error)
 
-    # Finally, delete the vpc
+def _delete_vpc(ec2_client, inventory):
+    """Finally, delete the vpc
+    """
+    vpc_id, aws_region = inventory.vpc_id, inventory.aws_region
     try:
         ec2_client.delete_vpc(VpcId=vpc_id)
         LOGGER.info(f"Destroying {vpc_id} in {aws_region} !!")
@@ -391,6 +312,118 @@ def delete_vpc(vpc_id, aws_region):
         sys.exit()
 
 
+# The teardown dependency graph: (phase name, function, phases to run first)
+VPC_PHASES = (
+    ("dhcp_options", _associate_default_dhcp_options, ()),
+    ("nat_gateways", _delete_nat_gateways, ()),
+    ("vpc_endpoints", _delete_vpc_endpoints, ()),
+    ("vpc_peering", _delete_vpc_peering_connections, ()),
+    ("vpn_gateways", _detach_vpn_gateways, ()),
+    ("tgw_attachments", _delete_tgw_attachments, ()),
+    ("security_group_rules", _revoke_security_group_rules, ()),
+    ("route_table_associations", _disassociate_route_tables, ()),
+    ("elastic_ips", _release_elastic_ips, ("nat_gateways",)),
+    ("network_interfaces", _delete_network_interfaces,
+     ("nat_gateways", "vpc_endpoints", "tgw_attachments")),
+    ("internet_gateways", _delete_internet_gateways,
+     ("nat_gateways", "elastic_ips")),
+    ("security_groups", _delete_security_groups,
+     ("security_group_rules", "network_interfaces", "vpc_endpoints")),
+    ("subnets", _delete_subnets,
+     ("network_interfaces", "nat_gateways", "vpc_endpoints",
+      "tgw_attachments", "route_table_associations")),
+    ("network_acls", _delete_network_acls, ("subnets",)),
+    ("route_tables", _delete_route_tables,
+     ("route_table_associations", "subnets", "internet_gateways",
+      "nat_gateways", "vpc_peering", "vpn_gateways", "tgw_attachments")),
+    ("vpc", _delete_vpc,
+     ("dhcp_options", "internet_gateways", "security_groups", "subnets",
+      "network_acls", "route_tables", "vpc_peering", "vpn_gateways")),
+)
+
+
+# The inventory kinds every phase reads
+PHASE_KINDS = {
+    "dhcp_options": (),
+    "nat_gateways": ("nat_gateways", "addresses"),
+    "vpc_endpoints": ("vpc_endpoints",),
+    "vpc_peering": ("vpc_peering_connections",),
+    "vpn_gateways": ("vpn_gateways", "vpn_connections"),
+    "tgw_attachments": ("transit_gateway_vpc_attachments",),
+    "security_group_rules": ("security_groups",),
+    "route_table_associations": ("route_tables",),
+    "elastic_ips": ("addresses", "network_interfaces"),
+    "network_interfaces": ("network_interfaces", "nat_gateways"),
+    "internet_gateways": ("internet_gateways",),
+    "security_groups": ("security_groups",),
+    "subnets": ("subnets",),
+    "network_acls": ("network_acls",),
+    "route_tables": ("route_tables",),
+    "vpc": (),
+}
+
+
+def pending_kinds(completed):
+    """The inventory kinds still needed once the completed phases are
+    skipped.
+
+    :args:
+        completed (phase names)
+    :return:
+        set of kinds
+    """
+    return {kind for name, _, _ in VPC_PHASES if name not in completed
+            for kind in PHASE_KINDS[name]}
+
+
+def build_phases(ec2_client, inventory):
+    """Bind the teardown phases to the vpc inventory, every phase timed
+    by teardown_metrics and traced by teardown_tracing.
+
+    :args:
+        ec2_client, inventory
+    :return:
+        list of Phase
+    """
+    return [
+        Phase(name, teardown_tracing.traced(
+            name, teardown_metrics.timed(
+                inventory.journal_key, name,
+                functools.partial(func, ec2_client, inventory),
+            ), run=inventory.journal_key,
+        ), requires)
+        for name, func, requires in VPC_PHASES
+    ]
+
+
+def delete_vpc(vpc_id, aws_region, max_workers=None):
+    """This function is describes and removes all VPC dependencies first
+    and then deletes the VPC itself. Independent phases run concurrently,
+    see VPC_PHASES for the dependency graph. All the phases read from
+    (and update) the shared vpc inventory. Every phase is recorded in the
+    teardown journal and the completed ones are skipped on --resume.
+
+    :args:
+        vpc_id, aws_region, max_workers
+    """
+    ec2_client = aws_session.get_client('ec2', aws_region)
+    journal = teardown_journal.get_journal()
+    journal_key = teardown_journal.vpc_key(vpc_id, aws_region)
+    completed = journal.completed_steps(journal_key)
+    inventory = vpc_inventory.get_inventory(
+        vpc_id, aws_region, max_workers, pending_kinds(completed)
+    )
+
+    def on_finished(name, error):
+        if error is None:
+            journal.mark_step(journal_key, name, "done")
+        else:
+            journal.mark_step(journal_key, name, "failed", repr(error))
+
+    run_phases(build_phases(ec2_client, inventory), max_workers=max_workers,
+               completed=completed, on_finished=on_finished)
+
+
 def main(vpc_id, aws_region):
     ''' Main function
     '''
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""VPC peering teardown stage of delete_vpc.
+    1. The open peering connections of the vpc, as requester and as
+       accepter, come from one paginated pass (see
+       aws_discovery.iter_vpc_peering_connections). The closed ones
+       (deleted, rejected, failed, expired) are never touched.
+    2. Every deletion is sent at once.
+    3. The pending peerings are polled in batches, a multi-ID
+       describe_vpc_peering_connections call per poll, until they are all
+       closed or gone.
+"""
+
+# Standard Packages
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party packages
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_discovery
+import aws_session
+import aws_waiters
+import teardown_tracing
+from aws_waiters import WaitTimeoutError
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Filter values per describe_vpc_peering_connections call
+MAX_IDS_PER_CALL = 200
+
+# Errors meaning the peering is already gone
+NOT_FOUND_CODES = ("InvalidVpcPeeringConnectionID.NotFound",
+                   "InvalidVpcPeeringConnectionId.NotFound")
+
+
+def describe_states(ec2_client, peering_ids):
+    """The state of the peerings, a multi-ID call per MAX_IDS_PER_CALL
+    peerings. The peerings that are gone aren't in the result.
+
+    :args:
+        ec2_client, peering_ids
+    :return:
+        {peering_id: state}
+    """
+    peering_ids = sorted(peering_ids)
+    states = {}
+    for start in range(0, len(peering_ids), MAX_IDS_PER_CALL):
+        for peering in aws_discovery.iter_items(
+                ec2_client, "describe_vpc_peering_connections",
+                "VpcPeeringConnections",
+                Filters=[{"Name": "vpc-peering-connection-id",
+                          "Values": peering_ids[
+                              start:start + MAX_IDS_PER_CALL]}]):
+            states[peering["VpcPeeringConnectionId"]] = \
+                peering["Status"]["Code"]
+    return states
+
+
+def _delete(ec2_client, peering_id):
+    try:
+        ec2_client.delete_vpc_peering_connection(
+            VpcPeeringConnectionId=peering_id
+        )
+        LOGGER.info(f"Deleting the peering connection ==> {peering_id}")
+    except ClientError as error:
+        if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+            raise
+
+
+def delete_vpc_peering_connections(ec2_client, inventory, timeout=None):
+    """Delete the open peering connections of the vpc, see the module
+    docstring. A timeout or a failing peering isn't fatal, the vpc
+    deletion reports whatever is left.
+
+    :args:
+        ec2_client, inventory, timeout
+    """
+    peerings = [peering for peering
+                in inventory.items("vpc_peering_connections")
+                if peering.state in aws_discovery.PEERING_OPEN_STATES]
+    LOGGER.info(f"VPC-Peer-Conns are: {peerings}")
+    if not peerings:
+        LOGGER.info("There is no peering connection...")
+        return
+
+    failed = []
+
+    def delete(peering_id):
+        # Errors are logged per peering, the rest go on
+        try:
+            _delete(ec2_client, peering_id)
+        except ClientError as error:
+            LOGGER.error(error)
+            failed.append(peering_id)
+
+    peering_ids = [peering.resource_id for peering in peerings]
+    max_workers = min(aws_session.max_pool_connections(), len(peering_ids))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(teardown_tracing.bind(delete), peering_ids))
+    pending = set(peering_ids) - set(failed)
+
+    def all_deleted():
+        states = describe_states(ec2_client, pending)
+        for peering_id in sorted(pending):
+            if states.get(peering_id) not in \
+                    aws_discovery.PEERING_OPEN_STATES + ("deleting",):
+                pending.discard(peering_id)
+                inventory.remove("vpc_peering_connections", peering_id)
+        return not pending
+
+    try:
+        aws_waiters.wait_until(
+            all_deleted, "vpc_peering_connection",
+            f"the deletion of {len(peering_ids)} peering(s) of "
+            f"{inventory.vpc_id}",
+            timeout=timeout,
+        )
+    except WaitTimeoutError as error:
+        LOGGER.error(f"{error}: {', '.join(sorted(pending))}")
+    if failed:
+        LOGGER.error(f"Unable to delete {len(failed)} peering(s) of "
+                     f"{inventory.vpc_id}")
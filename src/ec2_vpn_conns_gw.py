@@ -1,20 +1,37 @@
 #!/usr/bin/env python
 
-"""After deleting a VPC, we've to clean up rest of the "zombie" resources
-that were associated/attached to the deleted VPC,
-such as VPN connections and VPN Gateway(s).
+"""VPN connections and VPN gateways of the decommissioned VPC.
+Everything is scoped to the vpc: vpc => VGW(s) (attachment.vpc-id filter)
+=> VPN connection(s) (vpn-gateway-id filter), nothing else in the region is
+touched.
+    1. detach_vpc() runs as a delete_vpc phase: the VPN connections are
+       deleted concurrently, then the VGWs are detached concurrently. The
+       connection states and the VGW attachment states are polled in
+       batches, a multi-ID describe call per poll, so the phase takes about
+       one AWS state change whatever the number of connections.
+    2. After deleting a VPC, main() cleans up the VGWs it detached (see
+       detached_gateways()), i.e. the "zombie" resources left in the region:
+       the remaining connections and then the VGWs themselves.
+The customer gateways of the deleted connections are recorded in the journal
+(see released_customer_gateways()), for ec2_customer_gw.
 """
 
 # Standard Packages
 import logging
-import os
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Third party packages
-import boto3
 from botocore.exceptions import ClientError
 
+# Local imports
+import aws_discovery
+import aws_session
+import aws_waiters
+import teardown_journal
+import teardown_tracing
+from aws_waiters import WaitTimeoutError
+
 # Sets up logging
 logger = logging.getLogger("root")
 FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
@@ -22,81 +39,288 @@ logging.basicConfig(format=FORMAT, level=logging.INFO)
 LOGGER = logging.getLogger("root")
 LOGGER.setLevel(logging.DEBUG)
 
+# Filter values per describe call
+MAX_IDS_PER_CALL = 200
+
+# Errors meaning the resource is already gone
+NOT_FOUND_CODES = ("InvalidVpnConnectionID.NotFound",
+                   "InvalidVpnGatewayID.NotFound",
+                   "InvalidVpnGatewayAttachment.NotFound")
+
+
+def _batches(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), MAX_IDS_PER_CALL):
+        yield ids[start:start + MAX_IDS_PER_CALL]
+
+
+def _run_concurrently(func, items):
+    # Run func over the items on the shared client pool, in the current
+    # span. Errors are logged per item, the failed items are returned.
+    failed = []
+
+    def call(item):
+        try:
+            func(item)
+        except ClientError as error:
+            if error.response['Error']['Code'] not in NOT_FOUND_CODES:
+                LOGGER.error(error)
+                failed.append(item)
+
+    if items:
+        max_workers = min(aws_session.max_pool_connections(), len(items))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(teardown_tracing.bind(call), items))
+    return set(failed)
+
+
+def describe_connection_states(ec2_client, vpn_conn_ids):
+    """The state of the VPN connections, a multi-ID call per
+    MAX_IDS_PER_CALL connections. The ones that are gone aren't in the
+    result.
+
+    :args:
+        ec2_client, vpn_conn_ids
+    :return:
+        {vpn_conn_id: state}
+    """
+    states = {}
+    for batch in _batches(vpn_conn_ids):
+        for vpn_con in aws_discovery.iter_items(
+                ec2_client, "describe_vpn_connections", "VpnConnections",
+                Filters=[{"Name": "vpn-connection-id", "Values": batch}]):
+            states[vpn_con["VpnConnectionId"]] = vpn_con["State"]
+    return states
+
+
+def describe_attachment_states(ec2_client, vpn_gw_ids, vpc_id):
+    """The state of the attachment of the VGWs to the vpc, a multi-ID call
+    per MAX_IDS_PER_CALL VGWs. The VGWs that are gone aren't in the result.
+
+    :args:
+        ec2_client, vpn_gw_ids, vpc_id
+    :return:
+        {vpn_gw_id: attachment state, "detached" when there is none}
+    """
+    states = {}
+    for batch in _batches(vpn_gw_ids):
+        for vpn_gw in aws_discovery.iter_items(
+                ec2_client, "describe_vpn_gateways", "VpnGateways",
+                Filters=[{"Name": "vpn-gateway-id", "Values": batch}]):
+            states[vpn_gw["VpnGatewayId"]] = next(
+                (attachment["State"]
+                 for attachment in vpn_gw.get("VpcAttachments", [])
+                 if attachment["VpcId"] == vpc_id), "detached"
+            )
+    return states
+
+
+def delete_vpn_connections(ec2_client, vpn_cons, description):
+    """Delete the VPN connections concurrently and poll them in batches
+    until they are all deleted.
+
+    :args:
+        ec2_client, vpn_cons (aws_discovery.VpnConnectionRecord),
+        description
+    :return:
+        (set of deleted ids, set of ids left)
+    """
+    def delete(vpn_con_id):
+        ec2_client.delete_vpn_connection(VpnConnectionId=vpn_con_id)
+        LOGGER.info(f"Deleting the {vpn_con_id}")
+
+    failed = _run_concurrently(
+        delete, [vpn_con.resource_id for vpn_con in vpn_cons
+                 if vpn_con.state not in ("deleting", "deleted")]
+    )
+    pending = {vpn_con.resource_id for vpn_con in vpn_cons
+               if vpn_con.state != "deleted"} - failed
+    deleted = set()
+
+    def all_deleted():
+        states = describe_connection_states(ec2_client, pending)
+        for vpn_con_id in sorted(pending):
+            if states.get(vpn_con_id, "deleted") == "deleted":
+                pending.discard(vpn_con_id)
+                deleted.add(vpn_con_id)
+        return not pending
+
+    if pending:
+        try:
+            aws_waiters.wait_until(all_deleted, "vpn_connection",
+                                   f"the deletion of {description}")
+        except WaitTimeoutError as error:
+            LOGGER.error(f"{error}: {', '.join(sorted(pending))}")
+    return deleted, pending | failed
+
+
+def _release_customer_gateways(aws_region, vpn_cons, deleted):
+    # Record the customer gateways the deleted connections leave behind,
+    # for the region cleanup
+    run_key = teardown_journal.region_key(aws_region)
+    journal = teardown_journal.get_journal()
+    for vpn_con in vpn_cons:
+        if vpn_con.customer_gateway_id and (
+                vpn_con.resource_id in deleted or vpn_con.state == "deleted"):
+            journal.mark_resource(run_key, "customer_gateways",
+                                  vpn_con.customer_gateway_id,
+                                  status="released")
+
+
+def released_customer_gateways(aws_region):
+    """The customer gateways of the VPN connections deleted in the region,
+    by the vpc phases and by main().
 
-def delete_vpn_gw(aws_region):
-    """A function to delete any available VPN connectons and
-    then deletes VPN Gateway(s).
-    
     :args:
         aws_region
+    :return:
+        sorted list of customer gateway ids
     """
-    # Set up boto3 session
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
-        )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    ec2_client = session.client('ec2')
+    return sorted(teardown_journal.get_journal().resources(
+        teardown_journal.region_key(aws_region), "customer_gateways",
+        "released"
+    ))
 
-    # Delete VPN connection(s)
-    filters = [
-        {"Name": "state", "Values": ["available"]},
-    ]
-    vpn_conns = ec2_client.describe_vpn_connections(
-        Filters=filters
-    )["VpnConnections"]
-    for vpn_con in vpn_conns:
-        if 'available' in vpn_con['State']:
-            ec2_client.delete_vpn_connection(
-                VpnConnectionId=vpn_con["VpnConnectionId"],
-                # DryRun = True
+
+def detach_vpn_gateways(ec2_client, vpn_gw_ids, vpc_id):
+    """Detach the VGWs from the vpc concurrently and poll their attachment
+    states in batches until they are all detached.
+
+    :args:
+        ec2_client, vpn_gw_ids, vpc_id
+    :return:
+        (set of detached ids, set of ids left)
+    """
+    def detach(vpn_gw_id):
+        ec2_client.detach_vpn_gateway(VpnGatewayId=vpn_gw_id, VpcId=vpc_id)
+        LOGGER.info(f"Detaching the ==> {vpn_gw_id}")
+
+    failed = _run_concurrently(detach, list(vpn_gw_ids))
+    pending = set(vpn_gw_ids) - failed
+    detached = set()
+
+    def all_detached():
+        states = describe_attachment_states(ec2_client, pending, vpc_id)
+        for vpn_gw_id in sorted(pending):
+            if states.get(vpn_gw_id, "detached") == "detached":
+                pending.discard(vpn_gw_id)
+                detached.add(vpn_gw_id)
+        return not pending
+
+    if pending:
+        try:
+            aws_waiters.wait_until(
+                all_detached, "vpn_gateway_attachment",
+                f"the detach of {len(pending)} VGW(s) from {vpc_id}",
             )
-            LOGGER.info(f"Deleting the {vpn_con['VpnConnectionId']}")
-            time.sleep(60)
-        else:
-            LOGGER.info(f"The VpnGateway Connection doesn't exist \
-                        in the {aws_region} region"
-                        )
+        except WaitTimeoutError as error:
+            LOGGER.error(f"{error}: {', '.join(sorted(pending))}")
+    return detached, pending | failed
+
+
+def detach_vpc(ec2_client, inventory):
+    """Delete the VPN connection(s) of the vpc and detach its VPN
+    Gateway(s). The detached VGWs are recorded in the journal for main().
+    Raises RuntimeError when some are left, the scheduler reports the
+    failed phase.
+
+    :args:
+        ec2_client, inventory
+    """
+    vpc_id = inventory.vpc_id
+    vpn_conns = inventory.items("vpn_connections")
+    LOGGER.info(f"List of VPN connections: {vpn_conns}")
+    deleted, left = delete_vpn_connections(
+        ec2_client, vpn_conns, f"{len(vpn_conns)} VPN connection(s) of "
+        f"{vpc_id}"
+    )
+    for vpn_con_id in deleted:
+        inventory.update("vpn_connections", vpn_con_id, state="deleted")
+    _release_customer_gateways(inventory.aws_region, vpn_conns, deleted)
+    if left:
+        raise RuntimeError(f"Unable to delete the VPN connection(s) "
+                           f"{', '.join(sorted(left))} of {vpc_id}")
+
+    vpn_gws = inventory.items("vpn_gateways")
+    LOGGER.info(f"List of VPN gateways: {vpn_gws}")
+    detached, left = detach_vpn_gateways(
+        ec2_client, [vpn_gw.resource_id for vpn_gw in vpn_gws], vpc_id
+    )
+    for vpn_gw_id in detached:
+        inventory.remove("vpn_gateways", vpn_gw_id)
+    if left:
+        raise RuntimeError(f"Unable to detach the VGW(s) "
+                           f"{', '.join(sorted(left))} from {vpc_id}")
+
+
+def detached_gateways(vpc_id, aws_region):
+    """The VGWs detach_vpc() detached from the vpc, in this run or in the
+    run it resumes.
+
+    :args:
+        vpc_id, aws_region
+    :return:
+        sorted list of VGW ids
+    """
+    return sorted(teardown_journal.get_journal().deleted_resources(
+        teardown_journal.vpc_key(vpc_id, aws_region), "vpn_gateways"
+    ))
+
+
+def delete_vpn_gw(aws_region, vpn_gw_ids):
+    """Delete the remaining VPN connections of the VGWs, and then the VGWs.
+
+    :args:
+        aws_region, vpn_gw_ids
+    """
+    if not vpn_gw_ids:
+        LOGGER.info(f"There is no VGW to delete in the {aws_region} region")
+        return
+    ec2_client = aws_session.get_client('ec2', aws_region)
+
+    # Delete VPN connection(s)
+    vpn_conns = list(aws_discovery.iter_vpn_connections(ec2_client,
+                                                        vpn_gw_ids))
+    deleted, left = delete_vpn_connections(
+        ec2_client, vpn_conns, f"the VPN connection(s) of "
+        f"{', '.join(sorted(vpn_gw_ids))}"
+    )
+    _release_customer_gateways(aws_region, vpn_conns, deleted)
+    if left:
+        sys.exit(f"Unable to delete the VPN connection(s) "
+                 f"{', '.join(sorted(left))} in {aws_region}")
 
     # Delete the VPN Gateway(s)
-    try:
-        vpn_gws = ec2_client.describe_vpn_gateways(
-            Filters=[
-                {
-                    'Name': 'state',
-                    'Values': ['available'],
-                }
-            ]
-        )['VpnGateways']
-        for vpn_gw in vpn_gws:
-            if 'available' in vpn_gw['State']:
-                ec2_client.delete_vpn_gateway(
-                    VpnGatewayId=vpn_gw['VpnGatewayId'],
-                    # DryRun = True
-                )
-                LOGGER.info(f"Deleting the ==> {vpn_gw['VpnGatewayId']}")
-    except ClientError as error:
-        LOGGER.error(error)
-        LOGGER.error(f"The VGW doesn't exist \
-                      in the {aws_region} region."
-                     )
-        sys.exit()
-
-
-def main(aws_region):
+    vpn_gws = [
+        vpn_gw["VpnGatewayId"]
+        for batch in _batches(vpn_gw_ids)
+        for vpn_gw in aws_discovery.iter_items(
+            ec2_client, "describe_vpn_gateways", "VpnGateways",
+            Filters=[{"Name": "vpn-gateway-id", "Values": batch},
+                     {"Name": "state", "Values": ["available"]}]
+        )
+    ]
+
+    def delete(vpn_gw_id):
+        ec2_client.delete_vpn_gateway(VpnGatewayId=vpn_gw_id)
+        LOGGER.info(f"Deleting the ==> {vpn_gw_id}")
+
+    failed = _run_concurrently(delete, vpn_gws)
+    if failed:
+        sys.exit(f"Unable to delete the VGW(s) {', '.join(sorted(failed))} "
+                 f"in {aws_region}")
+
+
+def main(aws_region, vpn_gw_ids=()):
     """ A main function
     :args:
-        aws_region, cust_gw
+        aws_region, vpn_gw_ids
     """
-    delete_vpn_gw(aws_region)
+    delete_vpn_gw(aws_region, vpn_gw_ids)
 
 
 if __name__ == "__main__":
     try:
-        main(sys.argv[1])
+        main(sys.argv[1], sys.argv[2:])
     except KeyboardInterrupt:
         exit(0)
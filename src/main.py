@@ -9,6 +9,21 @@
     6. Calls ec2_transit_gw module
     7. Calls ec2_dynamodb_table module
     8. Calls s3_bucket module
+With --batch, steps 2-3 run concurrently for every VPC of the batch file.
+Steps 4-7 run once per region, every region concurrently (see region_fanout),
+and step 8 only deletes the S3 buckets of those regions. With --all_regions
+every enabled region of the account is cleaned up.
+Every completed step is recorded in a journal (see teardown_journal) and
+--resume goes on from where a failed run stopped.
+With --metrics_dir, the API calls and the time of every step are written
+as JSON and as a Prometheus textfile (see teardown_metrics), and with
+--trace_file the trace spans of the run as OTLP JSON (see teardown_tracing).
+With --plan, nothing is changed and the teardown plan is written as JSON
+(see teardown_plan).
+Every step imports its modules when it runs, so parsing the command line
+doesn't load the AWS SDK or the service models. The start-up time is checked
+against a budget and --profile_imports reports what every import costs (see
+startup_profile).
 """
 
 # Standard packages
@@ -17,17 +32,16 @@ import logging
 import os
 import sys
 
-# Third party packages
-from botocore.exceptions import ClientError
-
 # Local imports
-import ec2_get_status
-import ec2_vpn_conns_gw
-import ec2_customer_gw
-import ec2_transit_gw
-import ec2_dynamodb
-import s3_bucket
-from ec2_vpc import vpc_exists, delete_vpc
+# The start-up clock and the import profile, before the other imports
+import startup_profile
+import aws_rate_limiter
+import aws_session
+import batch_runner
+import teardown_journal
+import teardown_metrics
+import teardown_scheduler
+import teardown_tracing
 
 # Sets up logging
 logger = logging.getLogger("root")
@@ -44,10 +58,10 @@ def parse_args(argv):
     parser._action_groups.pop()
     required = parser.add_argument_group("required arguments")
     required.add_argument(
-        "--vpc_id", required=True, help="Please include the vpc_id"
+        "--vpc_id", help="Please include the vpc_id"
     )
     required.add_argument(
-        "--region", required=True, help="Please provide the AWS region"
+        "--region", help="Please provide the AWS region"
     )
 
     optional = parser.add_argument_group("optional arguments")
@@ -57,29 +71,154 @@ def parse_args(argv):
     optional.add_argument(
         "--tgw_id", help="The transit_gw_id"
     )
-    
-    args = parser.parse_args()
+    optional.add_argument(
+        "--max_workers", type=batch_runner.positive_int,
+        default=teardown_scheduler.MAX_WORKERS,
+        help="The number of concurrent teardown workers"
+    )
+    optional.add_argument(
+        "--all_regions", action="store_true",
+        help="Clean up the VPN, gateways and DynamoDB leftovers in every \
+             enabled region instead of the vpc region(s) only"
+    )
+    optional.add_argument(
+        "--s3_prefix", nargs="+",
+        help="Only delete the S3 buckets with one of these name prefixes"
+    )
+    optional.add_argument(
+        "--s3_tag", nargs="+", metavar="KEY[=VALUE]",
+        help="Only delete the S3 buckets with all of these tags"
+    )
+    optional.add_argument(
+        "--dynamodb_prefix", nargs="+",
+        help="Only delete the DynamoDB tables with one of these prefixes"
+    )
+    optional.add_argument(
+        "--dynamodb_tag", nargs="+", metavar="KEY[=VALUE]",
+        help="Only delete the DynamoDB tables with all of these tags"
+    )
+
+    journal = parser.add_argument_group("journal arguments")
+    journal.add_argument(
+        "--journal", metavar="FILE", default=teardown_journal.JOURNAL_PATH,
+        help="The SQLite file the completed steps are recorded in"
+    )
+    journal.add_argument(
+        "--resume", action="store_true",
+        help="Skip the steps the journal has as completed and go on from \
+             the failed one"
+    )
+
+    metrics = parser.add_argument_group("metrics arguments")
+    metrics.add_argument(
+        "--metrics_dir", metavar="DIR",
+        default=os.environ.get("TEARDOWN_METRICS_DIR"),
+        help="Write the API call and phase timing metrics of the run to \
+             the DIR, as JSON and as a Prometheus textfile"
+    )
+    metrics.add_argument(
+        "--trace_file", metavar="FILE",
+        default=os.environ.get("TEARDOWN_TRACE_FILE"),
+        help="Write the trace spans of every step, deletion and wait of \
+             the run to the FILE, as OTLP JSON"
+    )
+    metrics.add_argument(
+        "--profile_imports", action="store_true",
+        help="Write the time of the slowest module imports to stderr at \
+             the exit, see startup_profile"
+    )
+
+    plan = parser.add_argument_group("plan arguments")
+    plan.add_argument(
+        "--plan", action="store_true",
+        help="Only discover what would be deleted and print the teardown \
+             plan as JSON, nothing is changed"
+    )
+    plan.add_argument(
+        "--plan_output", metavar="FILE", default="-",
+        help="Write the plan to the FILE instead of stdout"
+    )
+
+    batch = parser.add_argument_group("batch arguments")
+    batch.add_argument(
+        "--batch", metavar="FILE",
+        help="Decommission every 'vpc_id,region[,cust_gw_id[,tgw_id]]' \
+             line of the FILE ('-' for stdin) instead of --vpc_id"
+    )
+    batch.add_argument(
+        "--max_jobs", type=batch_runner.positive_int,
+        default=batch_runner.MAX_JOBS,
+        help="The number of VPCs decommissioned concurrently"
+    )
+    batch.add_argument(
+        "--max_jobs_per_region", type=batch_runner.positive_int,
+        default=batch_runner.MAX_JOBS_PER_REGION,
+        help="The number of VPCs decommissioned concurrently per region"
+    )
+
+    args = parser.parse_args(argv)
+    if not args.batch:
+        if not args.vpc_id:
+            parser.error("the --vpc_id (or --batch) argument is required")
+        # Fall back to the 'AWS_DEFAULT_REGION' environment variable
+        args.region = args.region or os.environ.get("AWS_DEFAULT_REGION")
+        if not args.region:
+            parser.error("the --region argument is required")
     return args
 
 
-if __name__ == "__main__":
-    args = parse_args(sys.argv[1:])
+def metric_labels(args):
+    """The labels identifying the run in the exported metrics.
 
-    # Assign aws_region argument
-    if args.region:
-        aws_region = args.region
-    else:
-        try:
-            aws_region = os.environ["AWS_DEFAULT_REGION"]
-        except KeyError as error:
-            logging.error(error)
-            LOGGER.info("You must set the environment variable \
-                        for the 'AWS_DEFAULT_REGION'")
-        sys.exit()
+    :args:
+        args
+    :return:
+        dict
+    """
+    if args.batch:
+        return {"batch": os.path.basename(args.batch)}
+    return {"vpc_id": args.vpc_id, "region": args.region}
+
+
+def teardown_vpc(vpc_id, aws_region, max_workers=None):
+    """Delete the vpc with all its dependencies.
+
+    :args:
+        vpc_id, aws_region, max_workers
+    """
+    with teardown_tracing.span("teardown_vpc", vpc_id=vpc_id,
+                               region=aws_region):
+        _teardown_vpc(vpc_id, aws_region, max_workers)
+
+
+def _teardown_vpc(vpc_id, aws_region, max_workers):
+    from ec2_vpc import delete_vpc
+
+    journal_key = teardown_journal.vpc_key(vpc_id, aws_region)
+    if teardown_journal.get_journal().step_done(journal_key, "vpc"):
+        LOGGER.info(f"The {vpc_id} is already deleted, skipping...")
+        return
+    teardown_journal.run_step(journal_key, "preflight", preflight,
+                              vpc_id, aws_region)
+
+    # Run the delete program
+    LOGGER.info(f"Calling delete ==> {vpc_id}...")
+    delete_vpc(vpc_id=vpc_id, aws_region=aws_region,
+               max_workers=max_workers)
+
+
+def preflight(vpc_id, aws_region):
+    """Check the vpc exists and has no EC2 or RDS instances left.
+
+    :args:
+        vpc_id, aws_region
+    """
+    from botocore.exceptions import ClientError
+    import ec2_get_status
+    from ec2_vpc import vpc_exists
 
     # Check for the vpc_id in specified region
     try:
-        vpc_id = args.vpc_id
         if vpc_exists(vpc_id, aws_region):
             LOGGER.info(f"Found the {vpc_id} in the {aws_region}.\
                          Invoke deletion actions...")
@@ -91,30 +230,215 @@ if __name__ == "__main__":
     LOGGER.info(f"Calling ec2_get_status...")
     ec2_get_status.main(vpc_id, aws_region)
 
-    # Assign vpc_id argument and run the delete program
-    vpc_id = args.vpc_id
-    LOGGER.info(f"Calling delete ==> {vpc_id}...")
-    delete_vpc(vpc_id=vpc_id, aws_region=aws_region)
 
-    # Delete "zombie" vpn connections and "detached" vpn gateway(s)
-    LOGGER.info(f"Calling delete vpn_conns_gws...")
-    ec2_vpn_conns_gw.main(aws_region)
+def cleanup_regions(regions, cust_gw_ids=(), tgw_ids=(), vpn_gw_ids=(),
+                    dynamodb_tags=None, dynamodb_prefixes=None):
+    """Delete the region wide leftovers of the decommissioned vpc(s),
+    every region concurrently.
 
-    # Assign cust_gw argument and delete the customer gateway
-    cust_gw = args.cust_gw_id
-    LOGGER.info(f"Calling delete ==> {cust_gw}...")
-    ec2_customer_gw.main(aws_region, cust_gw)
+    :args:
+        regions, cust_gw_ids, tgw_ids, vpn_gw_ids (lists, or dicts keyed by
+        region), dynamodb_tags, dynamodb_prefixes
+    :return:
+        True if the cleanup succeeded in every region
+    """
+    import region_fanout
 
-    # Delete transit gateway
-    tgw_id = args.tgw_id
-    LOGGER.info(f"Calling delete ==> {tgw_id}...")
-    ec2_transit_gw.main(aws_region, tgw_id)
+    results = region_fanout.run_fanout(sorted(regions), cust_gw_ids, tgw_ids,
+                                       vpn_gw_ids=vpn_gw_ids,
+                                       dynamodb_tags=dynamodb_tags,
+                                       dynamodb_prefixes=dynamodb_prefixes)
+    region_fanout.print_results(results)
+    return all(result.ok for result in results)
 
-    # Delete DynamoDB table
-    LOGGER.info(f"Calling delete dynamodb...")
-    ec2_dynamodb.main(aws_region)
+
+def dynamodb_filters(args):
+    """The filters of the DynamoDB tables to delete.
+
+    :args:
+        args
+    :return:
+        {"dynamodb_tags": dict, "dynamodb_prefixes": list or None}
+    """
+    import s3_bucket_index
+
+    return {"dynamodb_tags": s3_bucket_index.parse_tags(args.dynamodb_tag),
+            "dynamodb_prefixes": args.dynamodb_prefix}
+
+
+def cleanup_account(regions, args):
+    """Delete the S3 buckets of the decommissioned vpc(s) regions.
+
+    :args:
+        regions, args
+    """
+    import s3_bucket
+    import s3_bucket_index
 
     # Delete S3 bucket
     LOGGER.info(f"Calling delete s3_bucket...")
-    s3_bucket.main()
-    
\ No newline at end of file
+    teardown_journal.run_step(
+        teardown_journal.ACCOUNT_KEY, "s3_bucket", s3_bucket.main,
+        sorted(regions), s3_bucket_index.parse_tags(args.s3_tag),
+        args.s3_prefix,
+    )
+
+
+def gateway_ids(jobs):
+    """The customer and transit gateway ids of the jobs per region.
+
+    :args:
+        jobs
+    :return:
+        ({region: cust_gw_ids}, {region: tgw_ids})
+    """
+    cust_gw_ids, tgw_ids = {}, {}
+    for job in jobs:
+        if job.cust_gw_id:
+            cust_gw_ids.setdefault(job.aws_region, []).append(job.cust_gw_id)
+        if job.tgw_id:
+            tgw_ids.setdefault(job.aws_region, []).append(job.tgw_id)
+    return cust_gw_ids, tgw_ids
+
+
+def vpn_gateway_ids(jobs):
+    """The VGW ids detached from the vpcs of the jobs per region.
+
+    :args:
+        jobs
+    :return:
+        {region: vpn_gw_ids}
+    """
+    import ec2_vpn_conns_gw
+
+    vpn_gw_ids = {}
+    for job in jobs:
+        vpn_gw_ids.setdefault(job.aws_region, []).extend(
+            ec2_vpn_conns_gw.detached_gateways(job.vpc_id, job.aws_region)
+        )
+    return vpn_gw_ids
+
+
+def run_batch(args):
+    """Decommission every vpc of the batch file concurrently.
+
+    :args:
+        args
+    :return:
+        process exit code
+    """
+    import region_fanout
+
+    jobs = batch_runner.read_jobs(args.batch)
+    LOGGER.info(f"Decommissioning {len(jobs)} vpc(s) in batch mode...")
+
+    def teardown(job):
+        teardown_vpc(job.vpc_id, job.aws_region,
+                     max_workers=args.max_workers)
+
+    batch_runner.run_batch(jobs, teardown, max_jobs=args.max_jobs,
+                           max_jobs_per_region=args.max_jobs_per_region)
+
+    # The region/account wide cleanup only runs where every vpc is gone
+    failed_regions = {job.aws_region for job in jobs if job.status != "done"}
+    for aws_region in sorted(failed_regions):
+        LOGGER.error(f"Skipping the cleanup of {aws_region}, "
+                     f"some vpc(s) weren't decommissioned")
+    done_jobs = [job for job in jobs if job.aws_region not in failed_regions]
+    regions = {job.aws_region for job in done_jobs}
+    if args.all_regions:
+        regions.update(set(region_fanout.enabled_regions()) - failed_regions)
+    cleaned = True
+    if regions:
+        cust_gw_ids, tgw_ids = gateway_ids(done_jobs)
+        cleaned = cleanup_regions(regions, cust_gw_ids, tgw_ids,
+                                  vpn_gateway_ids(done_jobs),
+                                  **dynamodb_filters(args))
+    if jobs and cleaned and not failed_regions:
+        cleanup_account(regions, args)
+
+    batch_runner.print_summary(jobs)
+    return 0 if cleaned and not failed_regions else 1
+
+
+def plan_run(args):
+    """Write the teardown plan of the run, without changing anything.
+
+    :args:
+        args
+    """
+    import region_fanout
+    import s3_bucket_index
+    import teardown_plan
+
+    if args.batch:
+        jobs = batch_runner.read_jobs(args.batch)
+    else:
+        jobs = [batch_runner.BatchJob(args.vpc_id, args.region,
+                                      args.cust_gw_id, args.tgw_id)]
+    regions = {job.aws_region for job in jobs}
+    if args.all_regions:
+        regions.update(region_fanout.enabled_regions())
+    cust_gw_ids, tgw_ids = gateway_ids(jobs)
+    plan = teardown_plan.build_plan(
+        [(job.vpc_id, job.aws_region) for job in jobs], regions,
+        cust_gw_ids, tgw_ids, s3_bucket_index.parse_tags(args.s3_tag),
+        args.s3_prefix, max_workers=args.max_workers,
+        max_jobs=args.max_jobs if args.batch else 1,
+        **dynamodb_filters(args)
+    )
+    teardown_plan.write_plan(plan, args.plan_output)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
+    # Size the shared client pool for the phase workers of every job, see
+    # aws_session.max_pool_connections()
+    aws_session.configure(
+        args.max_workers * (args.max_jobs if args.batch else 1)
+    )
+
+    if args.plan:
+        startup_profile.first_step("plan")
+        plan_run(args)
+        sys.exit(0)
+
+    teardown_journal.configure(args.journal, args.resume)
+    labels = metric_labels(args)
+    teardown_metrics.get_metrics().labels.update(labels)
+    teardown_tracing.configure(bool(args.trace_file))
+    startup_profile.first_step("batch" if args.batch else "teardown_vpc",
+                               teardown_metrics.get_metrics())
+
+    try:
+        with teardown_tracing.span("teardown", **labels):
+            if args.batch:
+                sys.exit(run_batch(args))
+
+            teardown_vpc(args.vpc_id, args.region,
+                         max_workers=args.max_workers)
+
+            import ec2_vpn_conns_gw
+            import region_fanout
+
+            regions = {args.region}
+            if args.all_regions:
+                regions.update(region_fanout.enabled_regions())
+            # Keyed by region, the gateways are only in the vpc's region
+            cust_gw_ids, tgw_ids = gateway_ids([batch_runner.BatchJob(
+                args.vpc_id, args.region, args.cust_gw_id, args.tgw_id)])
+            if not cleanup_regions(
+                    regions, cust_gw_ids, tgw_ids,
+                    {args.region: ec2_vpn_conns_gw.detached_gateways(
+                        args.vpc_id, args.region)},
+                    **dynamodb_filters(args)):
+                sys.exit(1)
+            cleanup_account(regions, args)
+    finally:
+        # Calls, throttles and time queued behind the rate limiter
+        aws_rate_limiter.get_limiter().log_report()
+        if args.metrics_dir:
+            teardown_metrics.get_metrics().write(args.metrics_dir)
+        if args.trace_file:
+            teardown_tracing.get_tracer().write(args.trace_file, labels)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""Region fan-out for the region wide cleanup modules.
+The enabled regions of the account are looked up with describe_regions and
+the cleanup modules (VPN connections/gateways, customer gateways, transit
+gateways and DynamoDB) run in every region in parallel on a region-level
+worker pool. Inside a region the modules keep their order, since the
+customer gateways can only go once the VPN connections are gone. A full
+account sweep takes about as long as the slowest region.
+"""
+
+# Standard Packages
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+import aws_session
+import batch_runner
+import ec2_customer_gw
+import ec2_dynamodb
+import ec2_transit_gw
+import ec2_vpn_conns_gw
+import s3_bucket_index
+import teardown_journal
+import teardown_tracing
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Default number of regions cleaned up concurrently
+MAX_REGION_WORKERS = int(os.environ.get("TEARDOWN_MAX_REGIONS", "8"))
+
+# Region used to list the enabled regions when no region is configured
+DEFAULT_REGION = "us-east-1"
+
+# Cleanup steps, in the order they run inside a region
+STEPS = ("vpn_conns_gw", "customer_gw", "transit_gw", "dynamodb")
+
+
+class RegionResult(object):
+    """Outcome of the cleanup steps in one region.
+    Every step is "done", "failed", "skipped" (after a failed step) or
+    "-" (nothing requested).
+    """
+
+    def __init__(self, aws_region):
+        self.aws_region = aws_region
+        self.steps = OrderedDict((step, "-") for step in STEPS)
+        self.error = None
+        self.duration = 0.0
+
+    @property
+    def ok(self):
+        return "failed" not in self.steps.values()
+
+    def __repr__(self):
+        return f"RegionResult({self.aws_region}, {dict(self.steps)})"
+
+
+def enabled_regions():
+    """The regions enabled in the account.
+
+    :return:
+        sorted list of region names
+    """
+    ec2_client = aws_session.get_client(
+        'ec2', os.environ.get("AWS_DEFAULT_REGION", DEFAULT_REGION)
+    )
+    regions = ec2_client.describe_regions(
+        Filters=[
+            {
+                "Name": "opt-in-status",
+                "Values": ["opt-in-not-required", "opted-in"],
+            }
+        ]
+    )['Regions']
+    return sorted(region['RegionName'] for region in regions)
+
+
+def _steps(aws_region, cust_gw_ids, tgw_ids, vpn_gw_ids, dynamodb_tags,
+           dynamodb_prefixes):
+    # (step, journal step, function)
+    if vpn_gw_ids:
+        yield "vpn_conns_gw", "vpn_conns_gw", \
+            lambda: ec2_vpn_conns_gw.main(aws_region, vpn_gw_ids)
+    # Read once the VPN connections are gone, the steps run as they come
+    released_ids = ec2_vpn_conns_gw.released_customer_gateways(aws_region)
+    if cust_gw_ids or released_ids:
+        yield "customer_gw", "customer_gw", \
+            lambda: ec2_customer_gw.main(aws_region, cust_gw_ids,
+                                         released_ids)
+    if tgw_ids:
+        yield "transit_gw", "transit_gw", \
+            lambda: ec2_transit_gw.main(aws_region, tgw_ids)
+    yield "dynamodb", "dynamodb", \
+        lambda: ec2_dynamodb.main(aws_region, dynamodb_tags,
+                                  dynamodb_prefixes)
+
+
+def cleanup_region(aws_region, cust_gw_ids=(), tgw_ids=(), vpn_gw_ids=(),
+                   dynamodb_tags=None, dynamodb_prefixes=None):
+    """Run the cleanup steps in one region, one after another.
+    A failing step (including sys.exit()) stops the rest of the region.
+    The steps are recorded in the teardown journal, so the completed ones
+    are skipped on --resume.
+
+    :args:
+        aws_region, cust_gw_ids, tgw_ids, vpn_gw_ids (the VGWs detached
+        from the decommissioned vpc(s)), dynamodb_tags, dynamodb_prefixes
+        (the filters of the DynamoDB tables, see ec2_dynamodb)
+    :return:
+        RegionResult
+    """
+    with teardown_tracing.span("cleanup_region", region=aws_region):
+        return _cleanup_region(aws_region, cust_gw_ids, tgw_ids, vpn_gw_ids,
+                               dynamodb_tags, dynamodb_prefixes)
+
+
+def _cleanup_region(aws_region, cust_gw_ids, tgw_ids, vpn_gw_ids,
+                    dynamodb_tags, dynamodb_prefixes):
+    result = RegionResult(aws_region)
+    started = time.monotonic()
+    journal_key = teardown_journal.region_key(aws_region)
+    for step, journal_step, func in _steps(aws_region, cust_gw_ids, tgw_ids,
+                                           vpn_gw_ids, dynamodb_tags,
+                                           dynamodb_prefixes):
+        if not result.ok:
+            result.steps[step] = "skipped"
+            continue
+        LOGGER.info(f"Calling {step} in {aws_region}...")
+        try:
+            teardown_journal.run_step(journal_key, journal_step, func)
+            result.steps[step] = "done"
+        except SystemExit as error:
+            result.steps[step] = "failed"
+            result.error = str(error.code) if error.code is not None \
+                else f"{step} exited"
+        except Exception as error:
+            result.steps[step] = "failed"
+            result.error = repr(error)
+    result.duration = time.monotonic() - started
+    if not result.ok:
+        LOGGER.error(f"The cleanup of {aws_region} failed: {result.error}")
+    return result
+
+
+def region_ids(ids, aws_region):
+    # The gateway ids are either per region or the same for every region
+    return ids.get(aws_region, ()) if isinstance(ids, dict) else ids
+
+
+def run_fanout(regions, cust_gw_ids=(), tgw_ids=(), max_workers=None,
+               vpn_gw_ids=(), dynamodb_tags=None, dynamodb_prefixes=None):
+    """Run the cleanup of every region concurrently.
+
+    :args:
+        regions, cust_gw_ids, tgw_ids, vpn_gw_ids (lists, or dicts keyed by
+        region), max_workers, dynamodb_tags, dynamodb_prefixes
+    :return:
+        list of RegionResult, in the order of the regions
+    """
+    regions = list(regions)
+    if not regions:
+        return []
+    max_workers = min(max_workers or MAX_REGION_WORKERS, len(regions))
+    LOGGER.info(f"Cleaning up {len(regions)} region(s) with "
+                f"{max_workers} worker(s)...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            teardown_tracing.bind(lambda aws_region: cleanup_region(
+                aws_region,
+                region_ids(cust_gw_ids, aws_region),
+                region_ids(tgw_ids, aws_region),
+                region_ids(vpn_gw_ids, aws_region),
+                dynamodb_tags, dynamodb_prefixes,
+            )),
+            regions,
+        ))
+
+
+def print_results(results, stream=None):
+    """Print the per-region result table.
+
+    :args:
+        results, stream (defaults to stdout)
+    """
+    stream = stream or sys.stdout
+    header = "".join(f"{step:<14}" for step in STEPS)
+    stream.write(f"\n{'region':<16} {header}{'seconds':>9}  error\n")
+    for result in results:
+        steps = "".join(f"{status:<14}" for status in result.steps.values())
+        stream.write(f"{result.aws_region:<16} {steps}"
+                     f"{result.duration:>9.1f}  {result.error or ''}\n")
+    failed = [result for result in results if not result.ok]
+    slowest = max([result.duration for result in results] or [0.0])
+    stream.write(f"\n{len(results)} regions: {len(results) - len(failed)} "
+                 f"done, {len(failed)} failed, slowest {slowest:.1f}s\n")
+
+
+def main(regions=None, cust_gw_ids=(), tgw_ids=(), max_workers=None,
+         vpn_gw_ids=(), dynamodb_tags=None, dynamodb_prefixes=None):
+    """ A main function
+
+    :args:
+        regions (defaults to every enabled region), cust_gw_ids, tgw_ids,
+        max_workers, vpn_gw_ids, dynamodb_tags, dynamodb_prefixes
+    :return:
+        process exit code
+    """
+    regions = regions or enabled_regions()
+    results = run_fanout(regions, cust_gw_ids, tgw_ids, max_workers,
+                         vpn_gw_ids, dynamodb_tags, dynamodb_prefixes)
+    print_results(results)
+    return 0 if all(result.ok for result in results) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--regions", nargs="+",
+        help="The regions to clean up (defaults to every enabled region)"
+    )
+    parser.add_argument(
+        "--cust_gw_id", nargs="+", default=[], help="The cust_gw_id(s)"
+    )
+    parser.add_argument(
+        "--tgw_id", nargs="+", default=[], help="The transit_gw_id(s)"
+    )
+    parser.add_argument(
+        "--vpn_gw_id", nargs="+", default=[],
+        help="The VGW id(s) to delete, with their VPN connections"
+    )
+    parser.add_argument(
+        "--max_workers", type=batch_runner.positive_int,
+        default=MAX_REGION_WORKERS,
+        help="The number of regions cleaned up concurrently"
+    )
+    parser.add_argument(
+        "--dynamodb_prefix", nargs="+",
+        help="Only delete the DynamoDB tables with one of these prefixes"
+    )
+    parser.add_argument(
+        "--dynamodb_tag", nargs="+", metavar="KEY[=VALUE]",
+        help="Only delete the DynamoDB tables with all of these tags"
+    )
+    args = parser.parse_args()
+    try:
+        sys.exit(main(args.regions, args.cust_gw_id, args.tgw_id,
+                      args.max_workers, args.vpn_gw_id,
+                      s3_bucket_index.parse_tags(args.dynamodb_tag),
+                      args.dynamodb_prefix))
+    except KeyboardInterrupt:
+        exit(0)
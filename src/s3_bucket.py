@@ -6,13 +6,15 @@ that were created as part of the account creation pipeline such as S3 bucket.
 
 # Standard Packages
 import logging
-import os
 import sys
 
 # Third party packages
-import boto3
 from botocore.exceptions import ClientError
 
+# Local imports
+import s3_bucket_index
+import s3_purge
+
 # Sets up logging
 logger = logging.getLogger("root")
 FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
@@ -21,56 +23,47 @@ LOGGER = logging.getLogger("root")
 LOGGER.setLevel(logging.DEBUG)
 
 
-def delete_s3_bucket():
+def delete_s3_bucket(regions=None, tags=None, prefixes=None):
     """ Delete S3 bucket that had been created via account creation pipeline
-    
-    """
+    Only the buckets of the given regions, tags and name prefixes are
+    emptied and deleted, concurrently, by the s3_purge engine.
 
-    # Create boto3 client session
-    session = boto3.Session(
-        # aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        # aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-        # aws_session_token=os.environ['AWS_SESSION_TOKEN'],
-        profile_name=os.environ['AWS_PROFILE'],
-        region_name=aws_region
-    )
-    # Any clients created from this session will use credentials
-    # from the [profile_name] section of ~/.aws/credentials.
-    s3_client = session.client('s3')
-    s3 = session.resource('s3')
+    :args:
+        regions, tags ({key: value}), prefixes
+    """
 
     # List the bucket(s)
-    s3_buckets = s3_client.list_buckets()['Buckets']
-    LOGGER.info(f"List of buckets ==> {s3_buckets}")
     try:
-        if s3_buckets != []:
-            for bucket in s3_buckets:
-                s3_bucket = s3.Bucket(bucket['Name'])
-
-                # Delete all object versions
-                s3_bucket.object_versions.all().delete()
-                
-                # Delete S3 bucket
-                s3_client.delete_bucket(
-                    Bucket=bucket['Name']
-                )
-                LOGGER.info(f"Deleting the ==> {bucket['Name']}")
-        else:                
-            LOGGER.info(f"The S3 bucket(s) doesn't exists.")
-         
+        index = s3_bucket_index.get_index()
     except ClientError as error:
         LOGGER.error(error)
-    
-   
-def main():
+        return
+    s3_buckets = index.select(regions, tags, prefixes)
+    LOGGER.info(f"List of buckets ==> {s3_buckets}")
+    if s3_buckets != []:
+        # Delete all object versions and the S3 bucket(s)
+        results = s3_purge.purge_buckets(
+            [bucket.name for bucket in s3_buckets],
+            {bucket.name: bucket.region for bucket in s3_buckets},
+        )
+        for stats in results:
+            if stats.bucket_deleted:
+                index.discard(stats.bucket)
+    else:
+        LOGGER.info(f"The S3 bucket(s) doesn't exists.")
+
+
+def main(regions=None, tags=None, prefixes=None):
     """ A main function
 
+    :args:
+        regions, tags, prefixes
     """
-    delete_s3_bucket()
+    delete_s3_bucket(regions, tags, prefixes)
 
 
 if __name__ == "__main__":
     try:
-        main()
+        main(sys.argv[1:] or None)
     except KeyboardInterrupt:
-        exit(0)
\ No newline at end of file
+        exit(0)
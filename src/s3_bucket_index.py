@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""Region and ownership index of the S3 buckets of the account.
+list_buckets is global, so the region and the tags of every bucket are
+looked up concurrently with get_bucket_location and get_bucket_tagging.
+The index is built once and cached for the whole run, and the buckets are
+filtered by region, tag or name prefix before any object is listed, so the
+purge only touches the buckets it has to, through a client of their own
+region.
+"""
+
+# Standard Packages
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party packages
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_session
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# get_bucket_location returns no constraint for us-east-1 and the
+# legacy "EU" one for eu-west-1
+LEGACY_LOCATIONS = {None: "us-east-1", "": "us-east-1", "EU": "eu-west-1"}
+
+_LOCK = threading.Lock()
+_INDEX = None
+
+
+class BucketInfo(object):
+    """Name, region and tags of a bucket.
+    """
+
+    __slots__ = ("name", "region", "tags")
+
+    def __init__(self, name, region=None, tags=None):
+        self.name = name
+        self.region = region
+        self.tags = tags or {}
+
+    def matches(self, regions=None, tags=None, prefixes=None):
+        """Whether the bucket passes every given filter.
+
+        :args:
+            regions, tags ({key: value}, a None value matches any value),
+            prefixes
+        :return:
+            bool
+        """
+        if regions and self.region not in regions:
+            return False
+        if prefixes and not self.name.startswith(tuple(prefixes)):
+            return False
+        for key, value in (tags or {}).items():
+            if key not in self.tags or \
+                    value is not None and self.tags[key] != value:
+                return False
+        return True
+
+    def __repr__(self):
+        return f"BucketInfo({self.name}, {self.region})"
+
+
+def bucket_region(s3_client, bucket):
+    """The region of the bucket, None if it can't be looked up.
+
+    :args:
+        s3_client, bucket
+    """
+    try:
+        location = s3_client.get_bucket_location(
+            Bucket=bucket
+        ).get('LocationConstraint')
+    except ClientError as error:
+        LOGGER.error(f"Unable to locate the {bucket}: {error}")
+        return None
+    return LEGACY_LOCATIONS.get(location, location)
+
+
+def bucket_tags(s3_client, bucket):
+    """The tags of the bucket as a dict.
+
+    :args:
+        s3_client, bucket
+    """
+    try:
+        tag_set = s3_client.get_bucket_tagging(Bucket=bucket)['TagSet']
+    except ClientError as error:
+        if error.response['Error']['Code'] != "NoSuchTagSet":
+            LOGGER.error(f"Unable to get the tags of the {bucket}: {error}")
+        return {}
+    return {tag['Key']: tag['Value'] for tag in tag_set}
+
+
+class BucketIndex(object):
+    """The buckets of the account with their region and tags.
+    """
+
+    def __init__(self, buckets):
+        self._buckets = {bucket.name: bucket for bucket in buckets}
+
+    @classmethod
+    def build(cls, max_workers=None):
+        """List the buckets and look their region and tags up concurrently.
+
+        :args:
+            max_workers (defaults to the client pool size)
+        :return:
+            BucketIndex
+        """
+        s3_client = aws_session.get_client('s3')
+        names = [bucket['Name']
+                 for bucket in s3_client.list_buckets()['Buckets']]
+        if not names:
+            return cls([])
+
+        def lookup(name):
+            return BucketInfo(
+                name,
+                bucket_region(s3_client, name),
+                bucket_tags(s3_client, name),
+            )
+
+        max_workers = max_workers or aws_session.max_pool_connections()
+        with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(names))) as executor:
+            index = cls(executor.map(lookup, names))
+        LOGGER.info(f"Indexed {len(names)} bucket(s)")
+        return index
+
+    def get(self, name):
+        return self._buckets.get(name)
+
+    def select(self, regions=None, tags=None, prefixes=None):
+        """The buckets that pass every given filter.
+
+        :args:
+            regions, tags, prefixes
+        :return:
+            list of BucketInfo, sorted by name
+        """
+        return sorted(
+            (bucket for bucket in self._buckets.values()
+             if bucket.matches(regions, tags, prefixes)),
+            key=lambda bucket: bucket.name,
+        )
+
+    def discard(self, name):
+        """Drop a bucket from the index, i.e. after it's been deleted.
+
+        :args:
+            name
+        """
+        self._buckets.pop(name, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def get_index(max_workers=None):
+    """Return the bucket index, building it on first use.
+
+    :args:
+        max_workers
+    :return:
+        BucketIndex
+    """
+    global _INDEX
+    with _LOCK:
+        if _INDEX is None:
+            _INDEX = BucketIndex.build(max_workers)
+        return _INDEX
+
+
+def drop_index():
+    """Forget the bucket index.
+    """
+    global _INDEX
+    with _LOCK:
+        _INDEX = None
+
+
+def parse_tags(tags):
+    """Parse "KEY=VALUE" (or "KEY" for any value) command line tags.
+
+    :args:
+        tags
+    :return:
+        dict
+    """
+    parsed = {}
+    for tag in tags or ():
+        key, sep, value = tag.partition("=")
+        parsed[key] = value if sep else None
+    return parsed
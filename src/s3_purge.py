@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""Parallel purge engine for the S3 buckets.
+The object versions and delete markers of a bucket are streamed page by page
+with list_object_versions, and every page is sent as a DeleteObjects batch
+of up to 1000 keys from a thread pool while the listing goes on. Keys from
+the per-key error list are retried with backoff, incomplete multipart
+uploads are aborted and several buckets are purged concurrently. Progress
+is reported as objects per second.
+"""
+
+# Standard Packages
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Third party packages
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_session
+import aws_waiters
+import teardown_metrics
+import teardown_tracing
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# DeleteObjects takes at most 1000 keys per request
+MAX_KEYS_PER_REQUEST = 1000
+
+# Default number of buckets purged concurrently
+MAX_BUCKET_WORKERS = 4
+
+# Number of times a key from the error list is retried
+MAX_KEY_RETRIES = 5
+
+# Per-key error codes worth retrying
+RETRYABLE_CODES = (
+    "SlowDown",
+    "InternalError",
+    "ServiceUnavailable",
+    "RequestTimeout",
+    "OperationAborted",
+)
+
+# Listing passes over a bucket, a pass only lists what the previous
+# passes missed while the keys were deleted underneath the listing
+MAX_PASSES = 3
+
+# Seconds between two progress reports of a bucket
+PROGRESS_INTERVAL = 10
+
+
+class PurgeStats(object):
+    """Progress of the purge of one bucket.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.deleted = 0
+        self.failed = 0
+        self.uploads_aborted = 0
+        self.bucket_deleted = False
+        self.error = None
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self._lock = threading.Lock()
+        self._reported = self.started
+
+    def add(self, deleted=0, failed=0, uploads_aborted=0):
+        with self._lock:
+            self.deleted += deleted
+            self.failed += failed
+            self.uploads_aborted += uploads_aborted
+            now = time.monotonic()
+            if now - self._reported < PROGRESS_INTERVAL:
+                return
+            self._reported = now
+        LOGGER.info(f"Purging {self.bucket}: {self.deleted} objects deleted, "
+                    f"{self.rate:.0f} objects/s")
+
+    @property
+    def rate(self):
+        elapsed = (self.duration or time.monotonic() - self.started)
+        return self.deleted / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return f"PurgeStats({self.bucket}, deleted={self.deleted})"
+
+
+def iter_version_batches(s3_client, bucket):
+    """Stream the object versions and delete markers of the bucket in
+    DeleteObjects sized batches.
+
+    :args:
+        s3_client, bucket
+    :return:
+        generator of lists of {'Key', 'VersionId'}
+    """
+    paginator = s3_client.get_paginator('list_object_versions')
+    batch = []
+    for page in paginator.paginate(
+            Bucket=bucket,
+            PaginationConfig={"PageSize": MAX_KEYS_PER_REQUEST}):
+        for item in page.get('Versions', []) + page.get('DeleteMarkers', []):
+            batch.append({"Key": item['Key'], "VersionId": item['VersionId']})
+            if len(batch) == MAX_KEYS_PER_REQUEST:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def delete_batch(s3_client, bucket, objects, stats):
+    """Delete a batch of object versions and retry the keys that failed
+    with a retryable error code.
+
+    :args:
+        s3_client, bucket, objects, stats
+    """
+    delays = aws_waiters.backoff_delays()
+    for attempt in range(MAX_KEY_RETRIES + 1):
+        errors = s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": objects, "Quiet": True},
+        ).get('Errors', [])
+        retry = [
+            {"Key": error['Key'], "VersionId": error['VersionId']}
+            for error in errors
+            if error.get('Code') in RETRYABLE_CODES
+            and attempt < MAX_KEY_RETRIES
+        ]
+        failed = len(errors) - len(retry)
+        for error in errors:
+            if error.get('Code') not in RETRYABLE_CODES:
+                LOGGER.error(f"Unable to delete {error['Key']} from {bucket}: "
+                             f"{error.get('Code')} {error.get('Message')}")
+        stats.add(deleted=len(objects) - len(errors), failed=failed)
+        if not retry:
+            return
+        LOGGER.info(f"Retrying {len(retry)} key(s) of {bucket}...")
+        objects = retry
+        teardown_metrics.sleep(next(delays), "s3_key_retry")
+
+
+def abort_multipart_uploads(s3_client, bucket, executor, stats):
+    """Abort the incomplete multipart uploads of the bucket.
+
+    :args:
+        s3_client, bucket, executor, stats
+    """
+    paginator = s3_client.get_paginator('list_multipart_uploads')
+    futures = []
+    for page in paginator.paginate(Bucket=bucket):
+        for upload in page.get('Uploads', []):
+            futures.append(executor.submit(
+                s3_client.abort_multipart_upload,
+                Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId'],
+            ))
+    for future in futures:
+        future.result()
+    stats.add(uploads_aborted=len(futures))
+
+
+def _purge_pass(s3_client, bucket, executor, max_in_flight, stats):
+    # One listing pass, returns the number of batches sent
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    futures = []
+    batches = 0
+    for objects in iter_version_batches(s3_client, bucket):
+        in_flight.acquire()
+        future = executor.submit(
+            delete_batch, s3_client, bucket, objects, stats
+        )
+        future.add_done_callback(lambda _: in_flight.release())
+        futures.append(future)
+        batches += 1
+        # Keep only the pending futures around
+        if len(futures) > max_in_flight * 4:
+            pending = []
+            for future in futures:
+                if future.done():
+                    future.result()
+                else:
+                    pending.append(future)
+            futures = pending
+    for future in wait(futures).done:
+        future.result()
+    return batches
+
+
+def purge_bucket(s3_client, bucket, executor, max_in_flight,
+                 delete_bucket=True):
+    """Empty the bucket and delete it.
+    The listing thread never runs more than max_in_flight batches ahead of
+    the delete workers, so the memory use stays flat on huge buckets. The
+    bucket is listed again until a pass finds nothing left (MAX_PASSES).
+
+    :args:
+        s3_client, bucket, executor (delete workers), max_in_flight,
+        delete_bucket
+    :return:
+        PurgeStats
+    """
+    stats = PurgeStats(bucket)
+    try:
+        abort_multipart_uploads(s3_client, bucket, executor, stats)
+        for _ in range(MAX_PASSES):
+            if not _purge_pass(s3_client, bucket, executor, max_in_flight,
+                               stats):
+                break
+
+        if stats.failed:
+            raise RuntimeError(f"{stats.failed} object(s) couldn't be deleted")
+        if delete_bucket:
+            s3_client.delete_bucket(Bucket=bucket)
+            stats.bucket_deleted = True
+            LOGGER.info(f"Deleting the ==> {bucket}")
+    except (ClientError, RuntimeError) as error:
+        LOGGER.error(f"Unable to purge the {bucket}: {error}")
+        stats.error = str(error)
+    stats.duration = time.monotonic() - stats.started
+    LOGGER.info(f"Purged {stats.bucket}: {stats.deleted} objects in "
+                f"{stats.duration:.1f}s ({stats.rate:.0f} objects/s)")
+    return stats
+
+
+def purge_buckets(buckets, bucket_regions=None, max_workers=None,
+                  max_buckets=MAX_BUCKET_WORKERS, delete_buckets=True):
+    """Purge several buckets concurrently, sharing one pool of delete
+    workers. Every bucket goes through a client of its own region, so
+    the requests are never redirected across regions.
+
+    :args:
+        buckets, bucket_regions ({bucket: region}), max_workers (delete
+        workers, defaults to the client pool size), max_buckets,
+        delete_buckets
+    :return:
+        list of PurgeStats, in the order of the buckets
+    """
+    buckets = list(buckets)
+    if not buckets:
+        return []
+    bucket_regions = bucket_regions or {}
+    max_workers = max_workers or aws_session.max_pool_connections()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as delete_executor, \
+            ThreadPoolExecutor(
+                max_workers=min(max_buckets, len(buckets))) as executor:
+        results = list(executor.map(
+            teardown_tracing.bind(lambda bucket: purge_bucket(
+                aws_session.get_client('s3', bucket_regions.get(bucket)),
+                bucket, delete_executor, max_workers * 2,
+                delete_buckets,
+            )),
+            buckets,
+        ))
+    elapsed = time.monotonic() - started
+    deleted = sum(stats.deleted for stats in results)
+    rate = deleted / elapsed if elapsed > 0 else 0.0
+    LOGGER.info(f"Purged {len(buckets)} bucket(s): {deleted} objects in "
+                f"{elapsed:.1f}s ({rate:.0f} objects/s)")
+    return results
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""Start-up time of the CLI.
+main.py only imports what parsing the command line needs, every step
+imports its modules (and the AWS SDK, see aws_session) when it runs, so the
+start-up is measured from main.py to the first teardown step and checked
+against STARTUP_BUDGET.
+With --profile_imports (or TEARDOWN_PROFILE_IMPORTS=1) every first import
+of a module is timed too, and the slowest ones are written to stderr when
+the process exits, i.e. to find what a new import costs. main.py imports
+this module first, so the clock and the import profile start before its
+other imports.
+"""
+
+# Standard Packages
+import atexit
+import builtins
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import time
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Seconds from main.py to the first teardown step
+STARTUP_BUDGET = float(os.environ.get("TEARDOWN_STARTUP_BUDGET", "0.25"))
+
+# Modules in the import report
+REPORT_LIMIT = int(os.environ.get("TEARDOWN_PROFILE_IMPORTS_LIMIT", "25"))
+
+STARTED = time.perf_counter()
+
+
+class ImportProfile(object):
+    """Times the first import of every module, through builtins.__import__.
+    The self time of a module excludes the modules it imports.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.started = time.perf_counter()
+        self._import = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def install(self):
+        if self._import is None:
+            self._import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(),
+                      level=0):
+        try:
+            module = name if level == 0 else importlib.util.resolve_name(
+                "." * level + name, (globals or {}).get("__package__"))
+        except (ImportError, ValueError):
+            module = name
+        if module in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        # Time spent in the nested imports, for the self time
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                if module not in self.timings:
+                    self.timings[module] = (elapsed - nested, elapsed)
+
+    def report(self, stream=None, limit=REPORT_LIMIT):
+        """Write the slowest imports, by cumulative time, to the stream.
+
+        :args:
+            stream (defaults to stderr), limit
+        """
+        stream = stream or sys.stderr
+        with self._lock:
+            timings = sorted(self.timings.items(),
+                             key=lambda item: item[1][1], reverse=True)
+        stream.write(f"{len(timings)} module(s) imported in "
+                     f"{sum(own for own, _ in self.timings.values()):.3f}s "
+                     f"({time.perf_counter() - self.started:.3f}s since "
+                     f"the profile started)\n")
+        stream.write(f"{'self ms':>9} {'cumulative ms':>14}  module\n")
+        for module, (own, cumulative) in timings[:limit]:
+            stream.write(f"{own * 1000:9.1f} {cumulative * 1000:14.1f}  "
+                         f"{module}\n")
+
+
+_PROFILE = None
+
+
+def profile_imports():
+    """Time the imports from now on and report them at the exit.
+    Idempotent.
+
+    :return:
+        ImportProfile
+    """
+    global _PROFILE
+    if _PROFILE is None:
+        _PROFILE = ImportProfile()
+        _PROFILE.install()
+        atexit.register(_PROFILE.report)
+    return _PROFILE
+
+
+def requested(argv):
+    """Whether the import profile is asked for. Checked when this module is
+    imported, before the arguments are parsed, so that the imports of
+    main.py are profiled too.
+
+    :args:
+        argv
+    :return:
+        bool
+    """
+    return "--profile_imports" in argv or \
+        os.environ.get("TEARDOWN_PROFILE_IMPORTS", "") not in ("", "0")
+
+
+def first_step(name, metrics=None):
+    """Record the start-up time when the first step starts, warn when it is
+    over STARTUP_BUDGET.
+
+    :args:
+        name (of the first step), metrics (teardown_metrics.Metrics)
+    :return:
+        seconds since main.py started
+    """
+    seconds = time.perf_counter() - STARTED
+    if metrics is not None:
+        metrics.record_phase("startup", name, seconds, "done")
+    if seconds > STARTUP_BUDGET:
+        LOGGER.warning(f"The start-up took {seconds:.3f}s, over the "
+                       f"{STARTUP_BUDGET}s budget, see --profile_imports")
+    else:
+        LOGGER.debug(f"Started up in {seconds:.3f}s")
+    return seconds
+
+
+if requested(sys.argv[1:]):
+    profile_imports()
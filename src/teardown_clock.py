@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""The clock the waits of the teardown go through.
+The polling loops (aws_waiters), the S3 key retries (s3_purge), the rate
+limiter and the phase timers of teardown_metrics read the time and sleep
+through get_clock() instead of the time module, so a VirtualClock can be
+swapped in: time then only moves when somebody sleeps, and the real wait
+logic runs in no time, i.e. in teardown_simulator or when timing the
+teardown offline. The retries of botocore itself (standard retry mode)
+still sleep on the real time.
+"""
+
+# Standard Packages
+import threading
+import time
+
+
+class SystemClock(object):
+    """The real time.
+    """
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class VirtualClock(object):
+    """A clock that only moves on sleep() or advance(). The sleeps of all
+    the threads add up, as if they ran one after another.
+
+    :args:
+        start (monotonic seconds), epoch (Unix time at start)
+    """
+
+    def __init__(self, start=0.0, epoch=None):
+        self._now = float(start)
+        self._epoch = time.time() if epoch is None else epoch
+        self._start = self._now
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self._now
+
+    def time(self):
+        return self._epoch + self._now - self._start
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += max(0.0, seconds)
+
+
+_CLOCK = SystemClock()
+
+
+def get_clock():
+    """The clock of the process, the SystemClock unless set_clock() was
+    called.
+    """
+    return _CLOCK
+
+
+def set_clock(clock):
+    """Swap the clock of the process.
+
+    :args:
+        clock
+    :return:
+        the previous clock
+    """
+    global _CLOCK
+    previous, _CLOCK = _CLOCK, clock
+    return previous
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""Checkpoint journal of the teardown, kept in a local SQLite file.
+Every completed (or failed) step and every deleted resource id is recorded
+as the run goes. A run started with --resume reads the journal back, skips
+the completed steps, doesn't load the resources already deleted and goes on
+from the failed step, so a retry doesn't sit through the finished work
+again. Without --resume the journal is started afresh.
+"""
+
+# Standard Packages
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Local imports
+import teardown_metrics
+import teardown_tracing
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Default journal file
+JOURNAL_PATH = os.environ.get("TEARDOWN_JOURNAL", "teardown_journal.sqlite")
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS steps (
+        run_key TEXT NOT NULL,
+        step TEXT NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        updated REAL NOT NULL,
+        PRIMARY KEY (run_key, step)
+    )""",
+    """CREATE TABLE IF NOT EXISTS resources (
+        run_key TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        resource_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        updated REAL NOT NULL,
+        PRIMARY KEY (run_key, kind, resource_id)
+    )""",
+)
+
+_LOCK = threading.Lock()
+
+
+def vpc_key(vpc_id, aws_region):
+    return f"vpc:{aws_region}:{vpc_id}"
+
+
+def region_key(aws_region):
+    return f"region:{aws_region}"
+
+
+ACCOUNT_KEY = "account"
+
+
+class NullJournal(object):
+    """A journal that records nothing, i.e. for the --plan runs.
+    """
+
+    resume = False
+
+    def step_done(self, run_key, step):
+        return False
+
+    def completed_steps(self, run_key):
+        return set()
+
+    def mark_step(self, run_key, step, status, error=None):
+        pass
+
+    def deleted_resources(self, run_key, kind):
+        return set()
+
+    def resources(self, run_key, kind, status):
+        return set()
+
+    def mark_resource(self, run_key, kind, resource_id, status="deleted"):
+        pass
+
+    def close(self):
+        pass
+
+
+class Journal(NullJournal):
+    """The SQLite journal, shared by all the worker threads.
+
+    :args:
+        path, resume (keep the records of the previous run)
+    """
+
+    def __init__(self, path=JOURNAL_PATH, resume=False):
+        self.path = path
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+            if not resume:
+                self._db.execute("DELETE FROM steps")
+                self._db.execute("DELETE FROM resources")
+        if resume:
+            LOGGER.info(f"Resuming from the journal {path}")
+
+    def step_done(self, run_key, step):
+        return step in self.completed_steps(run_key)
+
+    def completed_steps(self, run_key):
+        """The steps of the run completed so far.
+
+        :args:
+            run_key
+        :return:
+            set of step names
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT step FROM steps WHERE run_key = ? AND status = 'done'",
+                (run_key,),
+            ).fetchall()
+        return {step for step, in rows}
+
+    def mark_step(self, run_key, step, status, error=None):
+        """Record the outcome of a step, "done" or "failed".
+
+        :args:
+            run_key, step, status, error
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?)",
+                (run_key, step, status, error, time.time()),
+            )
+
+    def deleted_resources(self, run_key, kind):
+        """The ids of the resources of the kind deleted so far.
+
+        :args:
+            run_key, kind
+        :return:
+            set of resource ids
+        """
+        return self.resources(run_key, kind, "deleted")
+
+    def resources(self, run_key, kind, status):
+        """The ids of the resources of the kind recorded with the status.
+
+        :args:
+            run_key, kind, status
+        :return:
+            set of resource ids
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT resource_id FROM resources "
+                "WHERE run_key = ? AND kind = ? AND status = ?",
+                (run_key, kind, status),
+            ).fetchall()
+        return {resource_id for resource_id, in rows}
+
+    def mark_resource(self, run_key, kind, resource_id, status="deleted"):
+        """Record the state of a resource.
+
+        :args:
+            run_key, kind, resource_id, status
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)",
+                (run_key, kind, resource_id, status, time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_JOURNAL = NullJournal()
+
+
+def configure(path=JOURNAL_PATH, resume=False):
+    """Open the journal of the run.
+
+    :args:
+        path, resume
+    :return:
+        Journal
+    """
+    global _JOURNAL
+    with _LOCK:
+        _JOURNAL.close()
+        _JOURNAL = Journal(path, resume)
+        return _JOURNAL
+
+
+def get_journal():
+    """The journal of the run, a NullJournal until configure() is called.
+    """
+    return _JOURNAL
+
+
+def run_step(run_key, step, func, *args, **kwargs):
+    """Run a step unless the journal has it as completed, and record it.
+    The step is timed by teardown_metrics and traced by teardown_tracing.
+
+    :args:
+        run_key, step, func, func args
+    :return:
+        True if the step ran, False if it was skipped
+    """
+    journal = get_journal()
+    if journal.step_done(run_key, step):
+        LOGGER.info(f"Skipping the completed step {step} of {run_key}")
+        return False
+    try:
+        with teardown_tracing.span(step, run=run_key), \
+                teardown_metrics.phase(run_key, step):
+            func(*args, **kwargs)
+    except BaseException as error:
+        journal.mark_step(run_key, step, "failed", repr(error))
+        raise
+    journal.mark_step(run_key, step, "done")
+    return True
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+"""Timing and API call metrics of the teardown run.
+    1. Every client built by aws_session reports its calls through the
+       botocore events: calls, errors, retries and throttles per operation,
+       and a latency histogram per operation.
+    2. Every step (module main() and VPC phase) is timed by phase().
+    3. The polling backoffs and the S3 key retries sleep through sleep(),
+       so the time spent waiting is known per reason. The botocore retry
+       delays don't, they only show up in the API call latency.
+With --metrics_dir the run writes a JSON summary and a Prometheus textfile
+(node_exporter textfile collector format) at the end.
+"""
+
+# Standard Packages
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Local imports
+import aws_rate_limiter
+import teardown_clock
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Upper bounds (in seconds) of the API latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+SUMMARY_FILE = "teardown_metrics.json"
+TEXTFILE = "teardown.prom"
+
+PREFIX = "vpc_teardown"
+
+
+class Histogram(object):
+    """Cumulative histogram, the Prometheus way.
+
+    :args:
+        buckets (upper bounds)
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": {str(bound): count
+                        for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class Metrics(object):
+    """The metrics of the run, shared by all the worker threads.
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._clock = time.monotonic()
+            self.calls = {}
+            self.errors = {}
+            self.retries = {}
+            self.throttles = {}
+            self.latency = {}
+            self.phases = {}
+            self.waits = {}
+
+    def _count(self, counter, key, value=1):
+        counter[key] = counter.get(key, 0) + value
+
+    def record_call(self, service, operation, seconds, retries=0,
+                    error=None):
+        """Record a finished API call, its retries included.
+
+        :args:
+            service, operation, seconds, retries, error (error code)
+        """
+        key = (service, operation)
+        with self._lock:
+            self._count(self.calls, key)
+            self._count(self.retries, key, retries)
+            if error:
+                self._count(self.errors, key + (error,))
+            if key not in self.latency:
+                self.latency[key] = Histogram()
+            self.latency[key].observe(seconds)
+
+    def record_throttle(self, service, operation):
+        with self._lock:
+            self._count(self.throttles, (service, operation))
+
+    def record_phase(self, run_key, phase, seconds, status):
+        with self._lock:
+            self.phases[(run_key, phase)] = {
+                "seconds": round(seconds, 3), "status": status,
+            }
+
+    def record_wait(self, reason, seconds):
+        with self._lock:
+            count, total = self.waits.get(reason, (0, 0.0))
+            self.waits[reason] = (count + 1, total + seconds)
+
+    def attach(self, client):
+        """Hook the metrics into the client's events:
+            before-call - start the call timer
+            needs-retry - count the throttle responses
+            after-call  - record the call, its retries and error code
+
+        :args:
+            client
+        """
+        service = client.meta.service_model.service_name
+
+        def before_call(context=None, **kwargs):
+            if context is not None:
+                context["teardown_metrics_started"] = time.monotonic()
+
+        def needs_retry(response=None, event_name=None, **kwargs):
+            if response is not None and response[1].get(
+                    "Error", {}).get("Code") in \
+                    aws_rate_limiter.THROTTLE_CODES:
+                self.record_throttle(service, event_name.rsplit(".", 1)[-1])
+            return None
+
+        def after_call(parsed=None, model=None, context=None, **kwargs):
+            started = (context or {}).get("teardown_metrics_started")
+            if started is None:
+                return
+            parsed = parsed or {}
+            self.record_call(
+                service, model.name, time.monotonic() - started,
+                retries=parsed.get("ResponseMetadata", {}).get(
+                    "RetryAttempts", 0),
+                error=parsed.get("Error", {}).get("Code"),
+            )
+
+        events = client.meta.events
+        events.register(f"before-call.{service}", before_call)
+        events.register_first(f"needs-retry.{service}", needs_retry)
+        events.register(f"after-call.{service}", after_call)
+
+    def summary(self):
+        """The metrics as a JSON serializable dict.
+        """
+        with self._lock:
+            operations = {}
+            for (service, operation), calls in sorted(self.calls.items()):
+                key = (service, operation)
+                operations[f"{service}.{operation}"] = {
+                    "calls": calls,
+                    "retries": self.retries.get(key, 0),
+                    "throttles": self.throttles.get(key, 0),
+                    "errors": {
+                        code: count
+                        for (svc, op, code), count in self.errors.items()
+                        if (svc, op) == key
+                    },
+                    "latency_seconds": self.latency[key].to_dict(),
+                }
+            phases = [
+                dict(run=run_key, phase=phase, **values)
+                for (run_key, phase), values in sorted(self.phases.items())
+            ]
+            waits = {
+                reason: {"count": count, "seconds": round(total, 3)}
+                for reason, (count, total) in sorted(self.waits.items())
+            }
+        return {
+            "labels": dict(self.labels),
+            "started": self.started,
+            "duration_seconds": round(time.monotonic() - self._clock, 3),
+            "api_calls": sum(values["calls"]
+                             for values in operations.values()),
+            "operations": operations,
+            "phases": phases,
+            "waits": waits,
+            "wait_seconds": round(sum(values["seconds"]
+                                      for values in waits.values()), 3),
+            "rate_limiter": aws_rate_limiter.get_limiter().report(),
+        }
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format.
+
+        :return:
+            text
+        """
+        summary = self.summary()
+        common = summary["labels"]
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{PREFIX}_{name}{suffix}"
+                             f"{_labels(dict(common, **labels))} {value}")
+
+        metric("duration_seconds", "gauge", "Wall-clock time of the run.",
+               [("", {}, summary["duration_seconds"])])
+        metric("last_run_timestamp_seconds", "gauge",
+               "Start time of the run.", [("", {}, summary["started"])])
+
+        operations = sorted(summary["operations"].items())
+        for name, field, help_text in (
+                ("api_calls_total", "calls", "API calls per operation."),
+                ("api_retries_total", "retries",
+                 "Retried attempts per operation."),
+                ("api_throttles_total", "throttles",
+                 "Throttled attempts per operation.")):
+            metric(name, "counter", help_text, [
+                ("", {"operation": operation}, values[field])
+                for operation, values in operations
+            ])
+        metric("api_errors_total", "counter",
+               "Failed API calls per operation and error code.", [
+                   ("", {"operation": operation, "code": code}, count)
+                   for operation, values in operations
+                   for code, count in sorted(values["errors"].items())
+               ])
+
+        samples = []
+        for operation, values in operations:
+            histogram = values["latency_seconds"]
+            for bound, count in histogram["buckets"].items():
+                samples.append(("_bucket",
+                                {"operation": operation, "le": bound}, count))
+            samples.append(("_bucket", {"operation": operation, "le": "+Inf"},
+                            histogram["count"]))
+            samples.append(("_sum", {"operation": operation},
+                            histogram["sum"]))
+            samples.append(("_count", {"operation": operation},
+                            histogram["count"]))
+        metric("api_latency_seconds", "histogram",
+               "API call latency, retries included.", samples)
+
+        metric("phase_duration_seconds", "gauge",
+               "Wall-clock time of every teardown step.", [
+                   ("", {"run": phase["run"], "phase": phase["phase"],
+                         "status": phase["status"]}, phase["seconds"])
+                   for phase in summary["phases"]
+               ])
+        metric("wait_seconds_total", "counter",
+               "Time spent sleeping, per reason.", [
+                   ("", {"reason": reason}, values["seconds"])
+                   for reason, values in summary["waits"].items()
+               ])
+        metric("rate_limiter_queued_seconds_total", "counter",
+               "Time spent waiting for a rate limiter token.", [
+                   ("", {"family": family},
+                    round(values["queued_seconds"], 3))
+                   for family, values in sorted(
+                       summary["rate_limiter"].items())
+               ])
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory):
+        """Write the JSON summary and the Prometheus textfile.
+
+        :args:
+            directory
+        :return:
+            (summary path, textfile path)
+        """
+        os.makedirs(directory, exist_ok=True)
+        summary_path = os.path.join(directory, SUMMARY_FILE)
+        textfile_path = os.path.join(directory, TEXTFILE)
+        _write_atomic(summary_path,
+                      json.dumps(self.summary(), indent=2) + "\n")
+        _write_atomic(textfile_path, self.prometheus())
+        LOGGER.info(f"Wrote the metrics to {summary_path} and "
+                    f"{textfile_path}")
+        return summary_path, textfile_path
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n")
+        for value in labels.values()
+    )
+    return "{" + ",".join(
+        f'{key}="{value}"' for key, value in zip(labels, escaped)
+    ) + "}"
+
+
+def _write_atomic(path, text):
+    # The textfile collector must never read a half written file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as out:
+        out.write(text)
+    os.replace(temp_path, path)
+
+
+_METRICS = Metrics()
+
+
+def get_metrics():
+    """The metrics shared by every client and step of the process.
+    """
+    return _METRICS
+
+
+def reset():
+    """Start the metrics afresh, i.e. between two benchmark rounds.
+    The clients already hooked in keep recording into the shared object.
+    """
+    _METRICS.reset()
+
+
+@contextlib.contextmanager
+def phase(run_key, name):
+    """Time a teardown step, failed or not.
+
+    :args:
+        run_key (i.e. a teardown_journal key), name
+    """
+    clock = teardown_clock.get_clock()
+    started = clock.monotonic()
+    status = "failed"
+    try:
+        yield
+        status = "done"
+    finally:
+        _METRICS.record_phase(run_key, name, clock.monotonic() - started,
+                              status)
+
+
+def timed(run_key, name, func):
+    """Wrap the function into a phase() timer.
+
+    :args:
+        run_key, name, func
+    :return:
+        function
+    """
+    def wrapper(*args, **kwargs):
+        with phase(run_key, name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def sleep(seconds, reason):
+    """Sleep on the teardown_clock and record the time spent waiting.
+
+    :args:
+        seconds, reason (i.e. the resource type waited for)
+    """
+    if seconds <= 0:
+        return
+    teardown_clock.get_clock().sleep(seconds)
+    _METRICS.record_wait(reason, seconds)
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+
+"""Dry-run planning of a teardown.
+Everything main.py would touch is discovered with read-only describe/list
+calls and nothing is changed. The plan is a JSON document that lists, per
+VPC, the resources of every teardown phase, the dependency order of the
+phases, the expected number of API calls and the expected wall-clock time
+(the critical path of the phase graph), followed by the region and account
+wide cleanup. Many plans can be reviewed without running any teardown.
+"""
+
+# Standard Packages
+import datetime
+import json
+import logging
+import math
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party packages
+from botocore.exceptions import ClientError
+
+# Local imports
+import aws_session
+import ec2_customer_gw
+import ec2_dynamodb
+import ec2_nat_gateways
+import ec2_network_interfaces
+import ec2_transit_gw
+import ec2_vpc_peering
+import ec2_security_groups
+import ec2_vpc
+import region_fanout
+import s3_bucket_index
+import vpc_inventory
+from teardown_scheduler import Phase, critical_path, topological_order
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+PLAN_VERSION = 1
+
+# Average latency of a control-plane call (in seconds)
+API_CALL_SECONDS = 0.2
+
+# Average time between two state polls (in seconds)
+POLL_SECONDS = 10
+
+# Typical time (in seconds) a resource takes to reach the waited-for state
+EXPECTED_WAITS = {
+    "nat_gateway": 60,
+    "network_interface": 10,
+    "vpc_peering_connection": 5,
+    "vpc_endpoint": 30,
+    "vpn_connection": 120,
+    "vpn_gateway_attachment": 60,
+    "transit_gateway_attachment": 120,
+    "transit_gateway": 120,
+    "customer_gateway": 5,
+    "route_table_association": 2,
+    "subnet": 2,
+    "dynamodb_table": 30,
+}
+
+
+def estimate(resources, calls_per_resource=1, wait=None, fixed_calls=0):
+    """Expected API calls and seconds of a step that handles its resources
+    one after another, waiting for every one of them.
+
+    :args:
+        resources (ids), calls_per_resource, wait (EXPECTED_WAITS key),
+        fixed_calls
+    :return:
+        dict with the resources, api_calls and estimated_seconds
+    """
+    resources = sorted(resources)
+    wait_seconds = EXPECTED_WAITS.get(wait, 0)
+    polls = int(math.ceil(wait_seconds / POLL_SECONDS)) if wait else 0
+    calls_each = calls_per_resource + polls
+    api_calls = fixed_calls + len(resources) * calls_each
+    seconds = api_calls * API_CALL_SECONDS + len(resources) * wait_seconds
+    return OrderedDict((
+        ("resources", resources),
+        ("api_calls", api_calls),
+        ("estimated_seconds", round(seconds, 1)),
+    ))
+
+
+def _ids(records):
+    return [record.resource_id for record in records]
+
+
+def _estimate_concurrent(resources, calls_per_resource=1, wait=None):
+    # The resources are handled at once and polled together, so the step
+    # takes about one wait whatever their number
+    plan = estimate(resources, calls_per_resource)
+    if not resources:
+        return plan
+    wait_seconds = EXPECTED_WAITS.get(wait, 0)
+    polls = int(math.ceil(wait_seconds / POLL_SECONDS)) if wait else 0
+    plan["api_calls"] += polls
+    plan["estimated_seconds"] = round(
+        (calls_per_resource + polls) * API_CALL_SECONDS + wait_seconds, 1
+    )
+    return plan
+
+
+def _estimate_nat_gateways(inventory):
+    return _estimate_concurrent(
+        _ids(nat for nat in inventory.items("nat_gateways")
+             if nat.state != "deleted"),
+        wait="nat_gateway",
+    )
+
+
+def _estimate_elastic_ips(inventory):
+    # The EIPs of the NAT gateways are disassociated by their deletion
+    nat_allocations = {allocation_id
+                       for nat in inventory.items("nat_gateways")
+                       if nat.state not in ec2_nat_gateways.GONE_STATES
+                       for allocation_id in nat.allocation_ids}
+    eips = ec2_nat_gateways.vpc_addresses(inventory)
+    plan = _estimate_concurrent(_ids(eips))
+    plan["api_calls"] += sum(eip.association_id is not None and
+                             eip.resource_id not in nat_allocations
+                             for eip in eips)
+    return plan
+
+
+def _estimate_network_interfaces(inventory):
+    # Concurrent detach and delete, every poll is one batched describe
+    nat_enis = {eni_id for nat in inventory.items("nat_gateways")
+                for eni_id in nat.network_interface_ids}
+    enis, _ = ec2_network_interfaces.classify(
+        eni for eni in inventory.items("network_interfaces")
+        if eni.resource_id not in nat_enis
+    )
+    plan = estimate(_ids(enis))
+    if not enis:
+        return plan
+    attached = [eni for eni in enis if eni.attachment_id is not None]
+    batches = int(math.ceil(
+        len(enis) / ec2_network_interfaces.MAX_IDS_PER_CALL
+    ))
+    polls = batches * int(math.ceil(
+        EXPECTED_WAITS["network_interface"] / POLL_SECONDS
+    ))
+    plan["api_calls"] = len(attached) + len(enis) + polls
+    plan["estimated_seconds"] = round(
+        (bool(attached) + 1 + polls) * API_CALL_SECONDS
+        + EXPECTED_WAITS["network_interface"], 1
+    )
+    return plan
+
+
+def _estimate_vpc_peering(inventory):
+    # Concurrent deletes, every poll is one batched describe
+    plan = _estimate_concurrent(
+        _ids(inventory.items("vpc_peering_connections")),
+        wait="vpc_peering_connection",
+    )
+    peerings = len(plan["resources"])
+    if peerings > ec2_vpc_peering.MAX_IDS_PER_CALL:
+        batches = int(math.ceil(peerings / ec2_vpc_peering.MAX_IDS_PER_CALL))
+        plan["api_calls"] += (batches - 1) * int(math.ceil(
+            EXPECTED_WAITS["vpc_peering_connection"] / POLL_SECONDS
+        ))
+    return plan
+
+
+def _estimate_security_group_rules(inventory):
+    revokes = ec2_security_groups.blocking_rules(
+        inventory.items("security_groups")
+    )
+    plan = estimate(_ids(sg for sg, _, _ in revokes))
+    plan["api_calls"] = sum(bool(ingress) + bool(egress)
+                            for _, ingress, egress in revokes)
+    plan["estimated_seconds"] = round(
+        plan["api_calls"] * API_CALL_SECONDS, 1
+    )
+    return plan
+
+
+def _estimate_vpn_gateways(inventory):
+    # The connections, then the VGWs, each at once with batched polls
+    connections = _estimate_concurrent(
+        _ids(vpn for vpn in inventory.items("vpn_connections")
+             if vpn.state not in ("deleting", "deleted")),
+        wait="vpn_connection",
+    )
+    gateways = _estimate_concurrent(_ids(inventory.items("vpn_gateways")),
+                                    wait="vpn_gateway_attachment")
+    gateways["resources"] = sorted(connections["resources"] +
+                                   gateways["resources"])
+    gateways["api_calls"] += connections["api_calls"]
+    gateways["estimated_seconds"] += connections["estimated_seconds"]
+    return gateways
+
+
+def _estimate_tgw_attachments(inventory):
+    # A describe and a propagations lookup, then at worst a disassociation
+    # and a deletion per attachment, every poll is one batched describe
+    plan = _estimate_concurrent(
+        _ids(inventory.items("transit_gateway_vpc_attachments")),
+        calls_per_resource=3, wait="transit_gateway_attachment",
+    )
+    if plan["resources"]:
+        plan["api_calls"] += 1
+    return plan
+
+
+def _estimate_route_table_associations(inventory):
+    return estimate(
+        [association_id
+         for route_table in inventory.items("route_tables")
+         for association_id, main, _ in route_table.associations
+         if not main],
+        wait="route_table_association",
+    )
+
+
+def _estimate_route_tables(inventory):
+    route_tables = [
+        route_table for route_table in inventory.items("route_tables")
+        if not any(main for _, main, _ in route_table.associations)
+    ]
+    plan = estimate(_ids(route_tables))
+    routes = sum(origin == "CreateRoute"
+                 for route_table in route_tables
+                 for _, origin in route_table.routes)
+    plan["api_calls"] += routes
+    plan["estimated_seconds"] = round(
+        plan["api_calls"] * API_CALL_SECONDS, 1
+    )
+    return plan
+
+
+# Expected work of every phase of ec2_vpc.VPC_PHASES
+PHASE_ESTIMATES = {
+    "dhcp_options":
+        lambda inventory: estimate([], fixed_calls=1),
+    "nat_gateways": _estimate_nat_gateways,
+    "vpc_endpoints":
+        lambda inventory: _estimate_concurrent(
+            _ids(inventory.items("vpc_endpoints")), wait="vpc_endpoint"),
+    "vpc_peering": _estimate_vpc_peering,
+    "vpn_gateways": _estimate_vpn_gateways,
+    "tgw_attachments": _estimate_tgw_attachments,
+    "security_group_rules": _estimate_security_group_rules,
+    "route_table_associations": _estimate_route_table_associations,
+    "elastic_ips": _estimate_elastic_ips,
+    "network_interfaces": _estimate_network_interfaces,
+    "internet_gateways":
+        lambda inventory: estimate(
+            _ids(inventory.items("internet_gateways")), calls_per_resource=2
+        ),
+    "security_groups":
+        lambda inventory: estimate(_ids(ec2_security_groups.custom_groups(
+            inventory.items("security_groups")
+        ))),
+    "subnets":
+        lambda inventory: estimate(_ids(inventory.items("subnets")),
+                                   wait="subnet"),
+    "network_acls":
+        lambda inventory: estimate(_ids(
+            nacl for nacl in inventory.items("network_acls")
+            if not nacl.is_default
+        )),
+    "route_tables": _estimate_route_tables,
+    "vpc":
+        lambda inventory: estimate([inventory.vpc_id]),
+}
+
+
+def _discovery_calls(inventory):
+    # One call per page of every resource kind
+    return sum(
+        max(1, int(math.ceil(len(inventory.items(kind)) / 1000)))
+        for kind in vpc_inventory.KINDS
+    )
+
+
+def _vpc_resources(inventory, kind):
+    # The addresses are discovered region wide, only the vpc's ones are
+    # released
+    if kind == "addresses":
+        return ec2_nat_gateways.vpc_addresses(inventory)
+    return inventory.items(kind)
+
+
+def plan_vpc(vpc_id, aws_region, max_workers=None):
+    """Plan the teardown of one vpc, read-only.
+
+    :args:
+        vpc_id, aws_region, max_workers
+    :return:
+        dict
+    """
+    plan = OrderedDict((("vpc_id", vpc_id), ("region", aws_region)))
+    ec2_client = aws_session.get_client('ec2', aws_region)
+    try:
+        ec2_client.describe_vpcs(VpcIds=[vpc_id])
+    except ClientError as error:
+        plan["error"] = str(error)
+        return plan
+
+    inventory = vpc_inventory.get_inventory(vpc_id, aws_region, max_workers)
+    inventory.wait_loaded()
+    plan["blockers"] = _ids(
+        instance for instance in inventory.items("instances")
+        if instance.state in ("running", "stopped")
+    )
+    plan["resources"] = OrderedDict(
+        (kind, _ids(items)) for kind, items in (
+            (kind, _vpc_resources(inventory, kind))
+            for kind in vpc_inventory.KINDS
+        ) if items
+    )
+
+    phases = [Phase(name, None, requires)
+              for name, _, requires in ec2_vpc.VPC_PHASES]
+    plan["order"] = topological_order(phases)
+    plan["phases"] = []
+    durations = {}
+    for name, _, requires in ec2_vpc.VPC_PHASES:
+        phase = OrderedDict((("name", name), ("requires", list(requires))))
+        phase.update(PHASE_ESTIMATES[name](inventory))
+        durations[name] = phase["estimated_seconds"]
+        plan["phases"].append(phase)
+    seconds, path = critical_path(phases, durations)
+    plan["critical_path"] = path
+    plan["api_calls"] = _discovery_calls(inventory) + sum(
+        phase["api_calls"] for phase in plan["phases"]
+    )
+    plan["estimated_seconds"] = round(
+        seconds + len(vpc_inventory.KINDS) * API_CALL_SECONDS, 1
+    )
+    return plan
+
+
+def plan_region(aws_region, cust_gw_ids=(), tgw_ids=(), vpn_gw_ids=(),
+                dynamodb_tags=None, dynamodb_prefixes=None):
+    """Plan the region wide cleanup (see region_fanout), read-only.
+
+    :args:
+        aws_region, cust_gw_ids, tgw_ids, vpn_gw_ids, dynamodb_tags,
+        dynamodb_prefixes
+    :return:
+        dict
+    """
+    ec2_client = aws_session.get_client('ec2', aws_region)
+    dynamodb_client = aws_session.get_client('dynamodb', aws_region)
+    steps = OrderedDict()
+
+    # The connections of the VGWs are gone with the vpc phase by then, the
+    # step lists them and the VGWs, and deletes the VGWs at once
+    steps["vpn_conns_gw"] = _estimate_concurrent(sorted(vpn_gw_ids))
+    if vpn_gw_ids:
+        steps["vpn_conns_gw"]["api_calls"] += 2
+    # The customer gateways of the deleted VPN connections are only known
+    # once they're deleted, the plan has the ones given on the command line
+    steps["customer_gw"] = _estimate_concurrent(
+        sorted(cust_gw_id for cust_gw_id, state in
+               ec2_customer_gw.describe_customer_gateways(
+                   ec2_client, cust_gw_ids).items()
+               if state == "available"),
+        wait="customer_gateway",
+    )
+    if cust_gw_ids:
+        steps["customer_gw"]["api_calls"] += 2
+    steps["transit_gw"] = _estimate_concurrent(
+        sorted(tgw_id for tgw_id, tgw in
+               ec2_transit_gw.describe_transit_gateways(ec2_client,
+                                                        tgw_ids).items()
+               if tgw["State"] == "available"),
+        wait="transit_gateway",
+    )
+    if tgw_ids:
+        steps["transit_gw"]["api_calls"] += 1
+    tables = [
+        table_name for table_name in ec2_dynamodb.iter_table_names(
+            dynamodb_client, dynamodb_prefixes)
+        if not dynamodb_tags or ec2_dynamodb.has_tags(
+            dynamodb_client, dynamodb_client.describe_table(
+                TableName=table_name)['Table']['TableArn'], dynamodb_tags)
+    ]
+    steps["dynamodb"] = estimate(tables, calls_per_resource=3,
+                                 fixed_calls=1)
+    if tables:
+        steps["dynamodb"]["estimated_seconds"] += \
+            EXPECTED_WAITS["dynamodb_table"]
+
+    plan = OrderedDict((("region", aws_region), ("steps", steps)))
+    plan["api_calls"] = sum(step["api_calls"] for step in steps.values())
+    plan["estimated_seconds"] = round(
+        sum(step["estimated_seconds"] for step in steps.values()), 1
+    )
+    return plan
+
+
+def plan_account(regions, tags=None, prefixes=None):
+    """Plan the S3 cleanup of the regions, read-only.
+
+    :args:
+        regions, tags, prefixes
+    :return:
+        dict
+    """
+    index = s3_bucket_index.get_index()
+    buckets = index.select(regions, tags, prefixes)
+    plan = OrderedDict((
+        ("buckets", [
+            OrderedDict((("name", bucket.name), ("region", bucket.region)))
+            for bucket in buckets
+        ]),
+        # Objects aren't counted, that would mean listing every bucket
+        ("api_calls", 1 + 2 * len(index) + 3 * len(buckets)),
+    ))
+    plan["estimated_seconds"] = round(plan["api_calls"] * API_CALL_SECONDS, 1)
+    return plan
+
+
+def build_plan(vpcs, regions, cust_gw_ids=(), tgw_ids=(), tags=None,
+               prefixes=None, account=True, max_workers=None, max_jobs=1,
+               dynamodb_tags=None, dynamodb_prefixes=None):
+    """Plan the whole run of main.py without changing anything.
+
+    :args:
+        vpcs (list of (vpc_id, aws_region)), regions, cust_gw_ids, tgw_ids
+        (lists, or dicts keyed by region), tags, prefixes, account
+        (whether the S3 cleanup runs), max_workers, max_jobs,
+        dynamodb_tags, dynamodb_prefixes
+    :return:
+        dict
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_jobs)) as executor:
+        vpc_plans = list(executor.map(
+            lambda vpc: plan_vpc(vpc[0], vpc[1], max_workers), vpcs
+        ))
+    # The region step deletes the VGWs the vpc phases detach
+    vpn_gw_ids = {}
+    for vpc in vpc_plans:
+        vpn_gw_ids.setdefault(vpc["region"], []).extend(
+            vpc.get("resources", {}).get("vpn_gateways", [])
+        )
+    regions = sorted(regions)
+    with ThreadPoolExecutor(
+            max_workers=max(1, min(region_fanout.MAX_REGION_WORKERS,
+                                   len(regions)))) as executor:
+        region_plans = list(executor.map(
+            lambda aws_region: plan_region(
+                aws_region,
+                region_fanout.region_ids(cust_gw_ids, aws_region),
+                region_fanout.region_ids(tgw_ids, aws_region),
+                vpn_gw_ids.get(aws_region, ()),
+                dynamodb_tags, dynamodb_prefixes,
+            ),
+            regions,
+        ))
+    account_plan = plan_account(regions, tags, prefixes) if account else None
+
+    plan = OrderedDict((
+        ("version", PLAN_VERSION),
+        ("generated_at", datetime.datetime.now(
+            datetime.timezone.utc).isoformat()),
+        ("vpcs", vpc_plans),
+        ("regions", region_plans),
+        ("account", account_plan),
+    ))
+    steps = vpc_plans + region_plans + ([account_plan] if account else [])
+    plan["api_calls"] = sum(step.get("api_calls", 0) for step in steps)
+    # The vpcs run max_jobs at a time, the regions all at once, then S3
+    vpc_seconds = sorted((vpc.get("estimated_seconds", 0)
+                          for vpc in vpc_plans), reverse=True)
+    plan["estimated_seconds"] = round(
+        sum(vpc_seconds[::max(1, max_jobs)])
+        + max([region["estimated_seconds"] for region in region_plans]
+              or [0])
+        + (account_plan["estimated_seconds"] if account else 0), 1
+    )
+    return plan
+
+
+def write_plan(plan, path="-"):
+    """Write the plan as JSON to the file, '-' means stdout.
+
+    :args:
+        plan, path
+    """
+    if path == "-":
+        json.dump(plan, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    with open(path, "w") as stream:
+        json.dump(plan, stream, indent=2)
+        stream.write("\n")
+    LOGGER.info(f"The teardown plan is written to {path}")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""Dependency graph scheduler for the teardown phases.
+Every phase is a node with the names of the phases it depends on,
+e.g. "ENIs gone before subnets" or "IGW detached before VPC delete".
+The scheduler runs every ready phase on a bounded worker pool, so the total
+wall-clock time follows the critical path instead of the sum of all phases.
+"""
+
+# Standard Packages
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Local imports
+import teardown_tracing
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Default size of the worker pool
+MAX_WORKERS = int(os.environ.get("TEARDOWN_MAX_WORKERS", "8"))
+
+
+class Phase(object):
+    """A single teardown phase (node of the dependency graph).
+
+    :args:
+        name, func, requires (names of the phases to run first)
+    """
+
+    def __init__(self, name, func, requires=()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+
+    def __repr__(self):
+        return f"Phase({self.name!r}, requires={self.requires!r})"
+
+
+def topological_order(phases):
+    """Validate the graph and return the phase names in dependency order.
+
+    :args:
+        phases
+    :return:
+        list of phase names
+    """
+    by_name = {phase.name: phase for phase in phases}
+    if len(by_name) != len(phases):
+        raise ValueError("Duplicate phase names in the teardown graph")
+    for phase in phases:
+        for dep in phase.requires:
+            if dep not in by_name:
+                raise ValueError(
+                    f"Phase {phase.name} depends on unknown phase {dep}"
+                )
+
+    order, done = [], set()
+    pending = [phase.name for phase in phases]
+    while pending:
+        ready = [name for name in pending
+                 if all(dep in done for dep in by_name[name].requires)]
+        if not ready:
+            raise ValueError(f"Dependency cycle between phases: {pending}")
+        for name in ready:
+            order.append(name)
+            done.add(name)
+        pending = [name for name in pending if name not in done]
+    return order
+
+
+def critical_path(phases, durations):
+    """The longest chain of dependent phases, i.e. the wall-clock time of
+    the teardown with enough workers.
+
+    :args:
+        phases, durations ({phase name: seconds})
+    :return:
+        (total seconds, list of phase names along the path)
+    """
+    by_name = {phase.name: phase for phase in phases}
+    finish, previous = {}, {}
+    for name in topological_order(phases):
+        start = 0.0
+        for dep in by_name[name].requires:
+            if finish[dep] > start:
+                start, previous[name] = finish[dep], dep
+        finish[name] = start + durations.get(name, 0.0)
+    if not finish:
+        return 0.0, []
+    name = max(finish, key=lambda name: finish[name])
+    total, path = finish[name], [name]
+    while path[-1] in previous:
+        path.append(previous[path[-1]])
+    return total, path[::-1]
+
+
+def run_phases(phases, max_workers=None, completed=(), on_finished=None):
+    """Run the phases as soon as their dependencies are done.
+    If a phase fails no new phases are started, the running ones are
+    allowed to finish and the first error is raised again.
+
+    :args:
+        phases, max_workers, completed (names of the phases already done,
+        i.e. by a previous run), on_finished (called with the phase name
+        and the error, None on success)
+    """
+    topological_order(phases)
+    max_workers = max_workers or MAX_WORKERS
+    by_name = {phase.name: phase for phase in phases}
+    done = set(completed) & set(by_name)
+    pending = {phase.name for phase in phases} - done
+    for name in sorted(done):
+        LOGGER.info(f"Skipping the completed phase ==> {name}")
+    running = {}
+    failure = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if failure is None:
+                for name in sorted(pending):
+                    if all(dep in done for dep in by_name[name].requires):
+                        LOGGER.info(f"Starting phase ==> {name}")
+                        running[executor.submit(teardown_tracing.bind(
+                            by_name[name].func))] = name
+                        pending.discard(name)
+            if not running:
+                break
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    LOGGER.error(f"Phase {name} failed: {error!r}")
+                    if failure is None:
+                        failure = error
+                else:
+                    LOGGER.info(f"Finished phase ==> {name}")
+                    done.add(name)
+                if on_finished is not None:
+                    on_finished(name, error)
+
+    if failure is not None:
+        raise failure
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+"""Discrete-event simulation of a VPC teardown.
+The resources of a teardown plan (see teardown_plan, --plan) are replayed
+against latency distributions per resource type instead of AWS:
+    1. Every resource of a phase costs its API calls and, for the waited
+       for types, a wait_until() run on a VirtualClock, so the real polling
+       backoff and timeouts apply to the sampled state change time.
+    2. The phases run on max_workers workers as soon as the phases they
+       depend on (ec2_vpc.VPC_PHASES) are done, driven by an event queue.
+Many runs give the distribution of the total duration and the critical
+path that most often decides it, in milliseconds of CPU time.
+"""
+
+# Standard Packages
+import argparse
+import heapq
+import json
+import logging
+import math
+import random
+import sys
+import time
+from collections import Counter, OrderedDict
+
+# Local imports
+import aws_waiters
+import ec2_vpc
+import teardown_clock
+import teardown_plan
+from aws_waiters import WaitTimeoutError
+from teardown_scheduler import MAX_WORKERS
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Log-normal latency of every resource type: (median seconds, sigma), the
+# medians after the plan estimates
+LATENCIES = dict(
+    {wait: (seconds, 0.6)
+     for wait, seconds in teardown_plan.EXPECTED_WAITS.items()},
+    api_call=(teardown_plan.API_CALL_SECONDS, 0.5),
+)
+
+# The wait_until() resource type of the waited for resources, by id prefix
+WAITS = (
+    ("nat-", "nat_gateway"),
+    ("eni-", "network_interface"),
+    ("pcx-", "vpc_peering_connection"),
+    ("vpce-", "vpc_endpoint"),
+    ("vpn-", "vpn_connection"),
+    ("vgw-", "vpn_gateway_attachment"),
+    ("tgw-attach-", "transit_gateway_attachment"),
+    ("rtbassoc-", "route_table_association"),
+    ("subnet-", "subnet"),
+)
+
+# How every phase handles its resources:
+# (API calls per resource, waits for them, resources run concurrently)
+PHASE_MODELS = {
+    "dhcp_options": (1, False, False),
+    "nat_gateways": (1, True, True),
+    "vpc_endpoints": (1, True, True),
+    "vpc_peering": (1, True, True),
+    "vpn_gateways": (1, True, True),
+    "tgw_attachments": (1, True, True),
+    "security_group_rules": (1, False, True),
+    "route_table_associations": (1, True, False),
+    "elastic_ips": (1, False, True),
+    "network_interfaces": (1, True, True),
+    "internet_gateways": (2, False, False),
+    "security_groups": (1, False, True),
+    "subnets": (1, True, False),
+    "network_acls": (1, False, False),
+    "route_tables": (1, False, False),
+    "vpc": (1, False, False),
+}
+
+PERCENTILES = (50, 90, 99)
+
+
+def wait_type(resource_id):
+    for prefix, resource_type in WAITS:
+        if resource_id.startswith(prefix):
+            return resource_type
+    return None
+
+
+class Simulator(object):
+    """Samples the phase durations and runs the phase graph.
+
+    :args:
+        latencies ({resource type: (median, sigma)}), max_workers, seed
+    """
+
+    def __init__(self, latencies=None, max_workers=None, seed=None):
+        self.latencies = dict(LATENCIES, **(latencies or {}))
+        self.max_workers = max_workers or MAX_WORKERS
+        self.random = random.Random(seed)
+        self.clock = teardown_clock.VirtualClock()
+
+    def sample(self, resource_type):
+        median, sigma = self.latencies.get(resource_type, (0.0, 0.0))
+        if median <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(median), sigma)
+
+    def wait(self, resource_type):
+        """Run wait_until() on the virtual clock against a state change
+        that takes a sampled time, every poll costing an API call.
+
+        :return:
+            (seconds, polls)
+        """
+        clock = self.clock
+        ready = clock.monotonic() + self.sample(resource_type)
+        polls = []
+
+        def predicate():
+            polls.append(1)
+            clock.sleep(self.sample("api_call"))
+            return clock.monotonic() >= ready
+
+        started = clock.monotonic()
+        try:
+            aws_waiters.wait_until(predicate, resource_type, resource_type)
+        except WaitTimeoutError:
+            pass
+        return clock.monotonic() - started, len(polls)
+
+    def phase_duration(self, name, resources):
+        """Sample the duration and the API calls of a phase.
+
+        :args:
+            name, resources (ids)
+        :return:
+            (seconds, api calls)
+        """
+        calls, waits, concurrent = PHASE_MODELS.get(name, (1, False, False))
+        durations, api_calls = [], 0
+        # A phase without resources still makes its fixed call, if any
+        for resource_id in resources or ([None] if name == "dhcp_options"
+                                         else []):
+            seconds = sum(self.sample("api_call") for _ in range(calls))
+            api_calls += calls
+            resource_type = waits and resource_id and wait_type(resource_id)
+            if resource_type:
+                waited, polls = self.wait(resource_type)
+                seconds += waited
+                api_calls += polls
+            durations.append(seconds)
+        return _makespan(durations,
+                         self.max_workers if concurrent else 1), api_calls
+
+    def run(self, plan_vpc):
+        """Simulate one teardown of the vpc plan.
+
+        :args:
+            plan_vpc (a "vpcs" item of the plan)
+        :return:
+            (total seconds, critical path, {phase: seconds}, api calls)
+        """
+        resources = {phase["name"]: phase.get("resources", [])
+                     for phase in plan_vpc.get("phases", [])}
+        requires = {name: set(deps) for name, _, deps in ec2_vpc.VPC_PHASES}
+        pending = dict((name, set(deps)) for name, deps in requires.items())
+        running, finish, durations = [], {}, {}
+        api_calls = 0
+        now = 0.0
+        while pending or running:
+            ready = sorted(name for name, deps in pending.items()
+                           if not deps)
+            for name in ready:
+                if len(running) >= self.max_workers:
+                    break
+                seconds, calls = self.phase_duration(name,
+                                                     resources.get(name))
+                durations[name] = seconds
+                api_calls += calls
+                heapq.heappush(running, (now + seconds, name))
+                del pending[name]
+            now, name = heapq.heappop(running)
+            finish[name] = now
+            for deps in pending.values():
+                deps.discard(name)
+
+        # Walk back from the last phase along the dependency that finished
+        # last, i.e. the one that held the phase up
+        path = [max(finish, key=lambda name: finish[name])]
+        while requires[path[-1]]:
+            path.append(max(requires[path[-1]],
+                            key=lambda name: finish[name]))
+        return now, path[::-1], durations, api_calls
+
+    def simulate(self, plan_vpc, runs=1000):
+        """Run the teardown of the vpc plan many times.
+
+        :args:
+            plan_vpc, runs
+        :return:
+            dict
+        """
+        cpu_started = time.process_time()
+        totals, paths, calls = [], Counter(), []
+        phase_seconds = Counter()
+        for _ in range(runs):
+            total, path, durations, api_calls = self.run(plan_vpc)
+            totals.append(total)
+            paths[tuple(path)] += 1
+            calls.append(api_calls)
+            phase_seconds.update(durations)
+        totals.sort()
+        path, count = paths.most_common(1)[0]
+        result = OrderedDict((
+            ("vpc_id", plan_vpc.get("vpc_id")),
+            ("runs", runs),
+            ("planned_seconds", plan_vpc.get("estimated_seconds")),
+            ("mean_seconds", round(sum(totals) / runs, 1)),
+        ))
+        for percentile in PERCENTILES:
+            result[f"p{percentile}_seconds"] = round(
+                _percentile(totals, percentile), 1
+            )
+        result["max_seconds"] = round(totals[-1], 1)
+        result["mean_api_calls"] = round(sum(calls) / runs, 1)
+        result["critical_path"] = list(path)
+        result["critical_path_share"] = round(count / runs, 3)
+        result["phase_mean_seconds"] = OrderedDict(
+            (name, round(phase_seconds[name] / runs, 1))
+            for name, _, _ in ec2_vpc.VPC_PHASES
+        )
+        result["cpu_ms"] = round((time.process_time() - cpu_started) * 1000)
+        return result
+
+
+def _makespan(durations, workers):
+    # Greedy list scheduling of the durations on the workers
+    if not durations:
+        return 0.0
+    if workers <= 1:
+        return sum(durations)
+    free = [0.0] * min(workers, len(durations))
+    for seconds in durations:
+        heapq.heapreplace(free, free[0] + seconds)
+    return max(free)
+
+
+def _percentile(values, percentile):
+    # Nearest-rank percentile of sorted values
+    index = max(0, int(math.ceil(percentile / 100 * len(values))) - 1)
+    return values[index]
+
+
+def simulate_plan(plan, runs=1000, latencies=None, max_workers=None,
+                  seed=None):
+    """Simulate every vpc of the plan, on a VirtualClock.
+
+    :args:
+        plan (teardown_plan.build_plan() document), runs, latencies,
+        max_workers, seed
+    :return:
+        list of dict
+    """
+    simulator = Simulator(latencies, max_workers, seed)
+    # The backoff jitter of wait_until() comes from the random module
+    random.seed(seed)
+    previous = teardown_clock.set_clock(simulator.clock)
+    level = LOGGER.level
+    # Every simulated wait would log its outcome
+    LOGGER.setLevel(logging.WARNING)
+    try:
+        return [simulator.simulate(plan_vpc, runs)
+                for plan_vpc in plan.get("vpcs", [])
+                if "phases" in plan_vpc]
+    finally:
+        LOGGER.setLevel(level)
+        teardown_clock.set_clock(previous)
+
+
+def print_results(results, stream=None):
+    """Print the simulated durations of every vpc.
+
+    :args:
+        results, stream (defaults to stdout)
+    """
+    stream = stream or sys.stdout
+    for result in results:
+        stream.write(
+            f"\n{result['vpc_id']}: {result['runs']} runs in "
+            f"{result['cpu_ms']}ms of CPU time\n"
+            f"  planned {result['planned_seconds']}s, mean "
+            f"{result['mean_seconds']}s, "
+            + ", ".join(f"p{percentile} "
+                        f"{result[f'p{percentile}_seconds']}s"
+                        for percentile in PERCENTILES)
+            + f", max {result['max_seconds']}s\n"
+            f"  critical path ({result['critical_path_share']:.0%} of the "
+            f"runs): {' -> '.join(result['critical_path'])}\n"
+        )
+        for name, seconds in result["phase_mean_seconds"].items():
+            stream.write(f"    {name:<26} {seconds:>8.1f}s\n")
+
+
+def parse_latencies(path):
+    """Read the latencies from a JSON file, {"nat_gateway": [60, 0.6]}.
+
+    :args:
+        path
+    :return:
+        {resource type: (median, sigma)}
+    """
+    with open(path) as latencies:
+        return {resource_type: tuple(value)
+                for resource_type, value in json.load(latencies).items()}
+
+
+def main(argv):
+    """Simulate the plan file given on the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description="Simulate the teardown of a plan written by --plan"
+    )
+    parser.add_argument("plan", help="The plan JSON file, '-' for stdin")
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max_workers", type=int, default=MAX_WORKERS)
+    parser.add_argument(
+        "--latencies", metavar="FILE",
+        help="JSON file of {resource type: [median seconds, sigma]}"
+    )
+    parser.add_argument("--output", metavar="FILE",
+                        help="Also write the results as JSON to the FILE")
+    args = parser.parse_args(argv)
+
+    if args.plan == "-":
+        plan = json.load(sys.stdin)
+    else:
+        with open(args.plan) as plan_file:
+            plan = json.load(plan_file)
+    latencies = parse_latencies(args.latencies) if args.latencies else None
+    results = simulate_plan(plan, args.runs, latencies, args.max_workers,
+                            args.seed)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv[1:])
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+"""Lightweight tracing of the teardown, exported as OTLP JSON.
+main.py opens the root span of the run and every VPC, region, step and
+phase opens a child span. Every delete/mutate API call of the clients built
+by aws_session and every wait_until() poll loop get a child span too, with
+the resource id, region and outcome as attributes. So a slow teardown shows
+which resource took the time and what it held up.
+The spans are kept in memory and written to a local file in the OTLP JSON
+format (as sent to /v1/traces), which the OpenTelemetry trace viewers load
+without a live collector. Tracing is off until configure() is called.
+"""
+
+# Standard Packages
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Local imports
+import aws_rate_limiter
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+SERVICE_NAME = "aws-delete-vpc"
+
+# OTLP span kind and status codes
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Request parameters naming the resource of an API call, besides the
+# ones ending in "Id" (or "Ids")
+RESOURCE_PARAMS = ("TableName", "BackupArn", "Bucket", "ResourceArn")
+
+
+def _now():
+    # Unix time in nanoseconds
+    return int(time.time() * 1e9)
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+class Span(object):
+    """A timed operation of the trace.
+
+    :args:
+        name, trace_id, parent_id, attributes, kind
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None,
+                 kind=KIND_INTERNAL):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start = _now()
+        self.end = None
+        self.status = STATUS_OK
+        self.message = ""
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = STATUS_ERROR
+        self.message = repr(error)
+        self.attributes["outcome"] = "error"
+
+    def finish(self):
+        self.end = _now()
+        self.attributes.setdefault("outcome", "ok")
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end or _now()),
+            "attributes": _attributes(self.attributes),
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.message:
+            span["status"]["message"] = self.message
+        return span
+
+
+class NullSpan(object):
+    """What the callers get while tracing is off.
+    """
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, error):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    """Collects the spans of the run. The current span is kept per thread,
+    bind() carries it over to the worker pools.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_id = _new_id(16)
+        self.root = None
+        self.spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self):
+        # Spans started by a thread the context wasn't bound to hang off
+        # the root span, so they still end up in the trace of the run
+        return getattr(self._local, "span", None) or self.root
+
+    def start(self, name, attributes=None, kind=KIND_INTERNAL, parent=None):
+        parent = parent or self.current()
+        span = Span(name, self.trace_id,
+                    parent.span_id if parent is not None else None,
+                    attributes, kind)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """Run the block in a child span of the current one.
+
+        :args:
+            name, attributes
+        """
+        if not self.enabled:
+            yield NULL_SPAN
+            return
+        span = self.start(name, attributes)
+        previous = getattr(self._local, "span", None)
+        self._local.span = span
+        if self.root is None:
+            self.root = span
+        try:
+            yield span
+        except BaseException as error:
+            span.set_error(error)
+            raise
+        finally:
+            span.finish()
+            self._local.span = previous
+
+    def bind(self, func):
+        """Make the function run in the current span, whatever the thread.
+
+        :args:
+            func
+        :return:
+            function
+        """
+        if not self.enabled:
+            return func
+        parent = self.current()
+
+        def wrapper(*args, **kwargs):
+            previous = getattr(self._local, "span", None)
+            self._local.span = parent
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.span = previous
+        return wrapper
+
+    def attach(self, client):
+        """Hook the tracer into the client's events, a span per delete or
+        mutate call (the describe calls would only add noise):
+            before-parameter-build - start the span, with the resource id
+                                     of the call parameters
+            after-call             - finish it with the error code
+            after-call-error       - finish it with the exception
+
+        :args:
+            client
+        """
+        service = client.meta.service_model.service_name
+        aws_region = client.meta.region_name
+
+        def before_build(params=None, model=None, context=None, **kwargs):
+            if not self.enabled or context is None or \
+                    aws_rate_limiter.action_family(model.name) == "describe":
+                return
+            attributes = {"service": service, "operation": model.name,
+                          "region": aws_region}
+            resource_id = _resource_id(params or {})
+            if resource_id:
+                attributes["resource_id"] = resource_id
+            context["teardown_span"] = self.start(
+                f"{service}.{model.name}", attributes, KIND_CLIENT,
+            )
+
+        def after_call(parsed=None, context=None, **kwargs):
+            span = (context or {}).pop("teardown_span", None)
+            if span is None:
+                return
+            code = (parsed or {}).get("Error", {}).get("Code")
+            if code:
+                span.status = STATUS_ERROR
+                span.message = code
+                span.set_attribute("outcome", code)
+            span.finish()
+
+        def after_call_error(exception=None, context=None, **kwargs):
+            span = (context or {}).pop("teardown_span", None)
+            if span is not None:
+                span.set_error(exception)
+                span.finish()
+
+        events = client.meta.events
+        events.register(f"before-parameter-build.{service}", before_build)
+        events.register(f"after-call.{service}", after_call)
+        events.register(f"after-call-error.{service}", after_call_error)
+
+    def to_otlp(self, resource_attributes=None):
+        """The spans as an OTLP JSON ExportTraceServiceRequest.
+
+        :args:
+            resource_attributes
+        :return:
+            dict
+        """
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        attributes = dict(resource_attributes or {})
+        attributes.setdefault("service.name", SERVICE_NAME)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _attributes(attributes)},
+                "scopeSpans": [{
+                    "scope": {"name": "teardown_tracing"},
+                    "spans": spans,
+                }],
+            }]
+        }
+
+    def write(self, path, resource_attributes=None):
+        """Write the trace to the file.
+
+        :args:
+            path, resource_attributes
+        """
+        with open(path, "w") as out:
+            json.dump(self.to_otlp(resource_attributes), out)
+            out.write("\n")
+        LOGGER.info(f"Wrote {len(self.spans)} spans of the trace "
+                    f"{self.trace_id} to {path}")
+
+
+def _attributes(attributes):
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            value = {"boolValue": value}
+        elif isinstance(value, int):
+            value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            value = {"doubleValue": value}
+        else:
+            value = {"stringValue": str(value)}
+        values.append({"key": key, "value": value})
+    return values
+
+
+def _resource_id(params):
+    # i.e. NatGatewayId, the VpcId only names the resource when alone
+    ids = []
+    for key, value in sorted(params.items()):
+        if key.endswith(("Id", "Ids")) or key in RESOURCE_PARAMS:
+            ids.append((key == "VpcId", value))
+    if not ids:
+        return None
+    value = sorted(ids, key=lambda item: item[0])[0][1]
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(item) for item in value)
+    return str(value)
+
+
+_TRACER = Tracer()
+
+
+def get_tracer():
+    """The tracer shared by every client and step of the process.
+    """
+    return _TRACER
+
+
+def configure(enabled=True):
+    """Turn the tracing on.
+
+    :args:
+        enabled
+    :return:
+        Tracer
+    """
+    _TRACER.enabled = enabled
+    return _TRACER
+
+
+def span(name, **attributes):
+    """A child span of the current span, see Tracer.span().
+    """
+    return _TRACER.span(name, **attributes)
+
+
+def bind(func):
+    """Carry the current span over to a worker thread, see Tracer.bind().
+    """
+    return _TRACER.bind(func)
+
+
+def traced(name, func, **attributes):
+    """Wrap the function into a span.
+
+    :args:
+        name, func, attributes
+    :return:
+        function
+    """
+    def wrapper(*args, **kwargs):
+        with span(name, **attributes):
+            return func(*args, **kwargs)
+    return wrapper
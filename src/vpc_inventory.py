@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+"""In-memory inventory of everything attached to a VPC.
+The inventory is built once per run with parallel, paginated describe calls
+(see aws_discovery) and is indexed by resource id and by vpc-id. Every
+resource kind is loaded in the background page by page, so a teardown phase
+only waits for the kinds it reads. The pre-flight checks and the teardown
+phases read from it instead of re-querying, and every deletion updates
+the index in place and is recorded in the teardown journal. When a run is
+resumed only the kinds still needed are loaded, without the resources the
+journal has as deleted.
+"""
+
+# Standard Packages
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+import aws_discovery
+import aws_session
+import teardown_journal
+import teardown_scheduler
+
+# Sets up logging
+logger = logging.getLogger("root")
+FORMAT = "[%(filename)s:%(lineno)s ===> %(funcName)8s()]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+LOGGER = logging.getLogger("root")
+LOGGER.setLevel(logging.DEBUG)
+
+# Resource kinds kept in the inventory and their discovery streams
+DISCOVERY = OrderedDict((
+    ("instances", aws_discovery.iter_instances),
+    ("network_interfaces", aws_discovery.iter_network_interfaces),
+    ("nat_gateways", aws_discovery.iter_nat_gateways),
+    ("addresses", aws_discovery.iter_addresses),
+    ("vpc_endpoints", aws_discovery.iter_vpc_endpoints),
+    ("security_groups", aws_discovery.iter_security_groups),
+    ("vpc_peering_connections", aws_discovery.iter_vpc_peering_connections),
+    ("vpn_gateways", aws_discovery.iter_vpn_gateways),
+    ("vpn_connections", None),
+    ("transit_gateway_vpc_attachments",
+     aws_discovery.iter_transit_gateway_vpc_attachments),
+    ("route_tables", aws_discovery.iter_route_tables),
+    ("subnets", aws_discovery.iter_subnets),
+    ("network_acls", aws_discovery.iter_network_acls),
+    ("internet_gateways", aws_discovery.iter_internet_gateways),
+))
+KINDS = tuple(DISCOVERY)
+
+_LOCK = threading.Lock()
+_BUILD_LOCKS = {}
+_INVENTORIES = {}
+
+
+class VpcInventory(object):
+    """Resources attached to a VPC, indexed by resource id and vpc-id.
+    All the methods are thread safe, so the teardown phases can share it.
+    Reading a resource kind blocks until that kind is fully loaded.
+    """
+
+    def __init__(self, vpc_id, aws_region):
+        self.vpc_id = vpc_id
+        self.aws_region = aws_region
+        self.journal_key = teardown_journal.vpc_key(vpc_id, aws_region)
+        self._lock = threading.RLock()
+        self._by_kind = {kind: OrderedDict() for kind in KINDS}
+        self._by_id = {}
+        self._by_vpc = {}
+        self._loaded = {kind: threading.Event() for kind in KINDS}
+        self._requested = set()
+        self._errors = {}
+
+    @classmethod
+    def build(cls, vpc_id, aws_region, max_workers=None, kinds=None):
+        """Start loading the resource kinds (every kind by default) in
+        parallel. Returns straight away, the readers wait for the kinds
+        they need. The kinds that aren't loaded stay empty.
+
+        :args:
+            vpc_id, aws_region, max_workers, kinds
+        :return:
+            VpcInventory
+        """
+        inventory = cls(vpc_id, aws_region)
+        for kind in KINDS:
+            inventory._loaded[kind].set()
+        inventory.load(kinds, max_workers)
+        return inventory
+
+    def load(self, kinds=None, max_workers=None):
+        """Start loading the resource kinds (every kind by default) that
+        aren't loaded or loading yet, i.e. the ones a pre-flight check
+        didn't need. Returns straight away.
+
+        :args:
+            kinds, max_workers
+        """
+        with self._lock:
+            kinds = [kind for kind in KINDS
+                     if (kinds is None or kind in kinds) and
+                     kind not in self._requested]
+            self._requested.update(kinds)
+            for kind in kinds:
+                self._loaded[kind].clear()
+        if not kinds:
+            return
+        ec2_client = aws_session.get_client('ec2', self.aws_region)
+        max_workers = max_workers or teardown_scheduler.MAX_WORKERS
+        executor = ThreadPoolExecutor(max_workers=min(max_workers,
+                                                      len(kinds)))
+        # Kinds are submitted in order, so the ENIs and VGWs start loading
+        # before the addresses and VPN connections that wait on them
+        for kind in kinds:
+            executor.submit(self._load, ec2_client, kind)
+        executor.shutdown(wait=False)
+
+    def _stream(self, ec2_client, kind):
+        if kind == "vpn_connections":
+            vpn_gw_ids = [vpn_gw.resource_id
+                          for vpn_gw in self.items("vpn_gateways")]
+            return aws_discovery.iter_vpn_connections(
+                ec2_client, vpn_gw_ids, self.vpc_id
+            )
+        return DISCOVERY[kind](ec2_client, self.vpc_id)
+
+    def _load(self, ec2_client, kind):
+        try:
+            if kind == "addresses":
+                eni_ids = {eni.resource_id
+                           for eni in self.items("network_interfaces")}
+            deleted = teardown_journal.get_journal().deleted_resources(
+                self.journal_key, kind
+            )
+            for record in self._stream(ec2_client, kind):
+                if record.resource_id in deleted:
+                    continue
+                if kind == "addresses" and \
+                        record.network_interface_id in eni_ids:
+                    record.vpc_id = self.vpc_id
+                self.add(record)
+        except Exception as error:
+            LOGGER.error(f"Unable to load the {kind} of {self.vpc_id}: "
+                         f"{error!r}")
+            self._errors[kind] = error
+        finally:
+            with self._lock:
+                self._loaded[kind].set()
+                done = all(self._loaded[name].is_set()
+                           for name in self._requested)
+        if done:
+            LOGGER.info(f"Inventory of {self.vpc_id}: {self.summary()}")
+
+    def wait_loaded(self, kind=None):
+        """Block until the kind (or every kind) is loaded.
+        Errors raised while loading are raised again here.
+
+        :args:
+            kind
+        """
+        for name in ([kind] if kind else KINDS):
+            self._loaded[name].wait()
+            if name in self._errors:
+                raise self._errors[name]
+
+    def add(self, record):
+        """Add (or replace) a resource record in the index.
+
+        :args:
+            record (aws_discovery.Record)
+        """
+        with self._lock:
+            self._discard(record.kind, record.resource_id)
+            self._by_kind[record.kind][record.resource_id] = record
+            self._by_id[record.resource_id] = record
+            self._by_vpc.setdefault(record.vpc_id, set()).add(
+                record.resource_id
+            )
+
+    def update(self, kind, resource_id, **fields):
+        """Update some fields of a resource record in place.
+
+        :args:
+            kind, resource_id, fields
+        """
+        with self._lock:
+            record = self._by_kind[kind].get(resource_id)
+            if record is None:
+                return
+            self._by_vpc.get(record.vpc_id, set()).discard(resource_id)
+            for key, value in fields.items():
+                setattr(record, key, value)
+            self._by_vpc.setdefault(record.vpc_id, set()).add(resource_id)
+
+    def _discard(self, kind, resource_id):
+        with self._lock:
+            record = self._by_kind[kind].pop(resource_id, None)
+            if record is None:
+                return False
+            self._by_id.pop(resource_id, None)
+            self._by_vpc.get(record.vpc_id, set()).discard(resource_id)
+            return True
+
+    def remove(self, kind, resource_id):
+        """Drop a resource from the index, i.e. after it's been deleted.
+
+        :args:
+            kind, resource_id
+        """
+        if self._discard(kind, resource_id):
+            teardown_journal.get_journal().mark_resource(
+                self.journal_key, kind, resource_id
+            )
+
+    def items(self, kind):
+        """A snapshot of the resources of one kind.
+
+        :args:
+            kind
+        :return:
+            list of records
+        """
+        self.wait_loaded(kind)
+        with self._lock:
+            return list(self._by_kind[kind].values())
+
+    def get(self, resource_id):
+        """Look a resource up by its id.
+
+        :args:
+            resource_id
+        :return:
+            record or None
+        """
+        self.wait_loaded()
+        with self._lock:
+            return self._by_id.get(resource_id)
+
+    def by_vpc(self, vpc_id=None):
+        """All the resources that belong to the vpc.
+
+        :args:
+            vpc_id (defaults to the inventory vpc)
+        :return:
+            list of records
+        """
+        self.wait_loaded()
+        with self._lock:
+            return [self._by_id[resource_id]
+                    for resource_id in self._by_vpc.get(
+                        vpc_id or self.vpc_id, ())]
+
+    def summary(self):
+        """Number of resources per kind.
+        """
+        with self._lock:
+            return {kind: len(items) for kind, items in self._by_kind.items()
+                    if items}
+
+
+def get_inventory(vpc_id, aws_region, max_workers=None, kinds=None):
+    """Return the inventory of the vpc, building it on first use. The
+    kinds the inventory doesn't have yet start loading.
+
+    :args:
+        vpc_id, aws_region, max_workers, kinds (every kind by default)
+    :return:
+        VpcInventory
+    """
+    key = (vpc_id, aws_region)
+    with _LOCK:
+        build_lock = _BUILD_LOCKS.setdefault(key, threading.Lock())
+    # Only the callers asking for the same vpc wait on each other
+    with build_lock:
+        if key not in _INVENTORIES:
+            _INVENTORIES[key] = VpcInventory.build(
+                vpc_id, aws_region, max_workers, kinds
+            )
+        else:
+            _INVENTORIES[key].load(kinds, max_workers)
+        return _INVENTORIES[key]
+
+
+def drop_inventory(vpc_id, aws_region):
+    """Forget the inventory of the vpc.
+
+    :args:
+        vpc_id, aws_region
+    """
+    with _LOCK:
+        _INVENTORIES.pop((vpc_id, aws_region), None)